@@ -0,0 +1,116 @@
+"""
+Startup time and per-request cost of the API-only settings (chatting.settings_api) against the default ones.
+
+    python -m benchmarks.api_profile [requests_number] [startups]
+
+Settings are global to a process, so every profile is measured in processes of its own. Startup is the wall time
+of a fresh `python` process that sets Django up, loads the WSGI handler (middleware) and the URLconf, and of the
+Django part of it (imports included), the median of `startups` (10 by default) runs. Per request, a process seeds
+10k messages in memory and sends `requests_number` (5000 by default) requests of each kind straight to Django's
+WSGIHandler, without a server: GET /topics/1/ and GET /topics/1/messages/?page_size=20 (served from the response
+cache after the first one, so mostly middleware and view overhead) and POST /topics/1/messages/.
+"""
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks.common import percentile, seed_messages, setup_django
+
+PROFILES = ('chatting.settings', 'chatting.settings_api')
+REQUESTS = (
+    ('GET', '/topics/1/', None),
+    ('GET', '/topics/1/messages/', 'page_size=20'),
+    ('POST', '/topics/1/messages/', None),
+)
+STARTUP = '''
+import time
+started = time.perf_counter()
+import django
+django.setup()
+from django.core.handlers.wsgi import WSGIHandler
+from django.urls import get_resolver
+WSGIHandler()
+get_resolver().url_patterns
+print((time.perf_counter() - started) * 1000)
+'''
+
+
+def measure_startup(profile, startups):
+    """Medians of the wall time of the process and of the Django part of it, in ms"""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=profile)
+    durations, django_durations = [], []
+    for _ in range(startups):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', STARTUP], env=env, check=True, capture_output=True,
+                                text=True).stdout
+        durations.append((time.perf_counter() - started) * 1000)
+        django_durations.append(float(output))
+    return statistics.median(durations), statistics.median(django_durations)
+
+
+def measure_requests(requests_number):
+    """Runs in the child process of a profile, prints {request: [p50 ms, p99 ms, req/s]} as JSON"""
+    setup_django()
+    from django.core.handlers.wsgi import WSGIHandler
+
+    seed_messages(10_000)
+    handler = WSGIHandler()
+
+    def request(method, path, query_string):
+        body = json.dumps({'text': 'Benchmark message'}).encode() if method == 'POST' else b''
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query_string or '',
+                   'SCRIPT_NAME': '', 'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+                   'SERVER_PROTOCOL': 'HTTP/1.1', 'HTTP_HOST': 'testserver', 'HTTP_ACCEPT': 'application/json',
+                   'CONTENT_TYPE': 'application/json', 'CONTENT_LENGTH': str(len(body)),
+                   'wsgi.input': io.BytesIO(body), 'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr,
+                   'wsgi.multithread': True, 'wsgi.multiprocess': False, 'wsgi.run_once': False}
+        statuses = []
+        response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        b''.join(response)
+        response.close()
+        assert statuses[0][:3] in ('200', '201'), statuses[0]
+
+    results = {}
+    for method, path, query_string in REQUESTS:
+        for _ in range(50):
+            request(method, path, query_string)
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(requests_number):
+            sent = time.perf_counter()
+            request(method, path, query_string)
+            latencies.append((time.perf_counter() - sent) * 1000)
+        elapsed = time.perf_counter() - started
+        results[f'{method} {path}'] = [statistics.median(latencies), percentile(latencies, 99),
+                                       requests_number / elapsed]
+    print(json.dumps(results))
+
+
+def run(requests_number, startups):
+    startup = {profile: measure_startup(profile, startups) for profile in PROFILES}
+    per_request = {}
+    for profile in PROFILES:
+        output = subprocess.run([sys.executable, '-m', 'benchmarks.api_profile', '--requests', str(requests_number)],
+                                env=dict(os.environ, DJANGO_SETTINGS_MODULE=profile), check=True,
+                                capture_output=True, text=True).stdout
+        per_request[profile] = json.loads(output.splitlines()[-1])
+
+    print(f'{"":<26}' + ''.join(f'{profile:>40}' for profile in PROFILES))
+    cells = [f'process {total:6.0f}ms  django {django:6.0f}ms' for total, django in startup.values()]
+    print(f'{"startup":<26}' + ''.join(f'{cell:>40}' for cell in cells))
+    for name in per_request[PROFILES[0]]:
+        cells = [f'p50 {p50:6.3f}ms  p99 {p99:6.3f}ms  {rate:5.0f}/s'
+                 for p50, p99, rate in (per_request[profile][name] for profile in PROFILES)]
+        print(f'{name:<26}' + ''.join(f'{cell:>40}' for cell in cells))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--requests']:
+        measure_requests(int(sys.argv[2]))
+    else:
+        arguments = [int(argument) for argument in sys.argv[1:]]
+        run(*(arguments + [5000, 10][len(arguments):]))
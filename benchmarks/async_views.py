@@ -0,0 +1,147 @@
+"""
+Throughput and latency of the async views under ASGI against the sync views under WSGI.
+
+    python -m benchmarks.async_views [concurrency] [requests_number] [wsgi_threads]
+
+Both handlers are driven in process, without a network server: `concurrency` clients (1000 by default) send
+`requests_number` requests in total (10000 by default), half of them GET /topics/<id>/messages/?page_size=20 of a
+random topic and half GET /topics/<id>/, every client sending its next request when the previous one is answered.
+ASGI clients are tasks of one event loop calling chatting.asgi's handler with CHAT_ASYNC_VIEWS, WSGI clients queue
+on a pool of `wsgi_threads` threads (32 by default, like a threaded WSGI server) calling Django's WSGIHandler.
+Latency is measured from the moment a client sends its request, so it includes the time the request waits for a
+thread.
+
+The database is a temporary SQLite file with 100k messages, the response cache is disabled so every request
+reads the database.
+"""
+import asyncio
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import percentile, seed_messages, setup_django
+
+MESSAGES_NUMBER = 100_000
+TOPICS_NUMBER = 100
+
+
+def make_paths(requests_number, seed=0):
+    choice = random.Random(seed)
+    paths = []
+    for number in range(requests_number):
+        topic_id = choice.randint(1, TOPICS_NUMBER)
+        paths.append(f'/topics/{topic_id}/messages/?page_size=20' if number % 2 else f'/topics/{topic_id}/')
+    return paths
+
+
+def report(name, latencies, elapsed, failures):
+    latencies_ms = [latency * 1000 for latency in latencies]
+    print(f'{name:<5} {len(latencies) / elapsed:8.0f} req/s  p50 {percentile(latencies_ms, 50):8.2f}ms  '
+          f'p99 {percentile(latencies_ms, 99):8.2f}ms  errors {failures}', flush=True)
+
+
+async def run_asgi(paths, concurrency):
+    from chatting.asgi import django_application
+
+    latencies = []
+    failures = 0
+    pending = iter(paths)
+
+    async def request(path):
+        path, _, query_string = path.partition('?')
+        scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                 'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query_string.encode(),
+                 'root_path': '', 'headers': [(b'host', b'testserver')], 'server': ('testserver', 80)}
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        await django_application(scope, receive, send)
+        return messages[0]['status']
+
+    async def client():
+        nonlocal failures
+        for path in pending:
+            started = time.perf_counter()
+            if await request(path) != 200:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started, failures
+
+
+def run_wsgi(paths, concurrency, threads):
+    from django.core.handlers.wsgi import WSGIHandler
+
+    handler = WSGIHandler()
+
+    def request(path, sent):
+        path, _, query_string = path.partition('?')
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query_string, 'SCRIPT_NAME': '',
+                   'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                   'HTTP_HOST': 'testserver', 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+                   'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                   'wsgi.run_once': False}
+        statuses = []
+        body = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        b''.join(body)
+        body.close()
+        return statuses[0].startswith('200'), time.perf_counter() - sent
+
+    # every client keeps one request in flight, so at most `concurrency` requests wait for the pool
+    with ThreadPoolExecutor(threads) as pool:
+        started = time.perf_counter()
+        pending = iter(paths)
+        in_flight = []
+        for path, _ in zip(pending, range(concurrency)):
+            in_flight.append(pool.submit(request, path, time.perf_counter()))
+        latencies = []
+        failures = 0
+        while in_flight:
+            ok, latency = in_flight.pop(0).result()
+            latencies.append(latency)
+            failures += not ok
+            path = next(pending, None)
+            if path is not None:
+                in_flight.append(pool.submit(request, path, time.perf_counter()))
+        return latencies, time.perf_counter() - started, failures
+
+
+def run(concurrency, requests_number, wsgi_threads):
+    db_file = tempfile.NamedTemporaryFile(suffix='.sqlite3', delete=False)
+    db_file.close()
+    try:
+        setup_django(db_file.name)
+        from django.conf import settings
+        from django.db import connection
+
+        settings.CHAT_RESPONSE_CACHE = None
+        # read when chatting.asgi is imported
+        settings.CHAT_ASYNC_VIEWS = True
+        settings.ALLOWED_HOSTS = ['testserver']
+        seed_messages(MESSAGES_NUMBER, topics_number=TOPICS_NUMBER)
+        # requests open their own connections, the seeding one would keep the file busy
+        connection.close()
+
+        paths = make_paths(requests_number)
+        print(f'{MESSAGES_NUMBER} messages, {requests_number} requests, {concurrency} concurrent clients, '
+              f'{wsgi_threads} WSGI threads', flush=True)
+        report('WSGI', *run_wsgi(paths, concurrency, wsgi_threads))
+        report('ASGI', *asyncio.run(run_asgi(paths, concurrency)))
+    finally:
+        os.unlink(db_file.name)
+
+
+if __name__ == '__main__':
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    run(*(arguments + [1000, 10_000, 32][len(arguments):]))
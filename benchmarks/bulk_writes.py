@@ -0,0 +1,50 @@
+"""
+Message write throughput, one POST per message versus batches on /topics/<id>/messages/bulk/.
+
+    python -m benchmarks.bulk_writes [messages_number] [batch_size]
+
+Runs against a SQLite file in a temporary directory, so every commit pays for a real fsync.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.common import setup_django
+
+
+def run(messages_number, batch_size):
+    from rest_framework.test import APIRequestFactory
+    from chat.models import Topic, Message
+    from chat.views import MessageFromTopicViewSet
+
+    factory = APIRequestFactory()
+    topic = Topic.objects.create(title='Benchmark topic')
+    single_view = MessageFromTopicViewSet.as_view({'post': 'create'})
+    bulk_view = MessageFromTopicViewSet.as_view({'post': 'bulk_create'})
+    url = f'/topics/{topic.id}/messages/'
+
+    started = time.perf_counter()
+    for id in range(messages_number):
+        response = single_view(factory.post(url, {'text': f'Benchmark message number {id}'}), topic_id=topic.id)
+        assert response.status_code == 201, response.data
+    single = messages_number / (time.perf_counter() - started)
+
+    started = time.perf_counter()
+    for batch_start in range(0, messages_number, batch_size):
+        items = [{'text': f'Benchmark message number {id}'}
+                 for id in range(batch_start, min(batch_start + batch_size, messages_number))]
+        response = bulk_view(factory.post(f'{url}bulk/', items, format='json'), topic_id=topic.id)
+        assert response.status_code == 201, response.data
+    bulk = messages_number / (time.perf_counter() - started)
+
+    assert Message.objects.count() == 2 * messages_number
+    print(f'{messages_number} messages  single POST {single:,.0f} msg/s  '
+          f'bulk POST ({batch_size} per batch) {bulk:,.0f} msg/s  speedup x{bulk / single:.1f}')
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(db_name=os.path.join(directory, 'bench.sqlite3'))
+        arguments = [int(argument) for argument in sys.argv[1:]]
+        run(*(arguments + [5_000, 1_000][len(arguments):]))
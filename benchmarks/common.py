@@ -0,0 +1,100 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Benchmarks run against a throwaway database created the same way as the test database, so they never touch
+db.sqlite3. Run them from the repository root, e.g. ``python -m benchmarks.topic_listing``.
+"""
+import datetime
+import itertools
+import os
+import random
+import statistics
+import time
+
+import django
+
+
+def setup_django(db_name=None):
+    """Configure Django and create a fresh database, in memory unless db_name is given"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatting.settings')
+    from django.conf import settings
+
+    if db_name is not None:
+        settings.DATABASES['default']['TEST'] = {'NAME': db_name}
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    return connection
+
+
+def zipf_weights(number, s=1.0):
+    """Cumulative weights of ranks 1..number in a Zipf distribution with exponent s, for random.choices()"""
+    return list(itertools.accumulate(1 / rank ** s for rank in range(1, number + 1)))
+
+
+def seed_messages(messages_number, topics_number=100, hot_topic_share=0.1, batch_size=10000, make_text=None,
+                  zipf_s=None, seed=0):
+    """
+    Insert topics and messages with raw executemany, topic counters are recomputed once at the end.
+
+    Topic with id 1 receives hot_topic_share of all messages, the rest is spread evenly over the other topics.
+    With zipf_s the topic of every message is drawn instead from a Zipf distribution with that exponent, topic id
+    being the rank. Messages are interleaved in time, one second apart. make_text(id) returns the text of a message.
+    Returns the id of the hot topic.
+    """
+    from django.db import connection, transaction
+    from chat.models import Topic, Message
+
+    start = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    Topic.objects.bulk_create([Topic(id=id, title=f'Benchmark topic {id}') for id in range(1, topics_number + 1)])
+
+    hot_every = max(1, round(1 / hot_topic_share)) if hot_topic_share else None
+    if zipf_s is not None:
+        generator = random.Random(seed)
+        cum_weights = zipf_weights(topics_number, zipf_s)
+    sql = (f'INSERT INTO {Message._meta.db_table} (id, text, created_at, topic_id, change_seq) '
+           f'VALUES (%s, %s, %s, %s, %s)')
+    with transaction.atomic(), connection.cursor() as cursor:
+        for batch_start in range(1, messages_number + 1, batch_size):
+            rows = []
+            for id in range(batch_start, min(batch_start + batch_size, messages_number + 1)):
+                if zipf_s is not None:
+                    topic_id = generator.choices(range(1, topics_number + 1), cum_weights=cum_weights)[0]
+                elif hot_every and id % hot_every == 0:
+                    topic_id = 1
+                else:
+                    topic_id = 2 + id % (topics_number - 1)
+                text = make_text(id) if make_text else f'Benchmark message number {id}'
+                rows.append((id, text, start + datetime.timedelta(seconds=id), topic_id, id))
+            cursor.executemany(sql, rows)
+    Topic.objects.repair_activity()
+    return 1
+
+
+def measure(func, repeat=20, warmup=2):
+    """Call func repeat times and return latencies in milliseconds"""
+    for _ in range(warmup):
+        func()
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return latencies
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summary(latencies):
+    return {
+        'p50_ms': round(statistics.median(latencies), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+    }
@@ -0,0 +1,114 @@
+"""
+Connection setup cost of topic and message requests with and without persistent connections.
+
+    CHAT_DB_ENGINE=postgresql CHAT_DB_HOST=localhost CHAT_DB_USER=... python -m benchmarks.db_connections \
+        [requests_number] [pool modes]
+
+Runs against the database configured by the CHAT_DB_* variables (see chatting/database.py), on PostgreSQL in a
+test database created next to CHAT_DB_NAME, so the user needs CREATEDB. Every pool mode (none and persistent by
+default, pgbouncer with CHAT_DB_PORT pointing to a pgbouncer, native on Django 5.1+) is measured in a process of
+its own: 10k messages are seeded, then `requests_number` (2000 by default) requests of each kind go straight to
+Django's WSGIHandler with the response cache disabled, GET /topics/1/, /topics/, /messages/1/ and /messages/.
+Reported are p50/p99 latency, req/s and the connections opened per request, along with the median time of opening
+a connection.
+
+On SQLite (the default engine) the script runs as well, in a temporary file with CONN_MAX_AGE set like the modes
+would on PostgreSQL, but opening a SQLite file costs microseconds: its numbers say nothing about PostgreSQL, where
+the modes have not been measured yet.
+"""
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import percentile, seed_messages, setup_django
+
+PATHS = ('/topics/1/', '/topics/', '/messages/1/', '/messages/')
+
+
+def measure(mode, requests_number, db_name):
+    """Runs in the process of a pool mode, prints {path: [p50 ms, p99 ms, req/s, connections per request]}"""
+    connection = setup_django(db_name)
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.db.backends.signals import connection_created
+
+    settings.CHAT_RESPONSE_CACHE = None
+    if connection.vendor == 'sqlite':
+        connection.settings_dict['CONN_MAX_AGE'] = 0 if mode == 'none' else 600
+    seed_messages(10_000)
+    connection.close()
+
+    connect_times = []
+    for _ in range(20):
+        started = time.perf_counter()
+        connection.connect()
+        connect_times.append((time.perf_counter() - started) * 1000)
+        connection.close()
+
+    opened = []
+    connection_created.connect(lambda **kwargs: opened.append(1), weak=False)
+    handler = WSGIHandler()
+
+    def request(path):
+        path, _, query_string = path.partition('?')
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query_string, 'SCRIPT_NAME': '',
+                   'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                   'HTTP_HOST': 'testserver', 'HTTP_ACCEPT': 'application/json', 'wsgi.input': io.BytesIO(),
+                   'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+                   'wsgi.multiprocess': False, 'wsgi.run_once': False}
+        statuses = []
+        response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        b''.join(response)
+        response.close()
+        assert statuses[0].startswith('200'), statuses[0]
+
+    results = {'connect': statistics.median(connect_times)}
+    for path in PATHS:
+        for _ in range(20):
+            request(path)
+        opened.clear()
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(requests_number):
+            sent = time.perf_counter()
+            request(path)
+            latencies.append((time.perf_counter() - sent) * 1000)
+        elapsed = time.perf_counter() - started
+        results[path] = [statistics.median(latencies), percentile(latencies, 99), requests_number / elapsed,
+                         len(opened) / requests_number]
+    connection.creation.destroy_test_db(connection.settings_dict['NAME'], verbosity=0)
+    print(json.dumps(results))
+
+
+def run(requests_number, modes):
+    results = {}
+    for mode in modes:
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.db_connections', '--mode', mode,
+                                     str(requests_number), os.path.join(directory, 'benchmark.sqlite3')],
+                                    env=dict(os.environ, CHAT_DB_POOL=mode), check=True, capture_output=True,
+                                    text=True).stdout
+        results[mode] = json.loads(output.splitlines()[-1])
+
+    print(f'{os.environ.get("CHAT_DB_ENGINE", "sqlite")}, {requests_number} requests per path')
+    for mode in modes:
+        print(f'{mode:<11} connect {results[mode]["connect"]:.3f}ms')
+        for path in PATHS:
+            p50, p99, rate, connections = results[mode][path]
+            print(f'{mode:<11} GET {path:<14} p50 {p50:7.3f}ms  p99 {p99:7.3f}ms  {rate:6.0f} req/s  '
+                  f'{connections:.2f} connections/request')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--mode']:
+        mode, requests_number, db_name = sys.argv[2:5]
+        # the name of the test database on PostgreSQL is derived from CHAT_DB_NAME
+        measure(mode, int(requests_number),
+                db_name if os.environ.get('CHAT_DB_ENGINE', 'sqlite') == 'sqlite' else None)
+    else:
+        run(int(sys.argv[1]) if sys.argv[1:] else 2000, sys.argv[2:] or ['none', 'persistent'])
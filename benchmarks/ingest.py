@@ -0,0 +1,122 @@
+"""
+Message creates per second with a commit per request against group commit (CHAT_INGEST, see chat/ingest.py).
+
+    python -m benchmarks.ingest [writer_threads] [seconds]
+
+Every configuration runs in a process of its own on a temporary SQLite file in WAL mode (CHAT_DB_SQLITE_WAL, so
+writers wait for each other instead of failing) seeded with 10 topics, with synchronous=NORMAL and with FULL, an
+fsync per commit. For `seconds` (5 by default)
+`writer_threads` threads (16) POST /topics/<id>/messages/ as fast as they can through Django's WSGIHandler, like the
+threads of a WSGI server. Reported are messages/s, failed creates, create latency and, with group commit, the
+average number of messages per commit.
+"""
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import percentile, setup_django
+
+CONFIGURATIONS = {
+    'commit per request': None,
+    'group commit': {'MAX_BATCH': 256, 'MAX_DELAY_MS': 2},
+}
+# NORMAL syncs the WAL at checkpoints, FULL at every commit like a durable PostgreSQL commit
+SYNCHRONOUS = ('NORMAL', 'FULL')
+TOPICS_NUMBER = 10
+
+
+def measure(writers, seconds, db_name, ingest_config, synchronous):
+    """Runs in the process of a configuration, prints the results as JSON"""
+    connection = setup_django(db_name)
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    from chat import ingest
+    from chat.models import Topic
+
+    settings.CHAT_RESPONSE_CACHE = None
+    settings.CHAT_INGEST = ingest_config
+    settings.DEBUG = False
+    # failed requests are counted, not logged
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    Topic.objects.bulk_create([Topic(id=id, title=f'Benchmark topic {id}') for id in range(1, TOPICS_NUMBER + 1)])
+    connection.close()
+    settings.DATABASES['default']['OPTIONS']['synchronous'] = synchronous
+    handler = WSGIHandler()
+
+    def post(path, body):
+        environ = {'REQUEST_METHOD': 'POST', 'PATH_INFO': path, 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+                   'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                   'HTTP_HOST': 'testserver', 'HTTP_ACCEPT': 'application/json', 'CONTENT_TYPE': 'application/json',
+                   'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body), 'wsgi.url_scheme': 'http',
+                   'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                   'wsgi.run_once': False}
+        statuses = []
+        response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        b''.join(response)
+        response.close()
+        return statuses[0][:3]
+
+    stop = threading.Event()
+    latencies, failed = [], []
+    body = json.dumps({'text': 'Benchmark message written under load'}).encode()
+
+    def writer(seed):
+        choice = random.Random(seed)
+        while not stop.is_set():
+            sent = time.perf_counter()
+            if post(f'/topics/{choice.randint(1, TOPICS_NUMBER)}/messages/', body) == '201':
+                latencies.append((time.perf_counter() - sent) * 1000)
+            else:
+                failed.append(1)
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(writers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    group_writer = ingest.get_writer() if ingest_config else None
+    print(json.dumps({
+        'messages_per_second': len(latencies) / seconds,
+        'failed': len(failed),
+        'p50_ms': statistics.median(latencies) if latencies else None,
+        'p99_ms': percentile(latencies, 99) if latencies else None,
+        'messages_per_commit': group_writer.messages / group_writer.batches if group_writer and group_writer.batches
+        else 1,
+    }))
+
+
+def run(writers, seconds):
+    print(f'{writers} writer threads, {seconds}s')
+    for synchronous in SYNCHRONOUS:
+        for name, ingest_config in CONFIGURATIONS.items():
+            with tempfile.TemporaryDirectory() as directory:
+                output = subprocess.run([sys.executable, '-m', 'benchmarks.ingest', '--measure', str(writers),
+                                         str(seconds), os.path.join(directory, 'benchmark.sqlite3'),
+                                         json.dumps(ingest_config), synchronous],
+                                        env=dict(os.environ, CHAT_DB_SQLITE_WAL='1'), check=True, capture_output=True,
+                                        text=True).stdout
+            result = json.loads(output.splitlines()[-1])
+            latency = (f'p50 {result["p50_ms"]:7.2f}ms  p99 {result["p99_ms"]:8.2f}ms'
+                       if result['p50_ms'] is not None else 'no create succeeded')
+            print(f'synchronous={synchronous:<6} {name:<20} {result["messages_per_second"]:7.0f} messages/s  '
+                  f'{result["failed"]:5} failed  {latency}  {result["messages_per_commit"]:6.1f} messages/commit',
+                  flush=True)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(int(sys.argv[2]), int(sys.argv[3]), sys.argv[4], json.loads(sys.argv[5]), sys.argv[6])
+    else:
+        arguments = [int(argument) for argument in sys.argv[1:]]
+        run(*(arguments + [16, 5][len(arguments):]))
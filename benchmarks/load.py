@@ -0,0 +1,400 @@
+"""
+Mixed read/write load on every route of chatting/urls.py, with results written as JSON to compare runs.
+
+    python -m benchmarks.load [--topics N] [--messages N] [--requests N] [--writes SHARE] [--zipf S] [--seed N]
+                              [--no-cache] [--metrics] [--output results.json] [--baseline results.json] [--tolerance 0.25]
+
+The database is seeded with `--messages` messages (100k by default) over `--topics` topics (1000) drawn from a Zipf
+distribution with exponent `--zipf` (1.1), so a few topics hold most messages; texts are made of words of the
+Zipf vocabulary of benchmarks.message_search. Requests go through the whole Django stack (middleware, URL
+resolving, rendering) with django.test.Client, one at a time. Every request is one of OPERATIONS, drawn by weight;
+read weights and write weights are scaled so writes are `--writes` (0.2) of the requests. Topics of requests are
+drawn from the same Zipf distribution as the seed, messages uniformly, so hot topics also get most of the traffic.
+Topics are deleted only if the benchmark created them.
+
+For every operation and in total the script prints and writes requests per second, p50/p95/p99 latency and
+queries per request. The run is deterministic for a given --seed apart from timings, so the query counts of two
+runs are comparable as they are. With --baseline the results are compared with an earlier --output file: slower
+p95 (of operations with at least 100 requests) or lower throughput by more than --tolerance, or more queries per
+request, is reported as a regression and the script exits with status 1.
+"""
+import argparse
+import datetime
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from urllib.parse import urlencode
+
+from benchmarks.common import seed_messages, setup_django, summary, zipf_weights
+from benchmarks.message_search import VOCABULARY_SIZE, make_texts
+
+READ, WRITE = 'read', 'write'
+MIN_COMPARED_REQUESTS = 100
+
+
+class Workload:
+    """State of the benchmark: the topics and messages that exist, and the random choices of the requests"""
+
+    def __init__(self, topics_number, message_topics, zipf_s, seed):
+        self.generator = random.Random(seed)
+        self.topics_number = topics_number
+        self.topic_weights = zipf_weights(topics_number, zipf_s)
+        self.word_weights = zipf_weights(VOCABULARY_SIZE)
+        self.make_text = make_texts(seed + 1)
+        # message id -> topic id, ids in a list for uniform choices, deleted ids are skipped lazily
+        self.messages = message_topics
+        self.message_ids = list(message_topics)
+        self.created_topics = []
+
+    def topic(self):
+        return self.generator.choices(range(1, self.topics_number + 1), cum_weights=self.topic_weights)[0]
+
+    def message(self):
+        while True:
+            id = self.generator.choice(self.message_ids)
+            if id in self.messages:
+                return id, self.messages[id]
+
+    def messages_of(self, topic_id, number):
+        ids = {self.message()[0] for _ in range(number * 3)}
+        return [id for id in ids if self.messages[id] == topic_id][:number] or None
+
+    def word(self):
+        return f'a{self.generator.choices(range(1, VOCABULARY_SIZE + 1), cum_weights=self.word_weights)[0]}z'
+
+    def text(self):
+        return self.make_text(None)
+
+    def add_message(self, data):
+        self.messages[data['id']] = data['topic']
+        self.message_ids.append(data['id'])
+
+    def remove_message(self, id):
+        del self.messages[id]
+
+
+# Every operation returns (method, path, data) or None when it cannot run now, then another one is drawn. data of
+# writes is sent as JSON unless it is a str (form encoded). after(workload, response) records created and deleted
+# rows.
+
+def list_topics(workload):
+    return 'GET', '/topics/?page_size=20', None
+
+
+def retrieve_topic(workload):
+    return 'GET', f'/topics/{workload.topic()}/', None
+
+
+def create_topic(workload):
+    return 'POST', '/topics/', {'title': f'Load topic {workload.generator.getrandbits(32)}'}
+
+
+def update_topic(workload):
+    return 'PATCH', f'/topics/{workload.topic()}/', {'title': f'Load topic {workload.generator.getrandbits(32)}'}
+
+
+def destroy_topic(workload):
+    if not workload.created_topics:
+        return None
+    return 'DELETE', f'/topics/{workload.created_topics.pop()}/', None
+
+
+def list_messages(workload):
+    return 'GET', '/messages/?page_size=20', None
+
+
+def retrieve_message(workload):
+    return 'GET', f'/messages/{workload.message()[0]}/', None
+
+
+def create_message(workload):
+    return 'POST', '/messages/', {'text': workload.text(), 'topic': workload.topic()}
+
+
+def update_message(workload):
+    return 'PATCH', f'/messages/{workload.message()[0]}/', {'text': workload.text()}
+
+
+def destroy_message(workload):
+    id, _ = workload.message()
+    workload.remove_message(id)
+    return 'DELETE', f'/messages/{id}/', None
+
+
+def search_messages(workload):
+    return 'GET', f'/messages/search/?q={workload.word()}&page_size=20', None
+
+
+def list_topic_messages(workload):
+    return 'GET', f'/topics/{workload.topic()}/messages/?page_size=20', None
+
+
+def retrieve_topic_message(workload):
+    id, topic_id = workload.message()
+    return 'GET', f'/topics/{topic_id}/messages/{id}/', None
+
+
+def create_topic_message(workload):
+    return 'POST', f'/topics/{workload.topic()}/messages/', {'text': workload.text()}
+
+
+def update_topic_message(workload):
+    id, topic_id = workload.message()
+    # the nested update reads request.data as a QueryDict
+    return 'PATCH', f'/topics/{topic_id}/messages/{id}/', urlencode({'text': workload.text()})
+
+
+def destroy_topic_message(workload):
+    id, topic_id = workload.message()
+    workload.remove_message(id)
+    return 'DELETE', f'/topics/{topic_id}/messages/{id}/', None
+
+
+def topic_message_changes(workload):
+    return 'GET', f'/topics/{workload.topic()}/messages/changes/?since=0&limit=100', None
+
+
+def search_topic_messages(workload):
+    return 'GET', f'/topics/{workload.topic()}/messages/search/?q={workload.word()}&page_size=20', None
+
+
+def export_topic_messages(workload):
+    return 'GET', f'/topics/{workload.topic()}/messages/export/', None
+
+
+def bulk_create_topic_messages(workload):
+    return 'POST', f'/topics/{workload.topic()}/messages/bulk/', [{'text': workload.text()} for _ in range(10)]
+
+
+def bulk_update_topic_messages(workload):
+    topic_id = workload.topic()
+    ids = workload.messages_of(topic_id, 10)
+    if ids is None:
+        return None
+    return 'PATCH', f'/topics/{topic_id}/messages/bulk/', [{'id': id, 'text': workload.text()} for id in ids]
+
+
+def bulk_destroy_topic_messages(workload):
+    topic_id = workload.topic()
+    ids = workload.messages_of(topic_id, 10)
+    if ids is None:
+        return None
+    for id in ids:
+        workload.remove_message(id)
+    return 'DELETE', f'/topics/{topic_id}/messages/bulk/', ids
+
+
+def cache_stats(workload):
+    return 'GET', '/stats/cache/', None
+
+
+def created_topic(workload, data):
+    workload.created_topics.append(data['id'])
+
+
+def created_messages(workload, data):
+    for message in data if isinstance(data, list) else [data]:
+        workload.add_message(message)
+
+
+# name: (function, kind, weight within its kind, expected status, after)
+OPERATIONS = {
+    'topics list': (list_topics, READ, 5, 200, None),
+    'topics retrieve': (retrieve_topic, READ, 8, 200, None),
+    'topics create': (create_topic, WRITE, 3, 201, created_topic),
+    'topics update': (update_topic, WRITE, 3, 200, None),
+    'topics destroy': (destroy_topic, WRITE, 2, 204, None),
+    'messages list': (list_messages, READ, 5, 200, None),
+    'messages retrieve': (retrieve_message, READ, 10, 200, None),
+    'messages create': (create_message, WRITE, 15, 201, created_messages),
+    'messages update': (update_message, WRITE, 8, 200, None),
+    'messages destroy': (destroy_message, WRITE, 4, 204, None),
+    'messages search': (search_messages, READ, 2, 200, None),
+    'topic messages list': (list_topic_messages, READ, 40, 200, None),
+    'topic messages retrieve': (retrieve_topic_message, READ, 10, 200, None),
+    'topic messages create': (create_topic_message, WRITE, 35, 201, created_messages),
+    'topic messages update': (update_topic_message, WRITE, 12, 200, None),
+    'topic messages destroy': (destroy_topic_message, WRITE, 6, 204, None),
+    'topic messages changes': (topic_message_changes, READ, 12, 200, None),
+    'topic messages search': (search_topic_messages, READ, 6, 200, None),
+    'topic messages export': (export_topic_messages, READ, 0.5, 200, None),
+    'topic messages bulk create': (bulk_create_topic_messages, WRITE, 4, 201, created_messages),
+    'topic messages bulk update': (bulk_update_topic_messages, WRITE, 2, 200, None),
+    'topic messages bulk destroy': (bulk_destroy_topic_messages, WRITE, 2, 204, None),
+    'cache stats': (cache_stats, READ, 0.5, 200, None),
+}
+
+
+def operation_weights(writes_share):
+    """Weights of OPERATIONS, in order, so that writes are writes_share of all requests"""
+    totals = {kind: sum(weight for _, op_kind, weight, _, _ in OPERATIONS.values() if op_kind == kind)
+              for kind in (READ, WRITE)}
+    shares = {READ: 1 - writes_share, WRITE: writes_share}
+    return [weight / totals[kind] * shares[kind] for _, kind, weight, _, _ in OPERATIONS.values()]
+
+
+def run_requests(client, workload, requests_number, weights):
+    """Sends requests_number requests, returns {operation: [(latency in ms, queries, ok)]} and the elapsed time"""
+    from django.db import connection, reset_queries
+    from django.test.utils import CaptureQueriesContext
+
+    names = list(OPERATIONS)
+    results = {name: [] for name in names}
+    started = time.perf_counter()
+    for _ in range(requests_number):
+        request = None
+        while request is None:
+            name = workload.generator.choices(names, weights)[0]
+            function, _, _, expected, after = OPERATIONS[name]
+            request = function(workload)
+        method, path, data = request
+        if isinstance(data, str):
+            content_type = 'application/x-www-form-urlencoded'
+        else:
+            content_type = 'application/json'
+            data = json.dumps(data) if data is not None else ''
+
+        # CaptureQueriesContext reads the log of the connection, which is bounded
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            sent = time.perf_counter()
+            response = client.generic(method, path, data, content_type)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            latency = (time.perf_counter() - sent) * 1000
+
+        ok = response.status_code == expected
+        if ok and after is not None:
+            after(workload, response.json())
+        results[name].append((latency, len(queries), ok))
+    return results, time.perf_counter() - started
+
+
+def report_line(requests, elapsed):
+    latencies = [latency for latency, _, _ in requests]
+    line = {
+        'requests': len(requests),
+        'errors': sum(not ok for _, _, ok in requests),
+        'throughput_rps': round(len(requests) / elapsed, 1),
+    }
+    if requests:
+        line.update(summary(latencies))
+        line['mean_ms'] = round(statistics.fmean(latencies), 3)
+        line['queries_per_request'] = round(statistics.fmean(queries for _, queries, _ in requests), 3)
+        line['max_queries'] = max(queries for _, queries, _ in requests)
+    return line
+
+
+def make_report(results, elapsed, options):
+    import django
+    from django.db import connection
+
+    everything = [request for requests in results.values() for request in requests]
+    return {
+        'benchmark': 'load',
+        'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': f'{connection.vendor} {".".join(map(str, connection.Database.sqlite_version_info))}'
+            if connection.vendor == 'sqlite' else connection.vendor,
+        },
+        'options': options,
+        'elapsed_s': round(elapsed, 3),
+        'total': report_line(everything, elapsed),
+        # throughput of an operation is its requests per second of the whole run
+        'operations': {name: report_line(requests, elapsed) for name, requests in results.items() if requests},
+    }
+
+
+def print_report(report):
+    print(f'{"operation":<28} {"requests":>8} {"errors":>6} {"req/s":>9} {"p50 ms":>8} {"p95 ms":>8} '
+          f'{"p99 ms":>8} {"queries":>7}')
+    for name, line in [*report['operations'].items(), ('total', report['total'])]:
+        print(f'{name:<28} {line["requests"]:>8} {line["errors"]:>6} {line["throughput_rps"]:>9.1f} '
+              f'{line["p50_ms"]:>8.2f} {line["p95_ms"]:>8.2f} {line["p99_ms"]:>8.2f} '
+              f'{line["queries_per_request"]:>7.2f}')
+
+
+def compare(report, baseline, tolerance):
+    """Regressions of report against the baseline report, as printable lines"""
+    regressions = []
+    lines = [('total', report['total'], baseline['total'])]
+    lines += [(name, line, baseline['operations'][name])
+              for name, line in report['operations'].items() if name in baseline['operations']]
+    for name, line, before in lines:
+        # the p95 of a rare operation is too noisy to compare
+        if line['requests'] >= MIN_COMPARED_REQUESTS and line['p95_ms'] > before['p95_ms'] * (1 + tolerance):
+            regressions.append(f'{name}: p95 {before["p95_ms"]:.2f}ms -> {line["p95_ms"]:.2f}ms')
+        if name == 'total' and line['throughput_rps'] < before['throughput_rps'] * (1 - tolerance):
+            regressions.append(f'{name}: {before["throughput_rps"]:.1f} -> {line["throughput_rps"]:.1f} req/s')
+        if line['queries_per_request'] > before['queries_per_request']:
+            regressions.append(f'{name}: {before["queries_per_request"]} -> {line["queries_per_request"]} '
+                               f'queries per request')
+        if line['errors'] > before['errors']:
+            regressions.append(f'{name}: {before["errors"]} -> {line["errors"]} errors')
+    return regressions
+
+
+def run(options):
+    setup_django()
+    from django.conf import settings
+    from django.test import Client
+    from chat.models import Message
+
+    if options.no_cache:
+        settings.CHAT_RESPONSE_CACHE = None
+    if options.metrics:
+        settings.CHAT_METRICS = {'SERVER_TIMING': True}
+    seed_messages(options.messages, topics_number=options.topics, make_text=make_texts(options.seed),
+                  zipf_s=options.zipf, seed=options.seed)
+    message_topics = dict(Message.objects.values_list('id', 'topic_id').iterator())
+    workload = Workload(options.topics, message_topics, options.zipf, options.seed)
+    weights = operation_weights(options.writes)
+    client = Client()
+
+    print(f'{options.messages} messages in {options.topics} topics (Zipf s={options.zipf}), {options.requests} '
+          f'requests, {options.writes:.0%} writes, response cache {"off" if options.no_cache else "on"}, '
+          f'metrics {"on" if options.metrics else "off"}', flush=True)
+    run_requests(client, workload, options.warmup, weights)
+    results, elapsed = run_requests(client, workload, options.requests, weights)
+
+    report = make_report(results, elapsed, vars(options))
+    print_report(report)
+    if options.output:
+        with open(options.output, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'Results written to {options.output}')
+    if options.baseline:
+        with open(options.baseline) as file:
+            regressions = compare(report, json.load(file), options.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print(f'No regressions against {options.baseline}')
+
+
+def parse_args(arguments=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.load', description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--topics', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=100_000)
+    parser.add_argument('--requests', type=int, default=20_000, help='measured requests')
+    parser.add_argument('--warmup', type=int, default=500, help='requests sent before measuring')
+    parser.add_argument('--writes', type=float, default=0.2, help='share of write requests')
+    parser.add_argument('--zipf', type=float, default=1.1, help='exponent of the topic distribution')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-cache', action='store_true', help='disable the response cache')
+    parser.add_argument('--metrics', action='store_true', help='enable chat.metrics.MetricsMiddleware')
+    parser.add_argument('--output', help='JSON file to write the results to')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='relative p95 and throughput change tolerated against the baseline')
+    return parser.parse_args(arguments)
+
+
+if __name__ == '__main__':
+    run(parse_args())
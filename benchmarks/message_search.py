@@ -0,0 +1,67 @@
+"""
+Search latency of the full-text index versus a naive icontains scan.
+
+    python -m benchmarks.message_search [messages_number]
+
+Messages are made of words drawn from a Zipf-distributed vocabulary, so there are very common, ordinary and rare
+words; no word is a substring of another, so icontains finds the same messages as the index. For each query the first page (20 results) of /messages/search/ and /topics/1/messages/search/ is requested
+with chat.search.SQLiteFullTextSearch and chat.search.ContainsSearch. The scan gets fewer repetitions, a single
+request takes seconds on 1M messages.
+"""
+import random
+import sys
+
+from benchmarks.common import measure, seed_messages, setup_django, summary
+
+VOCABULARY_SIZE = 20_000
+QUERIES = {
+    'top word': 'a1z',
+    'common word': 'a20z',
+    'ordinary word': 'a250z',
+    'rare word': 'a15000z',
+    'missing word': 'nowhere',
+    'two words': 'a40z a90z',
+}
+
+
+def make_texts(seed=1):
+    generator = random.Random(seed)
+    weights = [1 / rank for rank in range(1, VOCABULARY_SIZE + 1)]
+    words = [f'a{rank}z' for rank in range(1, VOCABULARY_SIZE + 1)]
+
+    def make_text(id):
+        return ' '.join(generator.choices(words, weights, k=generator.randint(5, 20)))
+    return make_text
+
+
+def run(messages_number):
+    setup_django()
+
+    from unittest import mock
+    from rest_framework.test import APIRequestFactory
+    from chat import search
+    from chat.views import MessageFromTopicViewSet, MessageViewSet
+
+    topic_id = seed_messages(messages_number, make_text=make_texts())
+    factory = APIRequestFactory()
+    all_view = MessageViewSet.as_view({'get': 'search'})
+    topic_view = MessageFromTopicViewSet.as_view({'get': 'search'})
+
+    def get_page(query, in_topic):
+        request = factory.get('/search/', {'q': query, 'page_size': 20})
+        response = topic_view(request, topic_id=topic_id) if in_topic else all_view(request)
+        response.render()
+        assert response.status_code == 200, response.content
+
+    for backend, repeat in ((search.SQLiteFullTextSearch(), 20), (search.ContainsSearch(), 3)):
+        with mock.patch.object(search, '_search', backend):
+            for name, query in QUERIES.items():
+                for in_topic in (False, True):
+                    latencies = measure(lambda: get_page(query, in_topic), repeat=repeat, warmup=1)
+                    scope = 'topic 1' if in_topic else 'all'
+                    print(f'{messages_number} messages  {type(backend).__name__:<20} {name:<14} {scope:<7} '
+                          f'{summary(latencies)}')
+
+
+if __name__ == '__main__':
+    run(*[int(argument) for argument in sys.argv[1:]] or [1_000_000])
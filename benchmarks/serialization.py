@@ -0,0 +1,62 @@
+"""
+Time to build a 10k-row page of messages with MessageSerializer and with MessageValuesSerializer.
+
+    python -m benchmarks.serialization [rows]
+
+Each path is split into fetching the rows (model instances or values_list() tuples), serializing them and rendering
+JSON (JSONRenderer or FastJSONRenderer), and the rendered pages are checked to be byte-identical. Pages this large
+are not served by the API (page_size is capped at 1000), the size only makes the per-row costs stand out.
+"""
+import sys
+import time
+
+from benchmarks.common import measure, seed_messages, setup_django, summary
+
+
+def run(rows_number):
+    setup_django()
+    seed_messages(rows_number, make_text=lambda id: f'Benchmark message number {id} with some ünicode ☀')
+
+    from rest_framework.renderers import JSONRenderer
+    from chat.models import Message
+    from chat.renderers import FastJSONRenderer
+    from chat.serializers import MessageSerializer, MessageValuesSerializer
+
+    queryset = Message.objects.order_by('created_at', 'id')[:rows_number]
+
+    def model_page():
+        return JSONRenderer().render(MessageSerializer(list(queryset.all()), many=True).data)
+
+    def values_page():
+        rows = list(MessageValuesSerializer.values_list(queryset.all()))
+        return FastJSONRenderer().render(MessageValuesSerializer(rows, many=True).data)
+
+    assert model_page() == values_page(), 'pages differ'
+
+    def stages(fetch, serialize, render):
+        timings = []
+        for _ in range(5):
+            started = time.perf_counter()
+            rows = fetch()
+            fetched = time.perf_counter()
+            data = serialize(rows)
+            serialized = time.perf_counter()
+            render(data)
+            rendered = time.perf_counter()
+            timings.append((fetched - started, serialized - fetched, rendered - serialized))
+        best = min(timings, key=sum)
+        return '  '.join(f'{name} {seconds * 1000:7.1f}ms' for name, seconds in zip(('fetch', 'serialize', 'render'),
+                                                                                 best))
+
+    print(f'{rows_number} rows per page', flush=True)
+    for name, page, fetch, serialize, render in (
+            ('ModelSerializer', model_page, lambda: list(queryset.all()),
+             lambda rows: MessageSerializer(rows, many=True).data, JSONRenderer().render),
+            ('ValuesSerializer', values_page, lambda: list(MessageValuesSerializer.values_list(queryset.all())),
+             lambda rows: MessageValuesSerializer(rows, many=True).data, FastJSONRenderer().render)):
+        print(f'{name:<17} {summary(measure(page, repeat=10, warmup=1))}', flush=True)
+        print(f'{"":<17} {stages(fetch, serialize, render)}', flush=True)
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000)
@@ -0,0 +1,118 @@
+"""
+Sustained message writes on a SQLite file under concurrent readers, default backend against CHAT_DB_SQLITE_WAL.
+
+    python -m benchmarks.sqlite_concurrency [writer_threads] [reader_threads] [seconds]
+
+Every configuration runs in a process of its own on a temporary database file seeded with 10k messages in 10
+topics. For `seconds` (10 by default) `writer_threads` threads (4) POST /topics/<id>/messages/ and
+`reader_threads` threads (8) GET /topics/<id>/messages/?page_size=20 as fast as they can, through Django's
+WSGIHandler like the threads of a WSGI server, with the response cache disabled so every read queries the
+database. Reported are writes/s, reads/s, failed writes ("database is locked" answers 500) and write latency.
+"""
+import io
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmarks.common import percentile, seed_messages, setup_django
+
+CONFIGURATIONS = {
+    'default': {},
+    'wal': {'CHAT_DB_SQLITE_WAL': '1'},
+    'wal + serialized writes': {'CHAT_DB_SQLITE_WAL': '1', 'CHAT_DB_SQLITE_SERIALIZE_WRITES': '1'},
+}
+TOPICS_NUMBER = 10
+
+
+def measure(writers, readers, seconds, db_name):
+    """Runs in the process of a configuration, prints the results as JSON"""
+    connection = setup_django(db_name)
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+
+    settings.CHAT_RESPONSE_CACHE = None
+    settings.DEBUG = False
+    # failed requests are counted, not logged
+    logging.getLogger('django.request').setLevel(logging.CRITICAL)
+    seed_messages(10_000, topics_number=TOPICS_NUMBER)
+    connection.close()
+    handler = WSGIHandler()
+
+    def request(method, path, query_string='', body=b''):
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query_string, 'SCRIPT_NAME': '',
+                   'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                   'HTTP_HOST': 'testserver', 'HTTP_ACCEPT': 'application/json', 'CONTENT_TYPE': 'application/json',
+                   'CONTENT_LENGTH': str(len(body)), 'wsgi.input': io.BytesIO(body), 'wsgi.url_scheme': 'http',
+                   'wsgi.errors': sys.stderr, 'wsgi.multithread': True, 'wsgi.multiprocess': False,
+                   'wsgi.run_once': False}
+        statuses = []
+        response = handler(environ, lambda status, headers, exc_info=None: statuses.append(status))
+        b''.join(response)
+        response.close()
+        return statuses[0][:3]
+
+    stop = threading.Event()
+    write_latencies, failed_writes, reads = [], [], []
+    body = json.dumps({'text': 'Benchmark message written under load'}).encode()
+
+    def writer(seed):
+        choice = random.Random(seed)
+        while not stop.is_set():
+            sent = time.perf_counter()
+            if request('POST', f'/topics/{choice.randint(1, TOPICS_NUMBER)}/messages/', body=body) == '201':
+                write_latencies.append((time.perf_counter() - sent) * 1000)
+            else:
+                failed_writes.append(1)
+
+    def reader(seed):
+        choice = random.Random(seed)
+        while not stop.is_set():
+            if request('GET', f'/topics/{choice.randint(1, TOPICS_NUMBER)}/messages/', 'page_size=20') == '200':
+                reads.append(1)
+
+    threads = [threading.Thread(target=writer, args=(seed,)) for seed in range(writers)]
+    threads += [threading.Thread(target=reader, args=(seed,)) for seed in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    print(json.dumps({
+        'writes_per_second': len(write_latencies) / seconds,
+        'reads_per_second': len(reads) / seconds,
+        'failed_writes': len(failed_writes),
+        'write_p50_ms': statistics.median(write_latencies) if write_latencies else None,
+        'write_p99_ms': percentile(write_latencies, 99) if write_latencies else None,
+    }))
+
+
+def run(writers, readers, seconds):
+    print(f'{writers} writer threads, {readers} reader threads, {seconds}s')
+    for name, environ in CONFIGURATIONS.items():
+        with tempfile.TemporaryDirectory() as directory:
+            output = subprocess.run([sys.executable, '-m', 'benchmarks.sqlite_concurrency', '--measure', str(writers),
+                                     str(readers), str(seconds), os.path.join(directory, 'benchmark.sqlite3')],
+                                    env=dict(os.environ, **environ), check=True, capture_output=True,
+                                    text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        latency = (f'p50 {result["write_p50_ms"]:7.2f}ms  p99 {result["write_p99_ms"]:8.2f}ms'
+                   if result['write_p50_ms'] is not None else 'no write succeeded')
+        print(f'{name:<24} {result["writes_per_second"]:7.0f} writes/s  {result["reads_per_second"]:7.0f} reads/s  '
+              f'{result["failed_writes"]:5} failed writes  {latency}', flush=True)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        measure(*[int(argument) for argument in sys.argv[2:5]], sys.argv[5])
+    else:
+        arguments = [int(argument) for argument in sys.argv[1:]]
+        run(*(arguments + [4, 8, 10][len(arguments):]))
@@ -0,0 +1,118 @@
+"""
+Overhead of the token-bucket throttles (chat/throttling.py) on requests that are not throttled.
+
+    python -m benchmarks.throttling [requests_number] [rounds]
+
+Sends `requests_number` (5000 by default) cached GET /topics/1/ requests, the cheapest request there is so the
+throttles weigh the most, straight to Django's WSGIHandler with:
+
+* no throttle classes at all,
+* the throttle classes with None rates (the default settings),
+* client and topic rates high enough never to throttle, buckets in LocalMemoryStore,
+* the same with buckets in SharedMemoryStore.
+
+Configurations take turns `rounds` (5) times, reported are the best p50 latency and throughput of the rounds, the
+time of the throttle checks of a request on their own (APIView.check_throttles()) and the cost of one bucket update
+of each store.
+"""
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.common import setup_django
+
+HIGH_RATES = {'client': '1000000/s', 'topic': '1000000/s'}
+
+
+def run(requests_number, rounds):
+    setup_django()
+    from django.conf import settings
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.test.utils import override_settings
+    from rest_framework.views import APIView
+    from chat import throttling
+    from chat.models import Topic
+
+    Topic.objects.create(id=1, title='Benchmark topic 1')
+    handler = WSGIHandler()
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/topics/1/', 'QUERY_STRING': '', 'SCRIPT_NAME': '',
+               'SERVER_NAME': 'testserver', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+               'HTTP_HOST': 'testserver', 'HTTP_ACCEPT': 'application/json', 'REMOTE_ADDR': '10.0.0.1',
+               'wsgi.url_scheme': 'http', 'wsgi.errors': sys.stderr, 'wsgi.multithread': False,
+               'wsgi.multiprocess': False, 'wsgi.run_once': False}
+
+    def get():
+        statuses = []
+        response = handler(dict(environ, **{'wsgi.input': io.BytesIO()}),
+                           lambda status, headers, exc_info=None: statuses.append(status))
+        b''.join(response)
+        response.close()
+        assert statuses[0].startswith('200'), statuses[0]
+
+    directory = tempfile.TemporaryDirectory()
+    throttle_classes = APIView.throttle_classes
+    rates = lambda rates: {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': rates}  # noqa: E731
+    configurations = {
+        'no throttle classes': ([], override_settings()),
+        'throttles, None rates': (throttle_classes, override_settings()),
+        'LocalMemoryStore': (throttle_classes, override_settings(
+            REST_FRAMEWORK=rates(HIGH_RATES),
+            CHAT_THROTTLE_STORE={'BACKEND': 'chat.throttling.LocalMemoryStore'})),
+        'SharedMemoryStore': (throttle_classes, override_settings(
+            REST_FRAMEWORK=rates(HIGH_RATES),
+            CHAT_THROTTLE_STORE={'BACKEND': 'chat.throttling.SharedMemoryStore',
+                                 'OPTIONS': {'path': os.path.join(directory.name, 'buckets')}})),
+    }
+    results = {name: [] for name in configurations}
+    for _ in range(rounds):
+        for name, (classes, settings_override) in configurations.items():
+            APIView.throttle_classes = classes
+            with settings_override:
+                for _ in range(200):
+                    get()
+                latencies = []
+                started = time.perf_counter()
+                for _ in range(requests_number):
+                    sent = time.perf_counter()
+                    get()
+                    latencies.append((time.perf_counter() - sent) * 1000)
+                results[name].append((statistics.median(latencies),
+                                      requests_number / (time.perf_counter() - started)))
+    APIView.throttle_classes = throttle_classes
+
+    print(f'{requests_number} cached GET /topics/1/ x {rounds} rounds')
+    baseline = min(p50 for p50, _ in results['no throttle classes'])
+    for name, (classes, settings_override) in configurations.items():
+        p50 = min(p50 for p50, _ in results[name])
+        print(f'{name:<22} p50 {p50 * 1000:7.1f}us {max(rps for _, rps in results[name]):7.0f} req/s  '
+              f'{(p50 - baseline) * 1000:+6.1f}us  check_throttles() {time_checks(classes, settings_override):5.2f}us')
+
+    for store in (throttling.LocalMemoryStore(), throttling.SharedMemoryStore(os.path.join(directory.name, 'micro'))):
+        keys = [f'client:address:10.0.{index // 256}.{index % 256}' for index in range(1000)]
+        started = time.perf_counter()
+        for index in range(100_000):
+            store.consume(keys[index % 1000], 1_000_000, 1_000_000, time.time())
+        print(f'{type(store).__name__:<22} consume() {(time.perf_counter() - started) * 10:5.2f}us')
+    directory.cleanup()
+
+
+def time_checks(throttle_classes, settings_override, number=100_000):
+    """Microseconds per APIView.check_throttles() of a GET of the topic view"""
+    from rest_framework.test import APIRequestFactory
+    from chat.views import TopicViewSet
+
+    view = TopicViewSet(throttle_classes=throttle_classes, kwargs={'pk': '1'}, action_map={'get': 'retrieve'})
+    request = view.initialize_request(APIRequestFactory().get('/topics/1/', REMOTE_ADDR='10.0.0.1'))
+    with settings_override:
+        started = time.perf_counter()
+        for _ in range(number):
+            view.check_throttles(request)
+    return (time.perf_counter() - started) / number * 1_000_000
+
+
+if __name__ == '__main__':
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    run(*(arguments + [5000, 5][len(arguments):]))
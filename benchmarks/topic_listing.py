@@ -0,0 +1,67 @@
+"""
+Per-topic message listing latency with and without message_topic_created_id_idx.
+
+    python -m benchmarks.topic_listing [messages_number ...]
+
+For every table size the first page and a deep page (90% into the topic) of /topics/1/messages/ are requested
+through MessageFromTopicViewSet, first without the composite index (only the implicit FK index on topic_id),
+then with it. The SQLite query plan of the deep page is printed for both runs.
+"""
+import sys
+
+from benchmarks.common import measure, seed_messages, setup_django, summary
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+INDEX_NAME = 'message_topic_created_id_idx'
+
+
+def run(sizes):
+    setup_django()
+
+    from django.db import connection as db_connection
+    from rest_framework.test import APIRequestFactory
+    from chat.models import Topic, Message
+    from chat.pagination import KeysetCursorPagination
+    from chat.views import MessageFromTopicViewSet
+
+    factory = APIRequestFactory()
+    view = MessageFromTopicViewSet.as_view({'get': 'list'})
+    index = next(index for index in Message._meta.indexes if index.name == INDEX_NAME)
+
+    def get_page(url, topic_id):
+        response = view(factory.get(url), topic_id=topic_id)
+        response.render()
+        return response
+
+    for size in sizes:
+        # the index is left in place after the previous size, like the migrated schema
+        with db_connection.cursor() as cursor_db:
+            cursor_db.execute(f'DELETE FROM {Message._meta.db_table}')
+            cursor_db.execute(f'DELETE FROM {Topic._meta.db_table}')
+        topic_id = seed_messages(size)
+
+        topic_messages = Message.objects.filter(topic=topic_id).order_by('created_at', 'id')
+        anchor = topic_messages[int(topic_messages.count() * 0.9)]
+        cursor = KeysetCursorPagination().encode_cursor(anchor)
+        first_url = f'/topics/{topic_id}/messages/'
+        deep_url = f'{first_url}?after={cursor}'
+        deep_queryset = topic_messages.filter(KeysetCursorPagination._after_filter((anchor.created_at, anchor.id)))
+
+        for with_index in (False, True):
+            with db_connection.schema_editor() as editor:
+                if with_index:
+                    editor.add_index(Message, index)
+                else:
+                    editor.remove_index(Message, index)
+            with db_connection.cursor() as cursor_db:
+                cursor_db.execute('ANALYZE')
+
+            first = summary(measure(lambda: get_page(first_url, topic_id)))
+            deep = summary(measure(lambda: get_page(deep_url, topic_id)))
+            label = 'after ' if with_index else 'before'
+            print(f'{size:>9} messages {label}  first page {first}  deep page {deep}')
+            print(f'{"":>9} plan: {deep_queryset[:101].explain()}')
+
+
+if __name__ == '__main__':
+    run([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,78 @@
+"""
+Delivery latency of the WebSocket fan-out.
+
+    python -m benchmarks.websocket_fanout [subscribers] [events] [interval_ms]
+
+Opens `subscribers` connections (10k by default) to chat.websocket.topic_messages_socket in one event loop, with
+in-memory ASGI receive/send channels instead of a network server, and publishes `events` message events from a
+worker thread, every interval_ms (250 by default), the way the views do. Reports the time from publish() to the
+frame handed to the server's send(). The last subscriber of an event waits for the frames of all the others, so
+with a single event loop the latency grows linearly with the number of subscribers.
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+
+from benchmarks.common import percentile, setup_django
+
+
+async def run(subscribers_number, events_number, interval_ms):
+    from chat.broadcast import get_broadcast, topic_channel
+    from chat.models import Topic
+    from chat.websocket import topic_messages_socket
+
+    topic = await asyncio.get_running_loop().run_in_executor(
+        None, lambda: Topic.objects.create(title='Benchmark topic'))
+    broadcast = get_broadcast()
+    latencies = []
+    delivered = asyncio.Event()
+    expected = subscribers_number * events_number
+
+    def make_send():
+        async def send(event):
+            if event['type'] == 'websocket.send':
+                latencies.append(time.perf_counter() - json.loads(event['text'])['message']['sent'])
+                if len(latencies) == expected:
+                    delivered.set()
+        return send
+
+    connections = []
+    for _ in range(subscribers_number):
+        received = asyncio.Queue()
+        received.put_nowait({'type': 'websocket.connect'})
+        scope = {'type': 'websocket', 'path': f'/ws/topics/{topic.id}/messages/'}
+        connections.append((received, asyncio.ensure_future(topic_messages_socket(scope, received.get, make_send()))))
+
+    started = time.perf_counter()
+    while broadcast.subscribers_count(topic_channel(topic.id)) < subscribers_number:
+        await asyncio.sleep(0.01)
+    print(f'{subscribers_number} subscribers connected in {time.perf_counter() - started:.2f}s')
+
+    def publish():
+        for id in range(events_number):
+            broadcast.publish(topic_channel(topic.id), {'event': 'created',
+                                                        'message': {'id': id, 'topic': topic.id,
+                                                                    'sent': time.perf_counter()}})
+            time.sleep(interval_ms / 1000)
+
+    started = time.perf_counter()
+    threading.Thread(target=publish).start()
+    await asyncio.wait_for(delivered.wait(), timeout=60 + events_number)
+    elapsed = time.perf_counter() - started
+
+    for received, _ in connections:
+        received.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+    await asyncio.gather(*(task for _, task in connections))
+
+    latencies_ms = [latency * 1000 for latency in latencies]
+    print(f'{len(latencies)} frames in {elapsed:.2f}s  '
+          f'p50 {percentile(latencies_ms, 50):.2f}ms  p95 {percentile(latencies_ms, 95):.2f}ms  '
+          f'p99 {percentile(latencies_ms, 99):.2f}ms  max {max(latencies_ms):.2f}ms')
+
+
+if __name__ == '__main__':
+    setup_django()
+    arguments = [int(argument) for argument in sys.argv[1:]]
+    asyncio.run(run(*(arguments + [10_000, 20, 250][len(arguments):])))
@@ -0,0 +1,273 @@
+"""
+Cold storage of old messages: manage.py archive_messages moves messages older than AGE_DAYS out of the message table
+into compressed, append-only segment files, one series per topic, so the table and its indexes only hold the recent
+messages most reads touch.
+
+Messages are archived in blocks of BLOCK_MESSAGES in (created_at, id) order. A block is one compressed frame
+appended to the segment file DIRECTORY/<topic id>/<segment>.seg, a new segment is started once the file reaches
+SEGMENT_BYTES. The offset index is kept in the database: models.ArchiveBlock locates every block and holds its
+first and last (created_at, id), models.ArchivedMessage maps the id of every archived message to its block. The rows
+of a block are inserted and its messages deleted in one transaction after the frame is written and synced, so a
+failed run leaves at most unreferenced bytes at the end of a segment.
+
+Archived messages are read-only and read transparently (see views.ArchiveReadMixin): pages of the message lists
+merge the archived messages of the page with the others, retrieve and export fall back to or include them. A page
+decompresses only the blocks overlapping it, decoded blocks are kept in an LRU of BLOCK_CACHE_SIZE. Topic counters
+keep counting archived messages. The changes feed and search only see messages in the table.
+
+Configured by settings.CHAT_ARCHIVE, None disables archiving and archive reads:
+
+    CHAT_ARCHIVE = {
+        'DIRECTORY': BASE_DIR / 'archive',
+        'AGE_DAYS': 30,
+        'COMPRESSION': 'zlib',
+        'BLOCK_MESSAGES': 256,
+        'SEGMENT_BYTES': 64 * 1024 * 1024,
+    }
+
+COMPRESSION is 'zlib', or 'zstd' when the zstandard package is installed. Every block records its codec, so it can
+be changed at any time. The directory has to be shared by all servers reading the archive.
+"""
+import datetime
+import heapq
+import json
+import os
+import shutil
+import zlib
+from functools import lru_cache
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .cache import invalidate_topics
+from .models import ArchiveBlock, ArchivedMessage, IdSequence, Message, Topic
+from .routers import get_write_database
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DEFAULTS = {
+    'AGE_DAYS': 30,
+    'COMPRESSION': 'zlib',
+    'BLOCK_MESSAGES': 256,
+    'SEGMENT_BYTES': 64 * 1024 * 1024,
+}
+# decoded blocks kept in memory, blocks never change once written
+BLOCK_CACHE_SIZE = 256
+
+message_key = attrgetter('created_at', 'id')
+
+
+class MessageArchived(APIException):
+    """A write of an archived message"""
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The message is archived and cannot be changed.'
+    default_code = 'message_archived'
+
+
+def is_enabled():
+    return getattr(settings, 'CHAT_ARCHIVE', None) is not None
+
+
+def get_config():
+    config = dict(DEFAULTS, **settings.CHAT_ARCHIVE)
+    if 'DIRECTORY' not in config:
+        raise ImproperlyConfigured('CHAT_ARCHIVE needs a DIRECTORY')
+    if config['COMPRESSION'] not in ('zlib', 'zstd'):
+        raise ImproperlyConfigured(f"CHAT_ARCHIVE COMPRESSION must be zlib or zstd, not {config['COMPRESSION']!r}")
+    if config['COMPRESSION'] == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured('CHAT_ARCHIVE COMPRESSION zstd needs the zstandard package')
+    return config
+
+
+def compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(write_checksum=True).compress(data)
+    return zlib.compress(data)
+
+
+def decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImproperlyConfigured('Reading zstd blocks of the archive needs the zstandard package')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def get_cutoff(age_days=None):
+    """Messages created before the cutoff are archived"""
+    if age_days is None:
+        age_days = get_config()['AGE_DAYS']
+    return timezone.now() - datetime.timedelta(days=age_days)
+
+
+def segment_path(topic_id, segment):
+    return os.path.join(get_config()['DIRECTORY'], str(topic_id), f'{segment:06d}.seg')
+
+
+# writing
+
+def archive_messages(cutoff, topic_ids=None):
+    """Archives the messages created before cutoff, of the topics topic_ids or of all topics, returns their number"""
+    messages = Message.objects.filter(created_at__lt=cutoff)
+    if topic_ids is not None:
+        messages = messages.filter(topic__in=topic_ids)
+    topic_ids = list(messages.order_by('topic').values_list('topic', flat=True).distinct())
+    return sum(archive_topic(topic_id, cutoff) for topic_id in topic_ids)
+
+
+def archive_topic(topic_id, cutoff):
+    """Archives the messages of the topic created before cutoff a block at a time, returns their number"""
+    config = get_config()
+    archived = 0
+    while True:
+        with transaction.atomic(using=get_write_database()):
+            # message writes bump their topic first, holding its row keeps them out until the block is archived,
+            # so no message changes between being read and deleted
+            if not Topic.objects.filter(id=topic_id).update(change_seq=F('change_seq')):
+                return archived
+            messages = list(Message.objects.filter(topic=topic_id, created_at__lt=cutoff)
+                            .order_by('created_at', 'id')[:config['BLOCK_MESSAGES']])
+            if not messages:
+                return archived
+            _write_block(topic_id, messages, config)
+            Message.objects.filter(id__in=[message.id for message in messages]).delete()
+            invalidate_topics(topic_id)
+        archived += len(messages)
+
+
+def _write_block(topic_id, messages, config):
+    codec = config['COMPRESSION']
+    records = [[message.id, message.created_at.isoformat(), message.change_seq, message.text] for message in messages]
+    data = compress(json.dumps(records, ensure_ascii=False, separators=(',', ':')).encode('utf-8'), codec)
+    segment, offset = _append(topic_id, data, config)
+    block = ArchiveBlock(topic_id=topic_id, segment=segment, offset=offset, length=len(data), codec=codec,
+                         count=len(messages), first_created_at=messages[0].created_at, first_id=messages[0].id,
+                         last_created_at=messages[-1].created_at, last_id=messages[-1].id)
+    # block ids stay unique across shards, topics are moved with their blocks (see chat.sharding)
+    IdSequence.assign_ids([block])
+    block.save()
+    ArchivedMessage.objects.bulk_create([ArchivedMessage(id=message.id, block=block) for message in messages])
+    return block
+
+
+def _append(topic_id, data, config):
+    """Appends data to the last segment of the topic, or a new one when it is full, returns (segment, offset)"""
+    segment = ArchiveBlock.objects.filter(topic=topic_id).order_by('-segment').values_list(
+        'segment', flat=True).first() or 1
+    path = segment_path(topic_id, segment)
+    if os.path.exists(path) and os.path.getsize(path) >= config['SEGMENT_BYTES']:
+        segment += 1
+        path = segment_path(topic_id, segment)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as file:
+        offset = file.seek(0, os.SEEK_END)
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    return segment, offset
+
+
+def delete_topic_files(topic_id):
+    """Removes the segments of a deleted topic"""
+    shutil.rmtree(os.path.join(get_config()['DIRECTORY'], str(topic_id)), ignore_errors=True)
+
+
+# reading
+
+def read_block(block):
+    """Messages of block in (created_at, id) order, unsaved instances"""
+    records = _read_records(block.id, segment_path(block.topic_id, block.segment), block.offset, block.length,
+                            block.codec)
+    messages = []
+    for message_id, created_at, change_seq, text in records:
+        message = Message(id=message_id, topic_id=block.topic_id, text=text, change_seq=change_seq,
+                          created_at=datetime.datetime.fromisoformat(created_at))
+        message._state.adding = False
+        messages.append(message)
+    return messages
+
+
+@lru_cache(maxsize=BLOCK_CACHE_SIZE)
+def _read_records(block_id, path, offset, length, codec):
+    # keyed by the block id too, the segments of a deleted topic are written again at the same places when its id
+    # comes back
+    with open(path, 'rb') as file:
+        file.seek(offset)
+        data = file.read(length)
+    return tuple(json.loads(decompress(data, codec)))
+
+
+def get_message(message_id, topic_id=None):
+    """The archived message, None when it is not archived (or not in the topic)"""
+    entries = ArchivedMessage.objects.filter(id=message_id).select_related('block')
+    if topic_id is not None:
+        entries = entries.filter(block__topic=topic_id)
+    entry = entries.first()
+    if entry is None:
+        return None
+    return next(message for message in read_block(entry.block) if message.id == entry.id)
+
+
+def read_page(after=None, before=None, limit=100, topic_id=None):
+    """
+    Archived messages of a page of the topic (of all topics when topic_id is None) in page order, like
+    chat.pagination.KeysetCursorPagination reads them: the limit first after the (created_at, id) after, or the
+    limit last before before, in descending order.
+
+    Blocks are read in the order of their first message (last message going backwards) until the next block
+    starts after the page, blocks of a topic only overlap when messages were added after an older one was archived.
+    """
+    blocks = ArchiveBlock.objects.all()
+    if topic_id is not None:
+        blocks = blocks.filter(topic=topic_id)
+    if before is not None:
+        blocks = blocks.filter(_first_before(before)).order_by('-last_created_at', '-last_id')
+        bound, in_page, reverse = attrgetter('last_created_at', 'last_id'), (lambda key: key < before), True
+    else:
+        if after is not None:
+            blocks = blocks.filter(_last_after(after))
+        blocks = blocks.order_by('first_created_at', 'first_id')
+        bound, in_page, reverse = attrgetter('first_created_at', 'first_id'), (lambda key: key > after), False
+
+    page = []
+    for block in blocks.iterator(chunk_size=100):
+        if len(page) >= limit and (message_key(page[-1]) > bound(block) if reverse
+                                   else message_key(page[-1]) < bound(block)):
+            break
+        messages = read_block(block)
+        if after is not None or before is not None:
+            messages = [message for message in messages if in_page(message_key(message))]
+        page = sorted(page + messages, key=message_key, reverse=reverse)[:limit]
+    return page
+
+
+def iter_topic(topic_id, using=None):
+    """All archived messages of the topic in (created_at, id) order, holding only overlapping blocks"""
+    pending = []
+    blocks = ArchiveBlock.objects.using(using).filter(topic=topic_id).order_by('first_created_at', 'first_id')
+    for block in blocks.iterator():
+        while pending and pending[0][0] < (block.first_created_at, block.first_id):
+            yield heapq.heappop(pending)[1]
+        for message in read_block(block):
+            heapq.heappush(pending, (message_key(message), message))
+    while pending:
+        yield heapq.heappop(pending)[1]
+
+
+def _first_before(cursor):
+    created_at, message_id = cursor
+    return Q(first_created_at__lt=created_at) | Q(first_created_at=created_at, first_id__lt=message_id)
+
+
+def _last_after(cursor):
+    created_at, message_id = cursor
+    return Q(last_created_at__gt=created_at) | Q(last_created_at=created_at, last_id__gt=message_id)
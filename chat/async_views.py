@@ -0,0 +1,162 @@
+"""
+Async request path for list, retrieve and create of topics and messages, served under ASGI with
+settings.CHAT_ASYNC_VIEWS (see chatting.asgi).
+
+Viewsets with AsyncViewSetMixin implement alist/aretrieve/acreate with the async ORM. async_urlpatterns() rebuilds
+their views in URL patterns as async views, chatting.urls_async routes the same URLs to them. Everything else runs
+the sync view in a thread like before: other actions, the browsable API, requests with credentials, whose
+authentication may query the database, and whatever runs_sync() sends there (sharded topics, see chat.sharding,
+and archived messages, see chat.archive).
+
+The async ORM has no transactions, so acreate validates the data in the event loop (related objects are loaded up
+front by aget_create_context) and goes to a thread only for the save.
+"""
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
+from django.http import Http404, HttpResponse
+from django.urls import URLPattern, URLResolver
+from rest_framework import status
+from rest_framework.response import Response
+
+
+class AsyncViewSetMixin:
+    async_actions = ('list', 'retrieve', 'create')
+    # set on the variants returned by async_viewset()
+    serve_async = False
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        sync_view = super().as_view(actions, **initkwargs)
+        if not cls.serve_async or not any(action in cls.async_actions for action in actions.values()):
+            return sync_view
+        run_sync_view = sync_to_async(sync_view)
+
+        async def view(request, *args, **kwargs):
+            method = request.method.lower()
+            action = actions.get(method, actions.get('get') if method == 'head' else None)
+            if action not in cls.async_actions or cls.runs_sync(request):
+                return await run_sync_view(request, *args, **kwargs)
+
+            self = cls(**initkwargs)
+            self.action_map = dict(actions, **{method: action})
+            self.args = args
+            self.kwargs = kwargs
+            self.request = request
+            drf_request = self.initialize_request(request, *args, **kwargs)
+            self.request = drf_request
+            self.headers = self.default_response_headers
+
+            try:
+                # content negotiation, permissions and throttles, authentication without credentials is a no-op
+                self.initial(drf_request, *args, **kwargs)
+                if drf_request.accepted_renderer.format != 'json':
+                    return await run_sync_view(request, *args, **kwargs)
+                response = await getattr(self, f'a{action}')(drf_request, *args, **kwargs)
+            except Exception as exc:
+                response = self.handle_exception(exc)
+
+            self.response = self.finalize_response(drf_request, response, *args, **kwargs)
+            return self._render(self.response)
+
+        view.cls = cls
+        view.initkwargs = initkwargs
+        view.actions = actions
+        # like csrf_exempt(), which wraps the coroutine function in a sync function before Django 5.0
+        view.csrf_exempt = True
+        return view
+
+    @classmethod
+    def runs_sync(cls, request):
+        """Whether the request goes to the sync view although its action has an async variant"""
+        return cls._has_credentials(request)
+
+    @staticmethod
+    def _has_credentials(request):
+        return 'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES
+
+    @staticmethod
+    def _render(response):
+        # Django renders a deferred response in a thread, a rendered plain response is returned as it is
+        response.render()
+        return HttpResponse(response.content, status=response.status_code, headers=dict(response.items()))
+
+    async def alist(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.paginator is None:
+            return Response(self.get_serializer([obj async for obj in queryset], many=True).data)
+        page = await self.paginator.apaginate_queryset(queryset, request, view=self)
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        return Response(self.get_serializer(instance).data)
+
+    async def acreate(self, request, *args, **kwargs):
+        data = self.get_create_data(request)
+        serializer = self.get_serializer(data=data, context=await self.aget_create_context(data))
+        serializer.is_valid(raise_exception=True)
+        await self.aperform_create(serializer)
+        headers = self.get_success_headers(serializer.data)
+        return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+    async def aperform_create(self, serializer):
+        await sync_to_async(self.perform_create)(serializer)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        obj = await self._aget_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    def get_create_data(self, request):
+        return request.data
+
+    async def aget_create_context(self, data):
+        """Serializer context for validating data in the event loop, related objects must be loaded here"""
+        return self.get_serializer_context()
+
+    @staticmethod
+    async def _aget_or_404(queryset, **filter_kwargs):
+        # like rest_framework.generics.get_object_or_404
+        try:
+            return await queryset.aget(**filter_kwargs)
+        except (ObjectDoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404
+
+
+async def iterate_in_thread(iterator):
+    """
+    Async iterator over a sync one, reading it one item at a time in the thread of the sync views. A streaming
+    response of a sync iterator is read to the end before anything is sent under ASGI, of this one as it is read.
+    Thread sensitive, so a database cursor read by the iterator stays in the thread of its connection.
+    """
+    read = sync_to_async(partial(next, iterator, _END))
+    while (item := await read()) is not _END:
+        yield item
+
+
+_END = object()
+
+
+def async_viewset(viewset):
+    """Variant of viewset serving its async actions with async views, for routers and as_view()"""
+    return type(viewset.__name__, (viewset,), {'serve_async': True, '__module__': viewset.__module__})
+
+
+def async_urlpatterns(urlpatterns):
+    """Copy of urlpatterns (with included ones) where views of AsyncViewSetMixin viewsets are async views"""
+    patterns = []
+    for pattern in urlpatterns:
+        if isinstance(pattern, URLResolver):
+            pattern = URLResolver(pattern.pattern, async_urlpatterns(pattern.url_patterns), pattern.default_kwargs,
+                                  pattern.app_name, pattern.namespace)
+        elif issubclass(getattr(pattern.callback, 'cls', object), AsyncViewSetMixin):
+            callback = pattern.callback
+            view = async_viewset(callback.cls).as_view(dict(callback.actions), **callback.initkwargs)
+            pattern = URLPattern(pattern.pattern, view, pattern.default_args, pattern.name)
+        patterns.append(pattern)
+    return patterns
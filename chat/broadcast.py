@@ -0,0 +1,214 @@
+"""
+Broadcast layer pushing message events to WebSocket subscribers.
+
+Views publish from worker threads, subscribers live in the event loop of the ASGI server. The backend is picked by
+settings.CHAT_BROADCAST:
+
+* InMemoryBroadcast - fan-out inside one process,
+* LocalSocketBroadcast - fan-out between processes on one host, every process binds a unix datagram socket in
+  a shared directory and publishers send each event to all sockets found there.
+
+Subscribers have bounded queues. A consumer that falls behind is not allowed to grow memory, its queue is dropped
+and it receives OVERFLOW, after which the socket is closed and the client has to resync.
+"""
+import asyncio
+import json
+import os
+import socket
+import threading
+import uuid
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework.utils.encoders import JSONEncoder
+
+from .routers import get_write_database
+
+OVERFLOW = object()
+
+
+def topic_channel(topic_id):
+    return f'topic.{topic_id}'
+
+
+class Subscription:
+    def __init__(self, broadcast, channel, max_queue):
+        self.broadcast = broadcast
+        self.channel = channel
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.overflowed = False
+
+    def deliver(self, message):
+        """Called in the subscriber's event loop"""
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(OVERFLOW)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def close(self):
+        self.broadcast.unsubscribe(self)
+
+
+class BaseBroadcast:
+    def __init__(self, max_queue=100):
+        self.max_queue = max_queue
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel):
+        """Must be called from a running event loop, events are delivered to that loop"""
+        subscription = Subscription(self, channel, self.max_queue)
+        with self._lock:
+            self._subscriptions[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscriptions.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscriptions[subscription.channel]
+
+    def publish(self, channel, message):
+        """Send message (JSON serializable) to every subscriber of channel, safe to call from any thread"""
+        raise NotImplementedError('publish() must be implemented')
+
+    def subscribers_count(self, channel):
+        with self._lock:
+            return len(self._subscriptions.get(channel, ()))
+
+    def _dispatch(self, channel, text):
+        with self._lock:
+            subscribers = list(self._subscriptions.get(channel, ()))
+        # one wake-up per event loop instead of one per subscriber
+        by_loop = defaultdict(list)
+        for subscription in subscribers:
+            by_loop[subscription.loop].append(subscription)
+        for loop, loop_subscribers in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(self._deliver_all, loop_subscribers, text)
+            except RuntimeError:
+                # loop already closed, its subscribers are gone
+                pass
+
+    @staticmethod
+    def _deliver_all(subscribers, text):
+        for subscription in subscribers:
+            subscription.deliver(text)
+
+    @staticmethod
+    def encode(message):
+        return json.dumps(message, cls=JSONEncoder)
+
+
+class InMemoryBroadcast(BaseBroadcast):
+
+    def publish(self, channel, message):
+        self._dispatch(channel, self.encode(message))
+
+
+class LocalSocketBroadcast(BaseBroadcast):
+    """
+    Multi-process stand-in for a pub/sub server: every process receiving events binds
+    <path>/<random>.sock and publishers send a datagram to each socket in path.
+    """
+
+    max_datagram = 1 << 20
+
+    def __init__(self, path, max_queue=100):
+        super().__init__(max_queue=max_queue)
+        self.path = str(path)
+        self._reader = None
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sender.setblocking(False)
+        os.makedirs(self.path, exist_ok=True)
+
+    def subscribe(self, channel):
+        self._ensure_reader()
+        return super().subscribe(channel)
+
+    def publish(self, channel, message):
+        datagram = json.dumps({'channel': channel, 'text': self.encode(message)}).encode('utf-8')
+        for name in os.listdir(self.path):
+            if not name.endswith('.sock'):
+                continue
+            address = os.path.join(self.path, name)
+            try:
+                self._sender.sendto(datagram, address)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # process owning the socket is gone
+                self._remove(address)
+            except OSError:
+                # receiving process is not keeping up (or the event is too big for a datagram), drop the event
+                # like for an overflowing subscriber
+                pass
+
+    def close(self):
+        if self._reader is not None:
+            loop, reader = self._reader
+            loop.remove_reader(reader.fileno())
+            address = reader.getsockname()
+            reader.close()
+            self._remove(address)
+            self._reader = None
+
+    def _ensure_reader(self):
+        with self._lock:
+            if self._reader is not None:
+                return
+            loop = asyncio.get_running_loop()
+            reader = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            reader.bind(os.path.join(self.path, f'{uuid.uuid4().hex}.sock'))
+            reader.setblocking(False)
+            loop.add_reader(reader.fileno(), self._on_datagram, reader)
+            self._reader = (loop, reader)
+
+    def _on_datagram(self, reader):
+        while True:
+            try:
+                datagram = reader.recv(self.max_datagram)
+            except BlockingIOError:
+                return
+            event = json.loads(datagram)
+            self._dispatch(event['channel'], event['text'])
+
+    @staticmethod
+    def _remove(address):
+        try:
+            os.unlink(address)
+        except FileNotFoundError:
+            pass
+
+
+_broadcast = None
+_broadcast_lock = threading.Lock()
+
+
+def get_broadcast():
+    global _broadcast
+    if _broadcast is None:
+        with _broadcast_lock:
+            if _broadcast is None:
+                config = getattr(settings, 'CHAT_BROADCAST', {})
+                backend = import_string(config.get('BACKEND', 'chat.broadcast.InMemoryBroadcast'))
+                _broadcast = backend(**config.get('OPTIONS', {}))
+    return _broadcast
+
+
+def publish_message_event(event, message):
+    """Publish a message event to the topic channel once the current transaction commits"""
+    payload = {'event': event, 'message': dict(message)}
+    transaction.on_commit(lambda: get_broadcast().publish(topic_channel(message['topic']), payload),
+                          using=get_write_database())
@@ -0,0 +1,147 @@
+"""
+Response cache for topic and message reads.
+
+Entries are grouped in scopes ('topics' for the topic list, 'topic:<id>' for a topic and its messages). Every
+scope has a generation number stored in the cache and keys of cached responses contain it, so a write invalidates
+a whole scope by bumping one number; entries of old generations are never read again and age out of the LRU.
+
+Generations are bumped after commit and read before the database is queried, so a response read from a snapshot
+of the default database older than a write can only be stored under the generation preceding that write. A replica
+may not have received a write yet when the generation is bumped, responses read from replicas (see chat.routers) are
+served from the cache but never stored in it.
+
+Configured by settings.CHAT_RESPONSE_CACHE, the alias of a cache from settings.CACHES (None disables caching).
+Generations live in that cache, with several worker processes it has to be shared by all of them (Redis,
+Memcached), otherwise the other workers keep serving what a write replaced until their entries expire.
+"""
+import hashlib
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .routers import get_write_database
+
+# LocMemCache storage is shared by all instances with the same LOCATION (there is one instance per thread),
+# so are the eviction counters
+_evictions = defaultdict(int)
+
+
+class LRULocMemCache(LocMemCache):
+    """Local memory cache bounded by MAX_ENTRIES, evicting the least recently used entry when full"""
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._name = name
+
+    def _cull(self):
+        # called with the lock held, entries are kept in most recently used first order
+        key, _ = self._cache.popitem()
+        del self._expire_info[key]
+        _evictions[self._name] += 1
+
+    @property
+    def evictions(self):
+        return _evictions[self._name]
+
+
+class ResponseCache:
+    def __init__(self, alias):
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def make_key(self, scope, name):
+        """Key of a response in scope, must be computed before the response is read from the database"""
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return f'chat:{scope}:{self.get_generation(scope)}:{digest}'
+
+    def get(self, key):
+        value = self.cache.get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    def invalidate(self, scope):
+        transaction.on_commit(lambda: self._bump_generation(scope), using=get_write_database())
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': getattr(self.cache, 'evictions', None),
+        }
+
+    def get_generation(self, scope):
+        """Number changed by every invalidation of scope, e.g. for versions of what it holds"""
+        key = f'chat:{scope}:generation'
+        generation = self.cache.get(key)
+        if generation is None:
+            # a new or evicted scope starts from the clock, not from 0, so old entries cannot come back
+            self.cache.add(key, time.time_ns(), timeout=None)
+            generation = self.cache.get(key)
+        return generation
+
+    def _bump_generation(self, scope):
+        key = f'chat:{scope}:generation'
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, time.time_ns(), timeout=None)
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """Returns the ResponseCache or None when caching is disabled"""
+    global _response_cache
+    alias = getattr(settings, 'CHAT_RESPONSE_CACHE', None)
+    if alias is None:
+        return None
+    if _response_cache is None or _response_cache.alias != alias:
+        with _response_cache_lock:
+            if _response_cache is None or _response_cache.alias != alias:
+                _response_cache = ResponseCache(alias)
+    return _response_cache
+
+
+def topic_scope(topic_id):
+    return f'topic:{topic_id}'
+
+
+TOPICS_SCOPE = 'topics'
+# topic lists embedding messages (?include=latest_messages), changed by every write of a topic or message
+TOPICS_WITH_MESSAGES_SCOPE = 'topics:messages'
+
+
+def invalidate_topics(*topic_ids, topic_list=False):
+    """
+    Drops cached responses of the given topics (their details and messages) and optionally the topic list. Topic
+    lists embedding messages are dropped in any case.
+    """
+    response_cache = get_response_cache()
+    if response_cache is None:
+        return
+    for topic_id in topic_ids:
+        response_cache.invalidate(topic_scope(topic_id))
+    if topic_list:
+        response_cache.invalidate(TOPICS_SCOPE)
+    if topic_ids or topic_list:
+        response_cache.invalidate(TOPICS_WITH_MESSAGES_SCOPE)
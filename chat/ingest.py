@@ -0,0 +1,145 @@
+"""
+Write-behind ingestion of created messages with group commit.
+
+Every create of a message is an INSERT with a commit of its own, so a worker writes at most one message per fsync
+of the database (per journal sync with SQLite). With settings.CHAT_INGEST the create views validate the message with
+MessageSerializer as usual, build it with its id (models.IdSequence) and created_at in the request and hand it to the
+writer thread of the process. The writer takes what is queued, waiting up to MAX_DELAY_MS for more once it has a
+message, and inserts up to MAX_BATCH messages in one transaction with bulk_create_messages(), change sequences and
+topic counters included.
+
+Acknowledgement is durable: a request waits for the commit of its batch and answers 201 only then, so a message
+confirmed to the client is in the database. When a batch fails, its messages are inserted one at a time and only
+the failing ones fail their requests (TIMEOUT seconds bounds the wait). Requests waiting for the writer hold no
+database connection, async views wait outside the thread of sync_to_async.
+
+Configured by settings.CHAT_INGEST, None creates messages in the request like before:
+
+    CHAT_INGEST = {
+        'MAX_BATCH': 256,
+        'MAX_DELAY_MS': 2,
+        'TIMEOUT': 10,
+    }
+
+Message ids come from models.IdSequence while it is enabled, for every created message. Ids assigned by the database
+afterwards continue after them on SQLite, a PostgreSQL sequence has to be moved past them (setval) when disabling it.
+"""
+import queue
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from .models import IdSequence, Message
+from .routers import use_shard
+
+DEFAULTS = {
+    'MAX_BATCH': 256,
+    'MAX_DELAY_MS': 2,
+    'TIMEOUT': 10,
+}
+
+
+def is_enabled():
+    return getattr(settings, 'CHAT_INGEST', None) is not None
+
+
+def get_config():
+    return dict(DEFAULTS, **settings.CHAT_INGEST)
+
+
+class GroupCommitWriter:
+    """Thread inserting the submitted messages in batches, one transaction per batch and database"""
+
+    def __init__(self, max_batch=256, max_delay=0.002):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = queue.SimpleQueue()
+        self.batches = 0
+        self.messages = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, message, using=DEFAULT_DB_ALIAS):
+        """Queues message for insertion in the database using, the future resolves to it once committed"""
+        if message.pk is None:
+            IdSequence.assign_ids([message])
+        future = Future()
+        self.queue.put((message, using, future))
+        self._start()
+        return future
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='chat-ingest', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.max_delay
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.monotonic(), 0)))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def flush(self, batch):
+        """Inserts batch, (message, database, future) items, and resolves the futures"""
+        databases = defaultdict(list)
+        for item in batch:
+            databases[item[1]].append(item)
+        for using, items in databases.items():
+            try:
+                self._insert(using, [message for message, _, _ in items])
+            except Exception:
+                # one bad message (e.g. of a topic deleted meanwhile) fails only its own request
+                for message, _, future in items:
+                    try:
+                        self._insert(using, [message])
+                    except Exception as e:
+                        future.set_exception(e)
+                    else:
+                        future.set_result(message)
+            else:
+                for message, _, future in items:
+                    future.set_result(message)
+        self.batches += 1
+        self.messages += len(batch)
+
+    @staticmethod
+    def _insert(using, messages):
+        # queries of chat models and on_commit() callbacks (cache invalidation) go to the database of the batch
+        try:
+            with use_shard(using if getattr(settings, 'CHAT_SHARDS', None) else None), \
+                    transaction.atomic(using=using):
+                Message.objects.using(using).bulk_create_messages(messages)
+        except Exception:
+            # the connection may be broken, the next batch opens a new one
+            connections[using].close()
+            raise
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer():
+    """Writer of this process for the current CHAT_INGEST"""
+    config = get_config()
+    key = (config['MAX_BATCH'], config['MAX_DELAY_MS'])
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = GroupCommitWriter(config['MAX_BATCH'], config['MAX_DELAY_MS'] / 1000)
+        return _writers[key]
+
+
+def ingest(message, using=DEFAULT_DB_ALIAS):
+    """Inserts message through the writer and waits for the commit, raises what the insert raised"""
+    return get_writer().submit(message, using).result(timeout=get_config()['TIMEOUT'])
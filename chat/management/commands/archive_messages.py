@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import archive, sharding
+from chat.models import Message
+from chat.routers import use_shard
+
+
+class Command(BaseCommand):
+    help = 'Moves old messages to the compressed segment files of the archive (see chat.archive)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('topic_ids', nargs='*', type=int, help='topics to archive, all topics by default')
+        parser.add_argument('--age-days', type=float, help='archive messages older than this, AGE_DAYS of '
+                            'CHAT_ARCHIVE by default')
+        parser.add_argument('--dry-run', action='store_true', help='count the messages without archiving them')
+
+    def handle(self, *args, **options):
+        if not archive.is_enabled():
+            raise CommandError('Archiving is disabled, set CHAT_ARCHIVE')
+        cutoff = archive.get_cutoff(options['age_days'])
+        topic_ids = options['topic_ids'] or None
+
+        archived = 0
+        for shard in sharding.get_shards() or [None]:
+            with use_shard(shard):
+                if options['dry_run']:
+                    messages = Message.objects.filter(created_at__lt=cutoff)
+                    if topic_ids is not None:
+                        messages = messages.filter(topic__in=topic_ids)
+                    archived += messages.count()
+                else:
+                    archived += archive.archive_messages(cutoff, topic_ids)
+        verb = 'Would archive' if options['dry_run'] else 'Archived'
+        self.stdout.write(f'{verb} {archived} messages created before {cutoff.isoformat()}')
@@ -0,0 +1,116 @@
+import datetime
+import heapq
+import os
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from chat import archive
+from chat.models import ArchiveBlock, Topic, Message
+from chat.transfer import FORMATS, MESSAGE_FIELDS, TOPIC_FIELDS, Checkpoint, Progress, dump_path, encode_records
+
+
+class Command(BaseCommand):
+    help = ('Writes all topics and messages, archived ones included (see chat.archive), to a dump directory (see '
+            'chat.transfer) for manage.py chat_import')
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='created when missing, dump files in it are overwritten')
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--chunk-size', type=int, default=10000, help='rows read and written at once')
+        parser.add_argument('--resume', action='store_true', help='continue an interrupted export into directory')
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        os.makedirs(directory, exist_ok=True)
+        checkpoint = Checkpoint(directory, 'chat_export')
+        if options['resume']:
+            state = checkpoint.load()
+            if state is None:
+                raise CommandError(f'No interrupted export in {directory}')
+        else:
+            # messages of topics created after the topics were read are left out, they would have no topic
+            state = {'format': options['format'],
+                     'max_topic': Topic.objects.order_by('-id').values_list('id', flat=True).first() or 0}
+        self.directory = directory
+        self.checkpoint = checkpoint
+        self.state = state
+        self.chunk_size = options['chunk_size']
+        self.verbosity = options['verbosity']
+
+        self.export('topics', Topic.objects.filter(id__lte=state['max_topic']), TOPIC_FIELDS,
+                    ('id',), ('id', 'title', 'created_at'))
+        self.export('messages', Message.objects.filter(topic__lte=state['max_topic']), MESSAGE_FIELDS,
+                    ('topic_id', 'created_at', 'id'), ('id', 'topic_id', 'created_at', 'text'),
+                    archived=self.archived_messages)
+        checkpoint.delete()
+
+    def export(self, name, queryset, fields, ordering, columns, archived=None):
+        """
+        Writes rows of queryset in ordering, continuing after the last row written before. archived(last) returns
+        the rows kept out of the table after last, in ordering too, they are merged with those of queryset.
+        """
+        section = self.state.setdefault(name, {'offset': 0, 'last': None, 'done': False})
+        if section['done']:
+            return
+        format = self.state['format']
+        if section['last'] is not None:
+            queryset = queryset.filter(self._after(ordering, section['last']))
+        rows = queryset.order_by(*ordering).values_list(*columns).iterator(chunk_size=self.chunk_size)
+        positions = [columns.index(column) for column in ordering]
+        if archived is not None:
+            rows = heapq.merge(rows, archived(section['last']), key=itemgetter(*positions))
+        progress = Progress(self.stdout, name, self.verbosity)
+
+        with open(dump_path(self.directory, name, format), 'r+b' if section['offset'] else 'wb') as file:
+            # whatever was written after the last checkpoint is written again
+            file.truncate(section['offset'])
+            file.seek(section['offset'])
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) == self.chunk_size:
+                    self._write(file, section, chunk, fields, positions, progress)
+                    chunk = []
+            self._write(file, section, chunk, fields, positions, progress)
+        section['done'] = True
+        self.checkpoint.save(self.state)
+        progress.finish('Exported')
+
+    def archived_messages(self, last):
+        """Rows of archived messages in (topic_id, created_at, id) order, after last"""
+        if not archive.is_enabled():
+            return
+        blocks = ArchiveBlock.objects.filter(topic__lte=self.state['max_topic'])
+        if last is not None:
+            last = (last[0], parse_datetime(last[1]), last[2])
+            blocks = blocks.filter(topic__gte=last[0])
+        for topic_id in blocks.order_by('topic').values_list('topic', flat=True).distinct():
+            for message in archive.iter_topic(topic_id):
+                if last is None or (topic_id, message.created_at, message.id) > last:
+                    yield message.id, topic_id, message.created_at, message.text
+
+    def _write(self, file, section, chunk, fields, positions, progress):
+        if not chunk and section['offset']:
+            return
+        file.write(encode_records(chunk, fields, self.state['format'], header=not section['offset']))
+        file.flush()
+        section['offset'] = file.tell()
+        if chunk:
+            last = [chunk[-1][position] for position in positions]
+            section['last'] = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in last]
+        self.checkpoint.save(self.state)
+        progress.update(len(chunk))
+
+    @staticmethod
+    def _after(ordering, last):
+        """Rows after last in ordering, like the keyset cursors of chat.pagination"""
+        values = [parse_datetime(value) if column == 'created_at' else value
+                  for column, value in zip(ordering, last)]
+        condition = Q()
+        for index in reversed(range(len(ordering))):
+            equal = {column: value for column, value in zip(ordering[:index], values[:index])}
+            condition |= Q(**equal, **{f'{ordering[index]}__gt': values[index]})
+        return condition
@@ -0,0 +1,86 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import DatabaseError, connection, transaction
+
+from chat.cache import invalidate_topics
+from chat.models import Topic, Message
+from chat.transfer import MESSAGE_FIELDS, TOPIC_FIELDS, Checkpoint, Progress, dump_path, find_format, read_records
+
+
+class Command(BaseCommand):
+    help = 'Loads topics and messages from a dump directory written by manage.py chat_export, keeping their ids'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument('--batch-size', type=int, default=5000, help='rows inserted in one transaction')
+        parser.add_argument('--resume', action='store_true', help='continue an interrupted import of directory')
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        format = find_format(directory)
+        checkpoint = Checkpoint(directory, 'chat_import')
+        if options['resume']:
+            state = checkpoint.load()
+            if state is None:
+                raise CommandError(f'No interrupted import of {directory}')
+        elif checkpoint.exists():
+            raise CommandError(f'An interrupted import of {directory} left {checkpoint.path}, run again with '
+                               f'--resume or delete it')
+        else:
+            state = {}
+        self.checkpoint = checkpoint
+        self.state = state
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+
+        self.load(directory, 'topics', format, TOPIC_FIELDS, Topic, self.create_topics)
+        self.load(directory, 'messages', format, MESSAGE_FIELDS, Message, self.create_messages)
+
+        # ids were given explicitly, sequences (PostgreSQL) continue after them
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Topic, Message]):
+                cursor.execute(sql)
+        checkpoint.delete()
+
+    def load(self, directory, name, format, fields, model, create):
+        """Inserts records of the dump file with create() in batches, every batch in a transaction and a checkpoint"""
+        offset = self.state.get(name, 0)
+        # the batch after the checkpoint may have been committed just before an interruption
+        resumed = offset > 0
+        progress = Progress(self.stdout, name, self.verbosity)
+        with open(dump_path(directory, name, format), 'rb') as file:
+            file.seek(offset)
+            batch = []
+            for record, offset in read_records(file, fields, format):
+                batch.append(record)
+                if len(batch) == self.batch_size:
+                    self._insert(name, model, create, batch, offset, resumed, progress)
+                    batch = []
+                    resumed = False
+            self._insert(name, model, create, batch, offset, resumed, progress)
+        progress.finish('Imported')
+
+    def _insert(self, name, model, create, batch, offset, resumed, progress):
+        if resumed:
+            existing = set(model.objects.filter(id__in=[record['id'] for record in batch]).values_list('id', flat=True))
+            batch = [record for record in batch if record['id'] not in existing]
+        if batch:
+            try:
+                with transaction.atomic():
+                    create(batch)
+            except DatabaseError as e:
+                raise CommandError(f'Could not import {name} up to byte {offset}: {e}')
+        self.state[name] = offset
+        self.checkpoint.save(self.state)
+        progress.update(len(batch))
+
+    def create_topics(self, records):
+        Topic.objects.bulk_create([Topic(**record) for record in records])
+        invalidate_topics(topic_list=True)
+
+    def create_messages(self, records):
+        # maintains change sequences and counters of the topics like the bulk endpoints, the dump is grouped by
+        # topic so a batch updates one or two topics
+        Message.objects.bulk_create_messages([
+            Message(id=record['id'], topic_id=record['topic'], created_at=record['created_at'], text=record['text'])
+            for record in records])
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import sharding, tombstones
+from chat.routers import use_shard
+
+
+class Command(BaseCommand):
+    help = 'Deletes tombstones of deleted messages older than the retention (see chat.tombstones)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('topic_ids', nargs='*', type=int, help='topics to prune, all topics by default')
+        parser.add_argument('--days', type=float, help='prune tombstones older than this, '
+                            'CHAT_TOMBSTONE_RETENTION_DAYS by default')
+
+    def handle(self, *args, **options):
+        cutoff = tombstones.get_cutoff(options['days'])
+        if cutoff is None:
+            raise CommandError('Tombstones are kept, set CHAT_TOMBSTONE_RETENTION_DAYS or pass --days')
+        topic_ids = options['topic_ids'] or None
+
+        pruned = 0
+        for shard in sharding.get_shards() or [None]:
+            with use_shard(shard):
+                pruned += tombstones.prune_tombstones(cutoff, topic_ids)
+        self.stdout.write(f'Pruned {pruned} tombstones deleted before {cutoff.isoformat()}')
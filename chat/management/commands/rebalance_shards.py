@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from chat import sharding
+
+
+class Command(BaseCommand):
+    help = 'Moves topics to the shard the consistent hashing ring places them in (see chat.sharding)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--topic', type=int, nargs='+', dest='topic_ids', help='topics to move, all misplaced '
+                            'topics by default')
+        parser.add_argument('--to', dest='target', help='shard the topics given with --topic are moved to, the ring '
+                            'shard of every topic by default')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='messages copied at once')
+        parser.add_argument('--dry-run', action='store_true', help='list the moves without moving anything')
+
+    def handle(self, *args, **options):
+        if not sharding.is_sharded():
+            raise CommandError('Topics are not sharded, set CHAT_DB_SHARDS')
+        target = options['target']
+        if target is not None:
+            if not options['topic_ids']:
+                raise CommandError('--to needs --topic')
+            if target not in sharding.get_shards():
+                raise CommandError(f'Unknown shard {target}, the shards are {", ".join(sharding.get_shards())}')
+
+        registered = sharding.register_topics()
+        if registered:
+            self.stdout.write(f'Registered {registered} topics missing from the directory')
+        if options['topic_ids']:
+            moves = [(topic_id, sharding.shard_of_topic(topic_id), target or sharding.ring_shard(topic_id))
+                     for topic_id in options['topic_ids']]
+        else:
+            moves = list(sharding.misplaced_topics())
+
+        messages = 0
+        for topic_id, source, destination in moves:
+            if source == destination:
+                continue
+            if options['dry_run'] or options['verbosity'] > 1:
+                self.stdout.write(f'Topic {topic_id}: {source} -> {destination}')
+            if not options['dry_run']:
+                messages += sharding.move_topic(topic_id, destination, chunk_size=options['chunk_size'])
+        moved = sum(source != destination for _, source, destination in moves)
+        if options['dry_run']:
+            self.stdout.write(f'Would move {moved} topics')
+        else:
+            self.stdout.write(f'Moved {moved} topics with {messages} messages')
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from chat import sharding
+from chat.models import Topic
+from chat.routers import use_shard
+
+
+class Command(BaseCommand):
+    help = 'Recomputes message_count and last_message_at of topics from their messages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('topic_ids', nargs='*', type=int, help='topics to repair, all topics by default')
+
+    def handle(self, *args, **options):
+        repaired = []
+        count = 0
+        for shard in sharding.get_shards() or [None]:
+            with use_shard(shard):
+                topics = Topic.objects.all()
+                if options['topic_ids']:
+                    topics = topics.filter(id__in=options['topic_ids'])
+                repaired += topics.repair_activity()
+                count += topics.count()
+        self.stdout.write(f'Repaired {len(repaired)} of {count} topics')
+        if repaired and options['verbosity'] > 1:
+            self.stdout.write('Topic ids: ' + ', '.join(map(str, repaired)))
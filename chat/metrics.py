@@ -0,0 +1,295 @@
+"""
+Request metrics: query count, database time, serializer time and response size of every request, by view.
+
+MetricsMiddleware measures every request and files it under the viewset action that served it
+(e.g. 'TopicViewSet.list', 'MessageFromTopicViewSet.partial_update'), or the name of a plain view. The response
+gets a Server-Timing header with the request's own numbers, totals since the process started are served as
+Prometheus text by the metrics view (/metrics) to the addresses in ALLOWED_IPS. Every worker process has its own
+totals, scrape each of them.
+
+Queries are counted by an execute wrapper installed on every database connection and serializers are timed by
+SerializerTimingMixin, both record into the metrics of the current request held in a context variable, so the
+cost is a few perf_counter() calls per query and one lock per request. Requests served by async views are
+measured too, the ORM threads run in a copy of the request's context.
+
+Configured by settings.CHAT_METRICS, None disables the middleware:
+
+    CHAT_METRICS = {
+        'SERVER_TIMING': True,
+        'ALLOWED_IPS': ['127.0.0.1', '::1'],
+    }
+"""
+import bisect
+import contextvars
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LOCAL_IPS = ('127.0.0.1', '::1')
+# label of requests that matched no URL pattern
+UNMATCHED = 'unmatched'
+
+_request_metrics = contextvars.ContextVar('chat_request_metrics', default=None)
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'queries', 'db_time', 'serializer_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+
+    def time_serializer(self, method):
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.serializer_time += time.perf_counter() - started
+        return timed
+
+
+class ViewMetrics:
+    __slots__ = ('statuses', 'duration_buckets', 'duration', 'queries', 'db_time', 'serializer_time',
+                 'response_size')
+
+    def __init__(self, buckets_number):
+        self.statuses = {}
+        self.duration_buckets = [0] * buckets_number
+        self.duration = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.response_size = 0
+
+
+class MetricsRegistry:
+    """Totals of the requests of every view in this process"""
+    # upper bounds of the request duration histogram, in seconds
+    duration_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._views = {}
+
+    def record(self, view, status, duration, request_metrics, response_size):
+        bucket = bisect.bisect_left(self.duration_buckets, duration)
+        with self._lock:
+            metrics = self._get_view(view)
+            metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+            if bucket < len(self.duration_buckets):
+                metrics.duration_buckets[bucket] += 1
+            metrics.duration += duration
+            metrics.queries += request_metrics.queries
+            metrics.db_time += request_metrics.db_time
+            metrics.serializer_time += request_metrics.serializer_time
+            metrics.response_size += response_size
+
+    def add_response_size(self, view, size):
+        """For streamed responses, whose size is known when the stream ends"""
+        with self._lock:
+            self._get_view(view).response_size += size
+
+    def reset(self):
+        with self._lock:
+            self._views = {}
+
+    def _get_view(self, view):
+        metrics = self._views.get(view)
+        if metrics is None:
+            metrics = self._views[view] = ViewMetrics(len(self.duration_buckets))
+        return metrics
+
+    def render(self):
+        """Prometheus text exposition format"""
+        with self._lock:
+            views = sorted((view, metrics) for view, metrics in self._views.items())
+            lines = [
+                '# HELP chat_requests_total Requests by view and status code.',
+                '# TYPE chat_requests_total counter',
+            ]
+            for view, metrics in views:
+                for status, count in sorted(metrics.statuses.items()):
+                    lines.append(f'chat_requests_total{{view="{_escape(view)}",status="{status}"}} {count}')
+
+            lines += [
+                '# HELP chat_request_duration_seconds Time from the first to the last middleware, by view.',
+                '# TYPE chat_request_duration_seconds histogram',
+            ]
+            for view, metrics in views:
+                label = f'view="{_escape(view)}"'
+                count = 0
+                for bound, bucket_count in zip(self.duration_buckets, metrics.duration_buckets):
+                    count += bucket_count
+                    lines.append(f'chat_request_duration_seconds_bucket{{{label},le="{bound}"}} {count}')
+                total = sum(metrics.statuses.values())
+                lines.append(f'chat_request_duration_seconds_bucket{{{label},le="+Inf"}} {total}')
+                lines.append(f'chat_request_duration_seconds_sum{{{label}}} {metrics.duration}')
+                lines.append(f'chat_request_duration_seconds_count{{{label}}} {total}')
+
+            for name, attribute, help in (
+                    ('chat_db_queries_total', 'queries', 'Database queries, by view.'),
+                    ('chat_db_duration_seconds_total', 'db_time', 'Time spent executing database queries, by view.'),
+                    ('chat_serializer_duration_seconds_total', 'serializer_time',
+                     'Time spent validating and representing data in serializers, by view.'),
+                    ('chat_response_size_bytes_total', 'response_size', 'Bytes of response bodies, by view.')):
+                lines += [f'# HELP {name} {help}', f'# TYPE {name} counter']
+                for view, metrics in views:
+                    lines.append(f'{name}{{view="{_escape(view)}"}} {getattr(metrics, attribute)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _record_query(execute, sql, params, many, context):
+    request_metrics = _request_metrics.get()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        request_metrics.queries += 1
+        request_metrics.db_time += time.perf_counter() - started
+
+
+def install_query_recorder(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+class SerializerTimingMixin:
+    """Adds the time serializers of the view spend in is_valid() and to_representation() to the request metrics"""
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        request_metrics = _request_metrics.get()
+        if request_metrics is not None:
+            for name in ('is_valid', 'to_representation'):
+                if hasattr(serializer, name):
+                    setattr(serializer, name, request_metrics.time_serializer(getattr(serializer, name)))
+        return serializer
+
+
+def get_view_name(request):
+    """Viewset action, or name of the view, that served request"""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return UNMATCHED
+    view = match.func
+    cls = getattr(view, 'cls', None)
+    if cls is None:
+        return match.view_name or f'{view.__module__}.{view.__qualname__}'
+    actions = getattr(view, 'actions', None)
+    if not actions:
+        # APIView, or a function view of @api_view, whose class is named after the function
+        return cls.__name__
+    method = request.method.lower()
+    action = actions.get(method, actions.get('get') if method == 'head' else None)
+    return f'{cls.__name__}.{action or method}'
+
+
+class MetricsMiddleware:
+    """Measures requests into the registry and adds their Server-Timing header, should be the first middleware"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = getattr(settings, 'CHAT_METRICS', None)
+        if config is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.server_timing = config.get('SERVER_TIMING', True)
+        # connections opened later, e.g. by the threads of async views, get the recorder when they connect
+        connection_created.connect(install_query_recorder, dispatch_uid='chat.metrics')
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        request_metrics = self.start()
+        token = _request_metrics.set(request_metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_metrics.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    async def __acall__(self, request):
+        request_metrics = self.start()
+        token = _request_metrics.set(request_metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_metrics.reset(token)
+        return self.finish(request, response, request_metrics)
+
+    @staticmethod
+    def start():
+        for connection in connections.all(initialized_only=True):
+            install_query_recorder(connection)
+        return RequestMetrics()
+
+    def finish(self, request, response, request_metrics):
+        duration = time.perf_counter() - request_metrics.started
+        match = getattr(request, 'resolver_match', None)
+        if match is not None and match.func is metrics:
+            # scrapes are left out
+            return response
+        view = get_view_name(request)
+
+        if not response.streaming:
+            response_size = len(response.content)
+        else:
+            response_size = 0
+            if not getattr(response, 'is_async', False):
+                response.streaming_content = self._count_streamed(view, response.streaming_content)
+        registry.record(view, response.status_code, duration, request_metrics, response_size)
+
+        if self.server_timing:
+            response['Server-Timing'] = (
+                f'db;dur={request_metrics.db_time * 1000:.3f};desc="{request_metrics.queries} queries", '
+                f'serializer;dur={request_metrics.serializer_time * 1000:.3f}, '
+                f'total;dur={duration * 1000:.3f}')
+        return response
+
+    @staticmethod
+    def _count_streamed(view, content):
+        size = 0
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            registry.add_response_size(view, size)
+
+
+def is_allowed_address(request):
+    """Whether the request comes from ALLOWED_IPS of CHAT_METRICS, the loopback addresses when it has none"""
+    config = getattr(settings, 'CHAT_METRICS', None) or {}
+    return request.META.get('REMOTE_ADDR') in config.get('ALLOWED_IPS', LOCAL_IPS)
+
+
+def metrics(request):
+    """Totals of the request metrics of this process in Prometheus text format"""
+    if getattr(settings, 'CHAT_METRICS', None) is None:
+        raise Http404
+    if not is_allowed_address(request):
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:16
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_message'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='text',
+            field=models.TextField(validators=[django.core.validators.MinLengthValidator(10)]),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['topic', 'created_at', 'id'], name='message_topic_created_id_idx'),
+        ),
+    ]
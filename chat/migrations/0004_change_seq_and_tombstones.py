@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def number_existing_messages(apps, schema_editor):
+    """Existing messages get the first change of their topic, so syncing from token 0 returns them"""
+    apps.get_model('chat', 'Topic').objects.update(change_seq=1)
+    apps.get_model('chat', 'Message').objects.update(change_seq=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_message_topic_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageTombstone',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message_id', models.IntegerField()),
+                ('change_seq', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='change_seq',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['topic', 'change_seq'], name='message_topic_change_seq_idx'),
+        ),
+        migrations.AddField(
+            model_name='messagetombstone',
+            name='topic',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chat.topic'),
+        ),
+        migrations.AddIndex(
+            model_name='messagetombstone',
+            index=models.Index(fields=['topic', 'change_seq'], name='tombstone_topic_change_seq_idx'),
+        ),
+        migrations.RunPython(number_existing_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:32
+
+import chat.models
+from django.db import migrations, models
+from django.db.models import Count, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_existing_messages(apps, schema_editor):
+    Topic = apps.get_model('chat', 'Topic')
+    Message = apps.get_model('chat', 'Message')
+    messages = Message.objects.filter(topic=OuterRef('pk')).order_by().values('topic')
+    Topic.objects.update(
+        message_count=Coalesce(Subquery(messages.annotate(count=Count('id')).values('count')), 0),
+        last_message_at=Subquery(messages.annotate(last=Max('created_at')).values('last')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_change_seq_and_tombstones'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='last_message_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='created_at',
+            field=models.DateTimeField(default=chat.models._now, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(fields=['created_at', 'id'], name='topic_created_id_idx'),
+        ),
+        migrations.RunPython(count_existing_messages, migrations.RunPython.noop),
+    ]
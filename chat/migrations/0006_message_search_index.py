@@ -0,0 +1,49 @@
+from django.db import migrations
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE chat_message_fts USING fts5("
+    "text, content='chat_message', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    # triggers keep the index in sync with every write, including bulk and raw ones
+    "CREATE TRIGGER chat_message_fts_insert AFTER INSERT ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER chat_message_fts_delete AFTER DELETE ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+    "CREATE TRIGGER chat_message_fts_update AFTER UPDATE OF text ON chat_message BEGIN "
+    "INSERT INTO chat_message_fts(chat_message_fts, rowid, text) VALUES ('delete', old.id, old.text); "
+    "INSERT INTO chat_message_fts(rowid, text) VALUES (new.id, new.text); END",
+    "INSERT INTO chat_message_fts(chat_message_fts) VALUES ('rebuild')",
+]
+SQLITE_DROP = [
+    'DROP TRIGGER IF EXISTS chat_message_fts_insert',
+    'DROP TRIGGER IF EXISTS chat_message_fts_delete',
+    'DROP TRIGGER IF EXISTS chat_message_fts_update',
+    'DROP TABLE IF EXISTS chat_message_fts',
+]
+POSTGRESQL_CREATE = [
+    "CREATE INDEX message_text_search_idx ON chat_message USING gin (to_tsvector('simple'::regconfig, text))",
+]
+POSTGRESQL_DROP = [
+    'DROP INDEX IF EXISTS message_text_search_idx',
+]
+
+
+def run_for_vendor(statements):
+    """Search indexes are specific to the database, other backends fall back to chat.search.ContainsSearch"""
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_topic_activity'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}),
+            run_for_vendor({'sqlite': SQLITE_DROP, 'postgresql': POSTGRESQL_DROP}),
+        ),
+    ]
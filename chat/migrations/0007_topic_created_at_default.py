@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 04:25
+
+import chat.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_message_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='topic',
+            name='created_at',
+            field=models.DateTimeField(default=chat.models._now, editable=False),
+        ),
+    ]
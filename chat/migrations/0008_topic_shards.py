@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_topic_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('next_id', models.BigIntegerField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TopicShard',
+            fields=[
+                ('topic_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('shard', models.CharField(db_index=True, max_length=100)),
+            ],
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 05:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_topic_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchiveBlock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('segment', models.IntegerField()),
+                ('offset', models.BigIntegerField()),
+                ('length', models.IntegerField()),
+                ('codec', models.CharField(max_length=10)),
+                ('count', models.IntegerField()),
+                ('first_created_at', models.DateTimeField()),
+                ('first_id', models.IntegerField()),
+                ('last_created_at', models.DateTimeField()),
+                ('last_id', models.IntegerField()),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chat.topic')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('block', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chat.archiveblock')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archiveblock',
+            index=models.Index(fields=['topic', 'first_created_at', 'first_id'], name='archive_topic_first_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archiveblock',
+            index=models.Index(fields=['topic', 'last_created_at', 'last_id'], name='archive_topic_last_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archiveblock',
+            index=models.Index(fields=['first_created_at', 'first_id'], name='archive_first_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archiveblock',
+            index=models.Index(fields=['last_created_at', 'last_id'], name='archive_last_idx'),
+        ),
+    ]
@@ -1,26 +1,375 @@
-from django.core.exceptions import ObjectDoesNotExist
+import threading
+from collections import Counter, defaultdict
+
+from django.conf import settings
 from django.core.validators import MinLengthValidator
-from django.db import models
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, models, router, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery, Sum, Value, Window
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+from django.utils import timezone
+
+from .cache import invalidate_topics
+
+
+def _now():
+    return timezone.now()
+
+
+class ChatQuerySet(models.QuerySet):
+
+    @property
+    def write_db(self):
+        """Database the queryset writes to"""
+        return self._db or router.db_for_write(self.model, **self._hints)
+
+
+class TopicQuerySet(ChatQuerySet):
+
+    def repair_activity(self):
+        """
+        Recomputes message_count and last_message_at of the topics from their messages.
+
+        Returns ids of the topics whose values were off. Those are rewritten in one transaction and get a new
+        change_seq, so cached responses and ETags of the topics are dropped.
+        """
+        using = self.write_db
+        actual_count, actual_last = self._actual_activity()
+        rows = self.using(using).annotate(actual_count=actual_count, actual_last=actual_last).values_list(
+            'id', 'message_count', 'last_message_at', 'actual_count', 'actual_last')
+        stale = [row[0] for row in rows.iterator(chunk_size=2000) if row[1:3] != row[3:]]
+        with transaction.atomic(using=using):
+            for start in range(0, len(stale), 500):
+                self.model.objects.using(using).filter(id__in=stale[start:start + 500]).update(
+                    message_count=actual_count, last_message_at=actual_last, change_seq=F('change_seq') + 1)
+            invalidate_topics(*stale, topic_list=bool(stale))
+        return stale
+
+    @staticmethod
+    def _actual_activity():
+        # archived messages (see chat.archive) still count, only their rows moved to segment files
+        messages = Message.objects.filter(topic=OuterRef('pk')).order_by().values('topic')
+        blocks = ArchiveBlock.objects.filter(topic=OuterRef('pk')).order_by().values('topic')
+        last = Subquery(messages.annotate(last=Max('created_at')).values('last'))
+        archived_last = Subquery(blocks.annotate(last=Max('last_created_at')).values('last'))
+        return (Coalesce(Subquery(messages.annotate(count=Count('id')).values('count')), 0) +
+                Coalesce(Subquery(blocks.annotate(count=Sum('count')).values('count')), 0),
+                # GREATEST of PostgreSQL skips NULLs, the one of SQLite returns NULL
+                Greatest(Coalesce(last, archived_last), Coalesce(archived_last, last)))
 
 
 class Topic(models.Model):
     title = models.CharField(max_length=255, validators=[MinLengthValidator(5)])
-    created_at = models.DateTimeField(auto_now_add=True)
+    # a default rather than auto_now_add, so manage.py chat_import can keep the exported value
+    created_at = models.DateTimeField(default=_now, editable=False)
+    # bumped on every message create, update and delete, messages and tombstones store the value of their change;
+    # also bumped on topic updates, so it versions everything served under the topic (see views.CachedReadMixin)
+    change_seq = models.BigIntegerField(default=0)
+    # denormalized from messages, kept in the same UPDATE as change_seq, see manage.py repair_topic_counters
+    message_count = models.PositiveIntegerField(default=0)
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
+    # written only by message writes, never by Topic.save(), so a topic update cannot overwrite a concurrent count
+    activity_fields = ('message_count', 'last_message_at')
+
+    objects = TopicQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the topic list pages by (created_at, id), see chat.pagination
+            models.Index(fields=['created_at', 'id'], name='topic_created_id_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        bump = not self._state.adding
+        if bump:
+            self.change_seq = F('change_seq') + 1
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = (set(update_fields) | {'change_seq'}) - set(self.activity_fields)
+        super(Topic, self).save(*args, **kwargs)
+        if bump:
+            # the new value is only known to the database, it is loaded again when accessed
+            del self.change_seq
+        invalidate_topics(self.id, topic_list=True)
+
+    def delete(self, *args, **kwargs):
+        invalidate_topics(self.id, topic_list=True)
+        return super(Topic, self).delete(*args, **kwargs)
+
+    @classmethod
+    def bump_change_seq(cls, topic_id, created_at=None, deleted_id=None, using=None):
+        """
+        Increments the change sequence of the topic and returns an expression reading the new value.
+
+        created_at is given when the change creates a message, deleted_id when it deletes one, message_count and
+        last_message_at are then updated by the same UPDATE. Must be called in a transaction, the row lock taken by
+        the UPDATE is kept until commit, so changes of one topic are committed in sequence order. Raises
+        Topic.DoesNotExist when the topic is not in the database.
+        """
+        created = [created_at] if created_at is not None else []
+        deleted_ids = [deleted_id] if deleted_id is not None else []
+        topics = cls.objects.db_manager(using).filter(id=topic_id)
+        updated = topics.update(change_seq=F('change_seq') + 1, **cls._activity_changes(created, deleted_ids))
+        if not updated and topic_id is not None:
+            # deleted, or moved to another shard (see chat.sharding) since the caller looked it up
+            raise cls.DoesNotExist(f'Topic {topic_id} does not exist')
+        invalidate_topics(topic_id, topic_list=bool(created or deleted_ids))
+        return Subquery(topics.values('change_seq')[:1])
+
+    @classmethod
+    def reserve_change_seqs(cls, counts, created=None, deleted=None, using=None):
+        """
+        Bumps change sequences of several topics, counts maps topic id to the number of changes.
+
+        created maps topic id to created_at values of new messages, deleted maps it to ids of deleted messages.
+        Returns topic id -> first reserved value. Must be called in a transaction. Topics are locked in id order,
+        so concurrent bulk writes cannot deadlock each other. Raises Topic.DoesNotExist when a topic is missing.
+        """
+        created = created or {}
+        deleted = deleted or {}
+        topics = cls.objects.db_manager(using)
+        for topic_id in sorted(counts):
+            topics.filter(id=topic_id).update(
+                change_seq=F('change_seq') + counts[topic_id],
+                **cls._activity_changes(created.get(topic_id, []), deleted.get(topic_id, [])))
+        invalidate_topics(*counts, topic_list=bool(created or deleted))
+        last = dict(topics.filter(id__in=counts).values_list('id', 'change_seq'))
+        missing = set(counts) - set(last)
+        if missing:
+            raise cls.DoesNotExist(f'Topics {", ".join(map(str, sorted(missing)))} do not exist')
+        return {topic_id: last[topic_id] - count + 1 for topic_id, count in counts.items()}
+
+    @staticmethod
+    def _activity_changes(created, deleted_ids):
+        """UPDATE values keeping message_count and last_message_at"""
+        changes = {}
+        if created or deleted_ids:
+            changes['message_count'] = F('message_count') + len(created) - len(deleted_ids)
+        if created:
+            newest = Value(max(created), output_field=models.DateTimeField())
+            changes['last_message_at'] = Greatest(Coalesce('last_message_at', newest), newest)
+        elif deleted_ids:
+            # the newest remaining message, read backwards from message_topic_created_id_idx, or the newest archived
+            # one (archived messages are never deleted) from archive_topic_last_idx
+            remaining = Message.objects.filter(topic=OuterRef('pk')).exclude(id__in=deleted_ids)
+            last = Subquery(remaining.order_by('-created_at', '-id').values('created_at')[:1])
+            blocks = ArchiveBlock.objects.filter(topic=OuterRef('pk')).order_by('-last_created_at', '-last_id')
+            archived_last = Subquery(blocks.values('last_created_at')[:1])
+            changes['last_message_at'] = Greatest(Coalesce(last, archived_last), Coalesce(archived_last, last))
+        return changes
+
+
+class MessageQuerySet(ChatQuerySet):
+    """Bulk writes keeping change sequences and tombstones like Message.save() and Message.delete() do"""
+
+    def bulk_create_messages(self, messages, batch_size=None):
+        IdSequence.assign_ids(messages)
+        with transaction.atomic(using=self.write_db, savepoint=False):
+            self._number_changes(messages, self.write_db, created=True)
+            return self.bulk_create(messages, batch_size=batch_size)
+
+    def bulk_update_messages(self, messages, fields, batch_size=None):
+        with transaction.atomic(using=self.write_db, savepoint=False):
+            self._number_changes(messages, self.write_db)
+            return self.bulk_update(messages, list(fields) + ['change_seq'], batch_size=batch_size)
+
+    def latest_of_topics(self, topic_ids, number):
+        """The number latest messages of every topic of topic_ids in (topic, created_at, id) order, in one query"""
+        rank = Window(RowNumber(), partition_by=F('topic'), order_by=[F('created_at').desc(), F('id').desc()])
+        return self.filter(topic__in=topic_ids).annotate(topic_rank=rank).filter(
+            topic_rank__lte=number).order_by('topic', 'created_at', 'id')
+
+    def delete_leaving_tombstones(self):
+        """Deletes the messages of the queryset recording a tombstone for each of them, returns (id, topic_id) rows"""
+        using = self.write_db
+        with transaction.atomic(using=using, savepoint=False):
+            rows = list(self.using(using).values_list('id', 'topic_id'))
+            deleted = defaultdict(list)
+            for message_id, topic_id in rows:
+                deleted[topic_id].append(message_id)
+            seqs = Topic.reserve_change_seqs(Counter(topic_id for _, topic_id in rows), deleted=deleted, using=using)
+            tombstones = []
+            for message_id, topic_id in rows:
+                tombstones.append(MessageTombstone(message_id=message_id, topic_id=topic_id,
+                                                   change_seq=seqs[topic_id]))
+                seqs[topic_id] += 1
+            MessageTombstone.objects.using(using).bulk_create(tombstones)
+            self.model.objects.using(using).filter(id__in=[message_id for message_id, _ in rows]).delete()
+        return rows
+
+    @staticmethod
+    def _number_changes(messages, using, created=False):
+        created_at = defaultdict(list)
+        if created:
+            for msg in messages:
+                created_at[msg.topic_id].append(msg.created_at)
+        seqs = Topic.reserve_change_seqs(Counter(msg.topic_id for msg in messages), created=created_at, using=using)
+        for msg in messages:
+            msg.change_seq = seqs[msg.topic_id]
+            seqs[msg.topic_id] += 1
 
 
 class Message(models.Model):
     text = models.TextField(validators=[MinLengthValidator(10)])
-    created_at = models.DateTimeField(auto_now_add=True)
+    # set when the message is built rather than when it is inserted, so the topic's last_message_at is updated with
+    # the same value before the INSERT
+    created_at = models.DateTimeField(default=_now, editable=False)
     topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+    change_seq = models.BigIntegerField(default=0)
+
+    objects = MessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # every nested listing filters by topic and pages by (created_at, id), so it is a single range scan
+            models.Index(fields=['topic', 'created_at', 'id'], name='message_topic_created_id_idx'),
+            models.Index(fields=['topic', 'change_seq'], name='message_topic_change_seq_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remember the topic the row was loaded with, so save() can check it without querying the database
+        if 'topic_id' in field_names:
+            instance._loaded_topic_id = instance.topic_id
+        return instance
 
     def save(self, *args, **kwargs):
         if self._state.adding is False:
+            loaded_topic_id = getattr(self, '_loaded_topic_id', self.topic_id)
+            if loaded_topic_id != self.topic_id:
+                raise (ValueError('You cannot change the topic of the message'))
+
+        if self._state.adding:
+            IdSequence.assign_ids([self])
+        created_at = self.created_at if self._state.adding else None
+        # the topic is written in the database of the message, like Model.save() picks it
+        using = kwargs['using'] = kwargs.get('using') or router.db_for_write(Message, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            self.change_seq = Topic.bump_change_seq(self.topic_id, created_at=created_at, using=using)
+            super(Message, self).save(*args, **kwargs)
+        self._loaded_topic_id = self.topic_id
+        # the saved value is only known to the database, leave the field deferred so it is loaded on access
+        del self.change_seq
+
+    def delete(self, *args, **kwargs):
+        using = kwargs['using'] = kwargs.get('using') or router.db_for_write(Message, instance=self)
+        with transaction.atomic(using=using, savepoint=False):
+            MessageTombstone.objects.using(using).create(
+                message_id=self.id, topic_id=self.topic_id,
+                change_seq=Topic.bump_change_seq(self.topic_id, deleted_id=self.id, using=using))
+            return super(Message, self).delete(*args, **kwargs)
+
+
+class MessageTombstone(models.Model):
+    """Left behind by a deleted message, so clients syncing changes learn about the deletion"""
+    message_id = models.IntegerField()
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+    change_seq = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['topic', 'change_seq'], name='tombstone_topic_change_seq_idx'),
+        ]
+
+
+class TopicShard(models.Model):
+    """Directory entry of a sharded topic, the shard holding it with its messages and tombstones (see chat.sharding)"""
+    topic_id = models.IntegerField(primary_key=True)
+    # alias of the database in settings.DATABASES
+    shard = models.CharField(max_length=100, db_index=True)
+
+
+class ArchiveBlock(models.Model):
+    """Compressed block of archived messages of a topic, stored at offset in a segment file (see chat.archive)"""
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE)
+    segment = models.IntegerField()
+    offset = models.BigIntegerField()
+    length = models.IntegerField()
+    codec = models.CharField(max_length=10)
+    count = models.IntegerField()
+    # (created_at, id) of the first and the last message of the block
+    first_created_at = models.DateTimeField()
+    first_id = models.IntegerField()
+    last_created_at = models.DateTimeField()
+    last_id = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            # pages of a topic read the blocks from their cursor on, pages of all messages those of every topic
+            models.Index(fields=['topic', 'first_created_at', 'first_id'], name='archive_topic_first_idx'),
+            models.Index(fields=['topic', 'last_created_at', 'last_id'], name='archive_topic_last_idx'),
+            models.Index(fields=['first_created_at', 'first_id'], name='archive_first_idx'),
+            models.Index(fields=['last_created_at', 'last_id'], name='archive_last_idx'),
+        ]
+
+
+class ArchivedMessage(models.Model):
+    """Block holding an archived message, for reads by id"""
+    id = models.IntegerField(primary_key=True)
+    block = models.ForeignKey(ArchiveBlock, on_delete=models.CASCADE)
+
+
+class IdSequence(models.Model):
+    """
+    Next free id of a model whose rows are spread over shards (see chat.sharding), so ids are unique across shards,
+    or of messages whose id is known before they are inserted (see chat.ingest).
+
+    Processes reserve blocks of block_size ids with one UPDATE and hand them out from memory, ids therefore do not
+    grow in the order rows are created. Both models are kept in the default database.
+    """
+    name = models.CharField(max_length=100, primary_key=True)
+    next_id = models.BigIntegerField()
+
+    block_size = 100
+    # model label -> [next id, end of the block] of this process
+    _blocks = defaultdict(lambda: [0, 0])
+    _blocks_lock = threading.Lock()
+
+    @classmethod
+    def assign_ids(cls, objs):
+        """Sets ids of new objs without one when topics are sharded or messages ingested, else the database does"""
+        if getattr(settings, 'CHAT_SHARDS', None) is None and getattr(settings, 'CHAT_INGEST', None) is None:
+            return
+        objs = [obj for obj in objs if obj.pk is None]
+        if objs:
+            for obj, id in zip(objs, cls.allocate(type(objs[0]), len(objs))):
+                obj.pk = id
+
+    @classmethod
+    def allocate(cls, model, count):
+        """count new ids of model"""
+        ids = []
+        with cls._blocks_lock:
+            block = cls._blocks[model._meta.label]
+            while len(ids) < count:
+                if block[0] == block[1]:
+                    block[:] = cls._reserve(model, max(cls.block_size, count - len(ids)))
+                taken = min(count - len(ids), block[1] - block[0])
+                ids.extend(range(block[0], block[0] + taken))
+                block[0] += taken
+        return ids
+
+    @classmethod
+    def _reserve(cls, model, count):
+        """Reserves count ids of model in the default database, returns (first, end)"""
+        name = model._meta.label
+        sequence = cls.objects.using(DEFAULT_DB_ALIAS).filter(name=name)
+        while True:
+            with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                if sequence.update(next_id=F('next_id') + count):
+                    end = sequence.values_list('next_id', flat=True).get()
+                    return end - count, end
+            # the first block starts after the rows already in the shards, e.g. of a database sharded later
+            shards = settings.CHAT_SHARDS['DATABASES'] if getattr(settings, 'CHAT_SHARDS', None) else [DEFAULT_DB_ALIAS]
+            start = max((model.objects.using(alias).aggregate(last=Max('pk'))['last'] or 0
+                         for alias in shards), default=0) + 1
             try:
-                msg = Message.objects.get(id=self.id)
-            except ObjectDoesNotExist:
-                msg = None
-            if msg is not None:
-                if msg.topic.id != self.topic.id:
-                    raise (ValueError('You cannot change the topic of the message'))
-
-        super(Message, self).save(*args, **kwargs)
+                with transaction.atomic(using=DEFAULT_DB_ALIAS):
+                    cls.objects.using(DEFAULT_DB_ALIAS).create(name=name, next_id=start + count)
+                    return start, start + count
+            except IntegrityError:
+                # created by another process in the meantime
+                continue
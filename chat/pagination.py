@@ -0,0 +1,189 @@
+import heapq
+import math
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from itertools import islice
+from operator import attrgetter
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Keyset pagination on (created_at, id).
+
+    Every page is a single indexed range scan: the cursor stores the (created_at, id) of the last/first row
+    of the previous page, so the cost does not depend on how deep the page is (unlike OFFSET).
+    ?after=<cursor> returns rows following the anchor, ?before=<cursor> rows preceding it. The body is a plain
+    JSON list, links to neighbouring pages are sent in the Link header.
+    """
+    page_size = api_settings.PAGE_SIZE or 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    after_query_param = 'after'
+    before_query_param = 'before'
+    ordering = ('created_at', 'id')
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self._get_page(list(self._get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """paginate_queryset() reading the page with the async ORM"""
+        return self._get_page([obj async for obj in self._get_page_queryset(queryset, request)])
+
+    def paginate_queryset_across(self, queryset, request, databases=None, readers=()):
+        """
+        paginate_queryset() over the same rows spread across databases (shards, see chat.sharding, None: the database
+        of queryset) and rows kept elsewhere (archived messages, see chat.archive): every database returns its page,
+        every reader called with (after, before, limit) its rows of the page in page order. The pages are merged in
+        (created_at, id) order and cut like a page of one database. Every database and reader is read for every
+        page, up to limit + 1 rows each.
+        """
+        queryset = self._get_page_queryset(queryset, request)
+        if databases is None:
+            pages = [list(queryset)]
+        else:
+            pages = [list(queryset.using(database)) for database in databases]
+        pages += [read(self.after, self.before, self.limit + 1) for read in readers]
+        rows = heapq.merge(*pages, key=attrgetter(*self.ordering), reverse=self.before is not None)
+        return self._get_page(list(islice(rows, self.limit + 1)))
+
+    def _get_page_queryset(self, queryset, request):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.limit = self.get_page_size(request)
+
+        self.after = self.decode_cursor(request.query_params.get(self.after_query_param))
+        self.before = self.decode_cursor(request.query_params.get(self.before_query_param))
+
+        if self.before is not None:
+            # walk backwards from the anchor and flip the page, so rows are always returned in ascending order
+            queryset = queryset.filter(self._before_filter(self.before)).order_by('-created_at', '-id')
+        else:
+            if self.after is not None:
+                queryset = queryset.filter(self._after_filter(self.after))
+            queryset = queryset.order_by(*self.ordering)
+        return queryset[:self.limit + 1]
+
+    def _get_page(self, results):
+        page_size = self.limit
+        if self.before is not None:
+            self.has_previous = len(results) > page_size
+            self.has_next = True
+            page = list(reversed(results[:page_size]))
+        else:
+            self.has_next = len(results) > page_size
+            self.has_previous = self.after is not None
+            page = results[:page_size]
+
+        self.page = page
+        return page
+
+    def get_paginated_response(self, data):
+        links = []
+        next_link = self.get_next_link()
+        previous_link = self.get_previous_link()
+        if next_link is not None:
+            links.append(f'<{next_link}>; rel="next"')
+        if previous_link is not None:
+            links.append(f'<{previous_link}>; rel="prev"')
+
+        headers = {'Link': ', '.join(links)} if links else None
+        return Response(data, headers=headers)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        url = remove_query_param(self.base_url, self.before_query_param)
+        return replace_query_param(url, self.after_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        url = remove_query_param(self.base_url, self.after_query_param)
+        return replace_query_param(url, self.before_query_param, self.encode_cursor(self.page[0]))
+
+    def encode_cursor(self, obj):
+        raw = f'{obj.created_at.isoformat()}|{obj.id}'
+        return urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, encoded):
+        if encoded is None:
+            return None
+        try:
+            created_at, obj_id = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            created_at = parse_datetime(created_at)
+            obj_id = int(obj_id)
+        except (BinasciiError, UnicodeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, obj_id
+
+    # the redundant created_at__gte/__lte bound lets the database start a range scan at the anchor,
+    # with the OR alone it walks the index from the beginning of the topic
+
+    @staticmethod
+    def _after_filter(cursor):
+        created_at, obj_id = cursor
+        return Q(created_at__gte=created_at) & (Q(created_at__gt=created_at) | Q(id__gt=obj_id))
+
+    @staticmethod
+    def _before_filter(cursor):
+        created_at, obj_id = cursor
+        return Q(created_at__lte=created_at) & (Q(created_at__lt=created_at) | Q(id__lt=obj_id))
+
+
+class SearchCursorPagination(KeysetCursorPagination):
+    """
+    Keyset pagination of search results (see chat.search) on (rank, id).
+
+    Pages only go forward, ?after=<cursor> continues after the last result of the previous page.
+    """
+
+    def paginate_search(self, search, query, request, topic_id=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        page_size = self.get_page_size(request)
+        after = self.decode_cursor(request.query_params.get(self.after_query_param))
+
+        results = search.search(query, topic_id=topic_id, after=after, limit=page_size + 1)
+        self.has_next = len(results) > page_size
+        self.has_previous = False
+        self.page = results[:page_size]
+        return self.page
+
+    def encode_cursor(self, result):
+        rank, obj_id = result
+        # repr() of a float reads back to the same value, so ties on the rank are found again
+        raw = f'{float(rank)!r}|{obj_id}'
+        return urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, encoded):
+        if encoded is None:
+            return None
+        try:
+            rank, obj_id = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii').split('|')
+            rank = float(rank)
+            obj_id = int(obj_id)
+        except (BinasciiError, UnicodeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not math.isfinite(rank):
+            raise NotFound(self.invalid_cursor_message)
+        return rank, obj_id
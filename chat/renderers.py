@@ -0,0 +1,62 @@
+"""
+JSON renderer writing with orjson when it is installed.
+
+The output is byte for byte the one of rest_framework's JSONRenderer with the default JSON settings: compact,
+UTF-8, U+2028 and U+2029 escaped, datetimes and other non JSON types converted by its encoder. The only
+differences are in floats, exponent notation (1e16 instead of 1e+16) and NaN written as null instead of an error,
+the API returns no floats.
+Indented output, non default JSON settings and values orjson cannot encode go through JSONRenderer.
+
+render_stream() renders lists coming in chunks (see MessageFromTopicViewSet.export) as one document without
+holding more than a chunk, as a JSON array or as NDJSON (NDJSONRenderer).
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    # types the stdlib encoder cannot handle either are left to encoder_class, like datetimes and dataclasses
+    orjson_options = (orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS) if orjson else 0
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.orjson_options)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+    def render_stream(self, chunks, renderer_context=None):
+        """Yields the JSON array of the items of all lists in chunks, rendered a chunk at a time"""
+        separator = b',' if self.compact else b', '
+        yield b'['
+        first = True
+        for chunk in chunks:
+            if chunk:
+                # the brackets of the chunk's array are cut, the items are joined like in one array
+                yield (b'' if first else separator) + self.render(chunk, renderer_context=renderer_context)[1:-1]
+                first = False
+        yield b']'
+
+
+class NDJSONRenderer(FastJSONRenderer):
+    """Newline delimited JSON, a line for every item of a list or one line for other data"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        items = data if isinstance(data, list) else [data]
+        # always compact, a line must not be broken by indentation
+        return b''.join(super(NDJSONRenderer, self).render(item) + b'\n' for item in items)
+
+    def render_stream(self, chunks, renderer_context=None):
+        for chunk in chunks:
+            yield self.render(chunk)
@@ -0,0 +1,194 @@
+"""
+Read replicas: reads of GET, HEAD and OPTIONS requests go to a replica, everything else to the default database.
+
+ReplicaMiddleware picks the replica of a request when it starts, so all reads of one request see the same
+snapshot, and holds it in a context variable read by ReplicaRouter. Writes, reads of unsafe requests and reads
+outside requests (management commands, shell) use the default database.
+
+Replicas are picked round robin, or least loaded, the one serving the fewest requests of this process at the
+moment. A replica lags behind the default database, so for STICKY_SECONDS after a POST, PUT, PATCH or DELETE a
+client reads from the default database and sees its own writes: the response sets a cookie that expires with the
+window, clients that do not keep cookies may read stale data right after a write. The cookie works across worker
+processes and servers.
+
+Configured by settings.CHAT_REPLICAS, None disables the middleware (chatting/database.py builds it from the
+CHAT_DB_REPLICAS variable):
+
+    DATABASES = {'default': {...}, 'replica1': {...}, 'replica2': {...}}
+    DATABASE_ROUTERS = ['chat.routers.ReplicaRouter']
+    CHAT_REPLICAS = {
+        'DATABASES': ['replica1', 'replica2'],
+        'SELECTION': 'round_robin',
+        'STICKY_SECONDS': 5,
+    }
+
+ShardRouter comes first when topics are sharded (settings.CHAT_SHARDS, see chat.sharding): queries of chat models go
+to the shard set by use_shard(), the topic directory and id sequences stay in the default database. Without a
+shard the queries are left to ReplicaRouter.
+"""
+import contextvars
+import itertools
+import threading
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS
+
+SELECTIONS = ('round_robin', 'least_loaded')
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_COOKIE = 'chat_read_primary'
+
+# models of the chat app kept in the default database when topics are sharded
+UNSHARDED_MODELS = ('topicshard', 'idsequence')
+
+# database the reads of the current request go to, None outside requests served by ReplicaMiddleware
+_read_database = contextvars.ContextVar('chat_read_database', default=None)
+# shard the queries of chat models go to, set by use_shard()
+_shard = contextvars.ContextVar('chat_shard', default=None)
+
+
+def get_replicas():
+    config = getattr(settings, 'CHAT_REPLICAS', None)
+    return config['DATABASES'] if config else []
+
+
+@contextmanager
+def use_shard(alias):
+    """Sends the queries of chat models in the block to the shard alias (None: no shard)"""
+    token = _shard.set(alias)
+    try:
+        yield
+    finally:
+        _shard.reset(token)
+
+
+def set_shard(alias):
+    """Sends the queries of chat models to the shard alias until the enclosing use_shard() block ends"""
+    _shard.set(alias)
+
+
+def current_shard():
+    return _shard.get()
+
+
+def reads_from_replica():
+    """Whether the reads of chat models in the current request go to a replica, which may lag behind"""
+    return _shard.get() is None and _read_database.get() not in (None, DEFAULT_DB_ALIAS)
+
+
+def get_write_database():
+    """Database chat models are written to, for transaction.atomic() and transaction.on_commit()"""
+    return _shard.get() or DEFAULT_DB_ALIAS
+
+
+class ShardRouter:
+    """Sends queries of chat models to the shard set by use_shard()"""
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label != 'chat':
+            return None
+        if model._meta.model_name in UNSHARDED_MODELS:
+            return DEFAULT_DB_ALIAS
+        return _shard.get()
+
+    db_for_write = db_for_read
+
+
+class ReplicaRouter:
+    """Sends the reads of the current request to the database picked by ReplicaMiddleware"""
+
+    def db_for_read(self, model, **hints):
+        return _read_database.get()
+
+    def db_for_write(self, model, **hints):
+        # not the database an instance was read from, instances read from a replica are saved to the default one
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *get_replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """Picks the database of the reads of a request, should come right after MetricsMiddleware"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = getattr(settings, 'CHAT_REPLICAS', None)
+        if config is None:
+            raise MiddlewareNotUsed
+        self.replicas = list(config['DATABASES'])
+        if not self.replicas:
+            raise ImproperlyConfigured('CHAT_REPLICAS needs at least one database in DATABASES')
+        unknown = set(self.replicas) - set(settings.DATABASES)
+        if unknown:
+            raise ImproperlyConfigured(f'CHAT_REPLICAS databases missing from DATABASES: {", ".join(sorted(unknown))}')
+        selection = config.get('SELECTION', 'round_robin')
+        if selection not in SELECTIONS:
+            raise ImproperlyConfigured(f'CHAT_REPLICAS SELECTION must be one of {", ".join(SELECTIONS)}, '
+                                       f'not {selection!r}')
+        self.pick = getattr(self, f'_pick_{selection}')
+        self.sticky_seconds = config.get('STICKY_SECONDS', 5)
+        self._cycle = itertools.cycle(self.replicas)
+        # requests of this process served by every replica right now
+        self.in_flight = dict.fromkeys(self.replicas, 0)
+        self._lock = threading.Lock()
+
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        database = self.start(request)
+        token = _read_database.set(database)
+        try:
+            response = self.get_response(request)
+        finally:
+            _read_database.reset(token)
+            self.finish(database)
+        return self.stick(request, response)
+
+    async def __acall__(self, request):
+        database = self.start(request)
+        token = _read_database.set(database)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _read_database.reset(token)
+            self.finish(database)
+        return self.stick(request, response)
+
+    def start(self, request):
+        if request.method not in SAFE_METHODS or STICKY_COOKIE in request.COOKIES:
+            return DEFAULT_DB_ALIAS
+        with self._lock:
+            database = self.pick()
+            self.in_flight[database] += 1
+        return database
+
+    def finish(self, database):
+        if database != DEFAULT_DB_ALIAS:
+            with self._lock:
+                self.in_flight[database] -= 1
+
+    def stick(self, request, response):
+        if request.method not in SAFE_METHODS and self.sticky_seconds:
+            response.set_cookie(STICKY_COOKIE, '1', max_age=self.sticky_seconds, httponly=True, samesite='Lax')
+        return response
+
+    def _pick_round_robin(self):
+        return next(self._cycle)
+
+    def _pick_least_loaded(self):
+        # ties go to the replica after the one picked last, so an idle process still spreads its requests
+        start = next(self._cycle)
+        index = self.replicas.index(start)
+        return min(self.replicas[index:] + self.replicas[:index], key=self.in_flight.__getitem__)
@@ -0,0 +1,145 @@
+"""
+Full-text search over message text.
+
+Backends return one page of (rank, message id) pairs ordered by relevance, lower rank is better and ties are broken
+by id, so (rank, id) is the cursor of the next page (see chat.pagination.SearchCursorPagination). Messages are loaded
+by the view afterwards.
+
+Configured by settings.CHAT_SEARCH:
+
+    SQLiteFullTextSearch      FTS5 index kept in sync by triggers (migration 0006), ranked by bm25
+    PostgreSQLFullTextSearch  GIN index on to_tsvector('simple', text) (migration 0006), ranked by ts_rank
+    ContainsSearch            case-insensitive substring match of every term, no index and no ranking
+
+The full-text backends rank only the max_ranked (OPTIONS, 10000 by default) matches of highest id, the newest
+messages, so a query of words most messages contain costs the same at any table size. Older matches are left out,
+and a page may shift when newer matches push the limit forward.
+"""
+import re
+import threading
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import FloatField, Q, Value
+from django.utils.module_loading import import_string
+
+from .models import Message
+
+# terms are runs of letters and digits, anything else (including query syntax of the index) only separates them
+TERM_RE = re.compile(r'\w+')
+
+
+def split_terms(query):
+    return TERM_RE.findall(query)
+
+
+class BaseSearch:
+    def search(self, query, topic_id=None, after=None, limit=100):
+        """
+        Returns up to limit (rank, id) pairs of messages matching every term of query, ordered by (rank, id).
+
+        after is the (rank, id) of the last result of the previous page.
+        """
+        raise NotImplementedError
+
+
+class RankedSearch(BaseSearch):
+    """Backend scoring at most max_ranked matches, those of highest id"""
+
+    def __init__(self, max_ranked=10000):
+        self.max_ranked = max_ranked
+
+
+class SQLiteFullTextSearch(RankedSearch):
+    """FTS5 table chat_message_fts, an external content index of chat_message.text"""
+    table = 'chat_message_fts'
+
+    def search(self, query, topic_id=None, after=None, limit=100):
+        terms = split_terms(query)
+        if not terms:
+            return []
+        # every term is quoted, so it is matched as a word and never parsed as FTS5 syntax
+        match = ' '.join(f'"{term}"' for term in terms)
+        # every match in the page is scored by bm25 before the page is cut, so only matches from the max_ranked-th
+        # newest on are, found walking the index by rowid without scoring
+        sql, params = self._matches('f', 'f.rank, f.rowid', match, topic_id)
+        newest, newest_params = self._matches('g', 'g.rowid', match, topic_id)
+        sql = [sql, f'AND f.rowid >= COALESCE(({newest} ORDER BY g.rowid DESC LIMIT 1 OFFSET %s), 0)']
+        params += newest_params + [self.max_ranked - 1]
+        if after is not None:
+            sql.append('AND (f.rank > %s OR (f.rank = %s AND f.rowid > %s))')
+            params.extend([after[0], after[0], after[1]])
+        sql.append('ORDER BY f.rank, f.rowid LIMIT %s')
+        params.append(limit)
+
+        # a read replica while serving GET requests, see chat.routers
+        with connections[router.db_for_read(Message)].cursor() as cursor:
+            cursor.execute(' '.join(sql), params)
+            return cursor.fetchall()
+
+    def _matches(self, alias, columns, match, topic_id):
+        """SELECT of columns of the index rows matching match as alias (and their messages of topic_id), params"""
+        sql, params = [f'SELECT {columns} FROM {self.table} {alias}'], []
+        if topic_id is not None:
+            sql.append(f'JOIN {Message._meta.db_table} m_{alias} ON m_{alias}.id = {alias}.rowid '
+                       f'AND m_{alias}.topic_id = %s')
+            params.append(topic_id)
+        sql.append(f'WHERE {alias}.{self.table} MATCH %s')
+        params.append(match)
+        return ' '.join(sql), params
+
+
+class PostgreSQLFullTextSearch(RankedSearch):
+    """Matches the expression indexed by message_text_search_idx, ts_rank is negated so lower is better"""
+    config = 'simple'
+
+    def search(self, query, topic_id=None, after=None, limit=100):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+        terms = split_terms(query)
+        if not terms:
+            return []
+        vector = SearchVector('text', config=self.config)
+        search_query = SearchQuery(' '.join(terms), config=self.config, search_type='plain')
+        messages = Message.objects.annotate(vector=vector).filter(vector=search_query)
+        if topic_id is not None:
+            messages = messages.filter(topic=topic_id)
+        # the newest max_ranked matches, from the GIN index without scoring
+        newest = messages.order_by('-id').values('id')[:self.max_ranked]
+        messages = messages.filter(id__in=newest).annotate(rank=-SearchRank(vector, search_query))
+        if after is not None:
+            messages = messages.filter(Q(rank__gt=after[0]) | Q(rank=after[0], id__gt=after[1]))
+        return list(messages.order_by('rank', 'id').values_list('rank', 'id')[:limit])
+
+
+class ContainsSearch(BaseSearch):
+    """Works on every database, scans all messages (of the topic), every result has rank 0"""
+
+    def search(self, query, topic_id=None, after=None, limit=100):
+        terms = split_terms(query)
+        if not terms:
+            return []
+        messages = Message.objects.all()
+        for term in terms:
+            messages = messages.filter(text__icontains=term)
+        if topic_id is not None:
+            messages = messages.filter(topic=topic_id)
+        if after is not None:
+            messages = messages.filter(id__gt=after[1])
+        messages = messages.annotate(rank=Value(0.0, output_field=FloatField()))
+        return list(messages.order_by('id').values_list('rank', 'id')[:limit])
+
+
+_search = None
+_search_lock = threading.Lock()
+
+
+def get_search():
+    global _search
+    if _search is None:
+        with _search_lock:
+            if _search is None:
+                config = getattr(settings, 'CHAT_SEARCH', {})
+                backend = import_string(config.get('BACKEND', 'chat.search.ContainsSearch'))
+                _search = backend(**config.get('OPTIONS', {}))
+    return _search
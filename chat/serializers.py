@@ -1,5 +1,10 @@
-from django.core.exceptions import ValidationError
-from rest_framework import serializers
+import datetime
+from collections import namedtuple
+
+from django.core.exceptions import ImproperlyConfigured, ValidationError
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
 from .models import Topic, Message
 
@@ -7,12 +12,52 @@ from .models import Topic, Message
 class TopicSerializer(serializers.ModelSerializer):
     class Meta:
         model = Topic
-        fields = ('id', 'title', 'created_at')
+        fields = ('id', 'title', 'created_at', 'message_count', 'last_message_at')
+        read_only_fields = Topic.activity_fields
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        return add_latest_messages(data, self.context)
+
+
+def add_latest_messages(data, context):
+    """Adds the messages of context['latest_messages'] (topic id -> message data) to the data of a topic, if given"""
+    latest_messages = context.get('latest_messages')
+    if latest_messages is not None:
+        data['latest_messages'] = latest_messages.get(data['id'], [])
+    return data
+
+
+class TopicPrimaryKeyField(serializers.PrimaryKeyRelatedField):
+    """
+    Looks topics up in context['topics'] (id -> Topic) when it is given, so validating a batch of messages
+    costs one query instead of one per message
+    """
+
+    def to_internal_value(self, data):
+        topics = self.context.get('topics')
+        if topics is None:
+            return super().to_internal_value(data)
+        try:
+            return topics[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class MessageListSerializer(serializers.ListSerializer):
+
+    def create(self, validated_data):
+        return Message.objects.bulk_create_messages([Message(**attrs) for attrs in validated_data])
 
 
 class MessageSerializer(serializers.ModelSerializer):
+    topic = TopicPrimaryKeyField(queryset=Topic.objects.all())
+
     class Meta:
         model = Message
+        list_serializer_class = MessageListSerializer
 
         fields = ('id', 'text', 'topic', 'created_at')
 
@@ -20,8 +65,119 @@ class MessageSerializer(serializers.ModelSerializer):
         instance = self.instance
 
         if instance is not None:
-            prievous_topic_id = instance.topic.id
+            prievous_topic_id = instance.topic_id
             new_topic_id = data.id
             if new_topic_id is not None and (prievous_topic_id != new_topic_id):
                 raise ValidationError('Cannot update message topic')
         return data
+
+
+class ValuesSerializer:
+    """
+    Read-only stand-in for serializer_class serializing rows of values_list(named=True) instead of model instances.
+
+    The fields of serializer_class are inspected once, data is then built with one dict per row and only datetimes
+    converted, with the format and timezone of the field like DateTimeField.to_representation. Other values are
+    model fields and primary keys of relations, taken as they come from the database. data is equal to the data of
+    serializer_class for the same objects.
+    """
+    serializer_class = None
+    # field classes whose representation is the database value
+    plain_fields = (serializers.IntegerField, serializers.CharField, serializers.BooleanField,
+                    serializers.PrimaryKeyRelatedField)
+
+    def __init__(self, instance=None, many=False, context=None, **kwargs):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+
+    @classmethod
+    def values_list(cls, queryset):
+        """queryset of the rows to serialize, the rows also have the attributes of the fields' sources"""
+        return queryset.values_list(*(source for _, source, _ in cls.get_fields()), named=True)
+
+    @classmethod
+    def rows_of(cls, instances):
+        """Rows like those of values_list() of model instances not read with it, e.g. archived messages"""
+        if '_row_class' not in cls.__dict__:
+            sources = [source for _, source, _ in cls.get_fields()]
+            opts = cls.serializer_class.Meta.model._meta
+            cls._row_class = namedtuple('Row', sources)
+            cls._row_attnames = [opts.get_field(source).attname for source in sources]
+        return [cls._row_class(*(getattr(obj, attname) for attname in cls._row_attnames)) for obj in instances]
+
+    @classmethod
+    def get_fields(cls):
+        """(name, source, DateTimeField or None) of every readable field"""
+        if '_fields' not in cls.__dict__:
+            fields = []
+            for name, field in cls.serializer_class().fields.items():
+                if field.write_only:
+                    continue
+                if '.' in field.source or field.source == '*' or getattr(field, 'pk_field', None) is not None:
+                    raise ImproperlyConfigured(f'{cls.__name__} cannot serialize field {name} with source '
+                                               f'{field.source}')
+                if isinstance(field, serializers.DateTimeField):
+                    fields.append((name, field.source, field))
+                elif isinstance(field, cls.plain_fields):
+                    fields.append((name, field.source, None))
+                else:
+                    raise ImproperlyConfigured(f'{cls.__name__} cannot serialize {type(field).__name__} {name}')
+            cls._fields = fields
+        return cls._fields
+
+    @property
+    def data(self):
+        if self.many:
+            return self.to_representation(self.instance)
+        return self.to_representation([self.instance])[0]
+
+    def to_representation(self, rows):
+        fields = self.get_fields()
+        names = [name for name, _, _ in fields]
+        converters = [(name, self.get_datetime_converter(field)) for name, _, field in fields if field is not None]
+        data = []
+        for row in rows:
+            item = dict(zip(names, row))
+            for name, convert in converters:
+                value = item[name]
+                # like DateTimeField.to_representation, a missing value is None
+                item[name] = convert(value) if value else None
+            data.append(item)
+        return data
+
+    @staticmethod
+    def get_datetime_converter(field):
+        """Function converting a datetime like field.to_representation, with the settings of the current request"""
+        output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+        if output_format is None:
+            return lambda value: value
+        field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+        iso_8601 = output_format.lower() == ISO_8601
+
+        def convert(value):
+            # DateTimeField.enforce_timezone
+            if field_timezone is not None:
+                if value.utcoffset() is not None:
+                    value = value.astimezone(field_timezone)
+                else:
+                    value = timezone.make_aware(value, field_timezone)
+            elif value.utcoffset() is not None:
+                value = timezone.make_naive(value, datetime.timezone.utc)
+            if iso_8601:
+                value = value.isoformat()
+                return value[:-6] + 'Z' if value.endswith('+00:00') else value
+            return value.strftime(output_format)
+
+        return convert
+
+
+class TopicValuesSerializer(ValuesSerializer):
+    serializer_class = TopicSerializer
+
+    def to_representation(self, rows):
+        return [add_latest_messages(item, self.context) for item in super().to_representation(rows)]
+
+
+class MessageValuesSerializer(ValuesSerializer):
+    serializer_class = MessageSerializer
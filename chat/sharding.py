@@ -0,0 +1,251 @@
+"""
+Sharding of topics over several databases, every topic lives in one shard along with its messages and tombstones.
+
+Message writes update the change sequence and counters of their topic in the same transaction (see
+Topic.bump_change_seq), so the topic row stays with its messages and every write is a transaction of one
+database. The default database holds the directory (models.TopicShard) and the id sequences (models.IdSequence):
+ids of topics and messages are unique across shards and survive moves.
+
+New topics are placed by consistent hashing of their id on a ring with VIRTUAL_NODES points per shard, adding a
+shard moves only the topics the ring now maps to it. manage.py rebalance_shards moves every topic whose shard
+differs from the ring, one at a time while it stays readable and writable (see move_topic()).
+
+Views route queries with chat.routers.ShardRouter (see views.ShardRoutingMixin): requests about one topic (nested
+message routes, topic details, message details) run in its shard, lists of all topics or messages and search across
+topics query every shard and merge the results in page order: a page of them costs one query per shard, each
+reading up to a page of rows, so their latency and database load grow with the number of shards. A batch of
+messages must belong to one shard, a transaction cannot span databases.
+
+Configured by settings.CHAT_SHARDS, None disables sharding and everything stays in the default database:
+
+    DATABASES = {'default': {...}, 'shard1': {...}, 'shard2': {...}}
+    CHAT_SHARDS = {
+        'DATABASES': ['shard1', 'shard2'],
+        'VIRTUAL_NODES': 64,
+    }
+
+Topics are created through the API or create_topic_entry(), which allocates the id and records the shard.
+"""
+import bisect
+import hashlib
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import ArchiveBlock, ArchivedMessage, IdSequence, Message, MessageTombstone, Topic, TopicShard
+from .routers import use_shard
+from .search import BaseSearch
+
+# fields of a topic copied as they are by move_topic()
+TOPIC_FIELDS = ('title', 'created_at', 'change_seq', 'message_count', 'last_message_at')
+
+
+class TopicMoved(APIException):
+    """A write of a topic that moved to another shard after the request looked it up"""
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The topic was moved to another shard, retry the request.'
+    default_code = 'topic_moved'
+    # seconds, sent as Retry-After
+    wait = 1
+
+
+def is_sharded():
+    return getattr(settings, 'CHAT_SHARDS', None) is not None
+
+
+def get_shards():
+    config = getattr(settings, 'CHAT_SHARDS', None)
+    return list(config['DATABASES']) if config else []
+
+
+class HashRing:
+    """Consistent hashing of keys to nodes, every node owns the arcs ending at its virtual_nodes points"""
+
+    def __init__(self, nodes, virtual_nodes=64):
+        points = sorted((self.hash(f'{node}#{index}'), node) for node in nodes for index in range(virtual_nodes))
+        self.points = [point for point, _ in points]
+        self.nodes = [node for _, node in points]
+
+    @staticmethod
+    def hash(key):
+        return int.from_bytes(hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+    def get(self, key):
+        return self.nodes[bisect.bisect(self.points, self.hash(key)) % len(self.points)]
+
+
+_rings = {}
+
+
+def get_ring():
+    config = settings.CHAT_SHARDS
+    key = (tuple(config['DATABASES']), config.get('VIRTUAL_NODES', 64))
+    if key not in _rings:
+        _rings[key] = HashRing(*key)
+    return _rings[key]
+
+
+def ring_shard(topic_id):
+    """Shard the ring places the topic in"""
+    return get_ring().get(topic_id)
+
+
+def shard_of_topic(topic_id):
+    """Shard holding the topic, the one the ring places it in when the directory does not know the topic"""
+    shard = TopicShard.objects.filter(topic_id=topic_id).values_list('shard', flat=True).first()
+    return shard or ring_shard(topic_id)
+
+
+def shards_of_topics(topic_ids):
+    """Set of the shards holding the topics"""
+    known = dict(TopicShard.objects.filter(topic_id__in=topic_ids).values_list('topic_id', 'shard'))
+    return {known.get(topic_id) or ring_shard(topic_id) for topic_id in topic_ids}
+
+
+def shards_with(model, ids):
+    """Shards holding rows of model with the primary keys ids"""
+    return [alias for alias in get_shards() if model.objects.using(alias).filter(pk__in=ids).exists()]
+
+
+def create_topic_entry():
+    """Allocates the id of a new topic and records the shard it goes to, returns (topic id, shard)"""
+    topic_id = IdSequence.allocate(Topic, 1)[0]
+    shard = ring_shard(topic_id)
+    TopicShard.objects.create(topic_id=topic_id, shard=shard)
+    return topic_id, shard
+
+
+def in_bulk(model, ids):
+    """model.objects.in_bulk(ids) over every shard"""
+    objects = {}
+    for alias in get_shards():
+        objects.update(model.objects.using(alias).in_bulk(ids))
+    return objects
+
+
+class ShardedSearch(BaseSearch):
+    """
+    Searches every shard with backend and merges the pages, bm25 ranks are only comparable within a shard. A page
+    runs one search per shard, each scoring up to the max_ranked matches of its shard (see chat.search).
+    """
+
+    def __init__(self, backend, shards):
+        self.backend = backend
+        self.shards = shards
+
+    def search(self, query, topic_id=None, after=None, limit=100):
+        pages = []
+        for alias in self.shards:
+            with use_shard(alias):
+                pages.append(self.backend.search(query, topic_id=topic_id, after=after, limit=limit))
+        return list(islice(heapq.merge(*pages), limit))
+
+
+def register_topics():
+    """Adds topics found in the shards but missing from the directory, e.g. of a database sharded later"""
+    registered = set(TopicShard.objects.values_list('topic_id', flat=True))
+    entries = []
+    for alias in get_shards():
+        for topic_id in Topic.objects.using(alias).values_list('id', flat=True).iterator():
+            if topic_id not in registered:
+                registered.add(topic_id)
+                entries.append(TopicShard(topic_id=topic_id, shard=alias))
+    TopicShard.objects.bulk_create(entries, batch_size=1000)
+    return len(entries)
+
+
+def misplaced_topics():
+    """(topic id, shard, ring shard) of the topics the ring places in another shard than the one holding them"""
+    for topic_id, shard in TopicShard.objects.order_by('topic_id').values_list('topic_id', 'shard').iterator():
+        target = ring_shard(topic_id)
+        if target != shard:
+            yield topic_id, shard, target
+
+
+def move_topic(topic_id, target, chunk_size=2000):
+    """
+    Moves the topic with its messages, tombstones and archive blocks to the shard target, returns the number of
+    messages moved (archived ones are not, their segment files stay where they are).
+
+    Rows up to the change_seq of the topic at the start are copied in chunks while the topic is read and written as
+    usual. Then the topic row is locked in the source shard by an UPDATE (SQLite locks the whole shard for writing,
+    for the busy timeout at most), the rows changed since are copied, the directory is switched to target and the
+    topic is deleted from the source in the same transaction. Writes that waited for the lock find no topic and fail
+    with Topic.DoesNotExist, views answer them with TopicMoved and the retry goes to target.
+    """
+    source = shard_of_topic(topic_id)
+    if source == target:
+        return 0
+    topic = Topic.objects.using(source).get(id=topic_id)
+    copied_seq = topic.change_seq
+
+    with transaction.atomic(using=target):
+        # leftovers of an interrupted move
+        Topic.objects.using(target).filter(id=topic_id).delete()
+        Topic.objects.using(target).bulk_create([topic])
+    messages = Message.objects.using(source).filter(topic=topic_id)
+    tombstones = MessageTombstone.objects.using(source).filter(topic=topic_id)
+    moved = _copy_chunks(messages.filter(change_seq__lte=copied_seq), target, chunk_size)
+    _copy_chunks(tombstones.filter(change_seq__lte=copied_seq), target, chunk_size, keep_pk=False)
+    blocks = ArchiveBlock.objects.using(source).filter(topic=topic_id)
+    copied_blocks = _copy_blocks(blocks, target, chunk_size)
+
+    with transaction.atomic(using=source):
+        if not Topic.objects.using(source).filter(id=topic_id).update(change_seq=F('change_seq')):
+            # deleted meanwhile
+            Topic.objects.using(target).filter(id=topic_id).delete()
+            return 0
+        topic = Topic.objects.using(source).get(id=topic_id)
+        changed = list(messages.filter(change_seq__gt=copied_seq))
+        deleted = list(tombstones.filter(change_seq__gt=copied_seq))
+        with transaction.atomic(using=target):
+            Topic.objects.using(target).filter(id=topic_id).update(
+                **{field: getattr(topic, field) for field in TOPIC_FIELDS})
+            Message.objects.using(target).filter(
+                id__in=[msg.id for msg in changed] + [tombstone.message_id for tombstone in deleted]).delete()
+            Message.objects.using(target).bulk_create(changed, batch_size=chunk_size)
+            for tombstone in deleted:
+                tombstone.pk = None
+            MessageTombstone.objects.using(target).bulk_create(deleted, batch_size=chunk_size)
+            # messages archived since were copied as messages
+            archived = _copy_blocks(blocks.exclude(id__in=copied_blocks), target, chunk_size)
+            Message.objects.using(target).filter(id__in=list(ArchivedMessage.objects.using(source).filter(
+                block__in=archived).values_list('id', flat=True))).delete()
+        TopicShard.objects.update_or_create(topic_id=topic_id, defaults={'shard': target})
+        with use_shard(source):
+            # like any topic delete, cached responses of the topic are dropped when source commits
+            topic.delete()
+    return moved + len(changed)
+
+
+def _copy_blocks(blocks, target, chunk_size):
+    """Copies the archive blocks (see chat.archive) with their message entries to the shard target, returns their ids"""
+    ids = list(blocks.values_list('id', flat=True))
+    if ids:
+        ArchiveBlock.objects.using(target).bulk_create(blocks.filter(id__in=ids), batch_size=chunk_size)
+        _copy_chunks(ArchivedMessage.objects.using(blocks.db).filter(block__in=ids), target, chunk_size)
+    return ids
+
+
+def _copy_chunks(queryset, target, chunk_size, keep_pk=True):
+    """Copies the rows of queryset to the shard target in chunks in primary key order, returns their number"""
+    copied = 0
+    last = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last is not None:
+            chunk = chunk.filter(pk__gt=last)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return copied
+        last = chunk[-1].pk
+        if not keep_pk:
+            for obj in chunk:
+                obj.pk = None
+        type(chunk[0]).objects.using(target).bulk_create(chunk)
+        copied += len(chunk)
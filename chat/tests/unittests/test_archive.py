@@ -0,0 +1,206 @@
+import datetime
+import os
+import tempfile
+import unittest
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import status
+
+from chat import archive
+from chat.cache import get_response_cache, topic_scope
+from chat.models import ArchiveBlock, Message, Topic
+from chat.tests.unittests.test_pagination import get_links
+from chat.tests.unittests.test_transfer_commands import Interrupted, interrupt_after
+
+
+def create_message(topic, id, days_ago):
+    created_at = timezone.now() - datetime.timedelta(days=days_ago)
+    with mock.patch('django.utils.timezone.now', mock.Mock(return_value=created_at)):
+        return Message.objects.create(id=id, text=f'Typical message number {id}', topic=topic)
+
+
+@override_settings(CHAT_RESPONSE_CACHE=None)
+class ArchiveTest(TestCase):
+    """Messages 1-7 of topic 1 and 8-9 of topic 2 are older than 30 days, messages 10-12 of topic 1 are recent"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings = override_settings(CHAT_ARCHIVE={'DIRECTORY': self.directory.name, 'BLOCK_MESSAGES': 3})
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.topic = Topic.objects.create(id=1, title='What is the weather like?')
+        self.other_topic = Topic.objects.create(id=2, title='The Most Popular Color in the World')
+        for id in range(1, 8):
+            create_message(self.topic, id, days_ago=60 - id)
+        for id in (8, 9):
+            create_message(self.other_topic, id, days_ago=60 - id)
+        for id in (10, 11, 12):
+            create_message(self.topic, id, days_ago=1)
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return response
+
+    def archive_messages(self, *args):
+        out = StringIO()
+        call_command('archive_messages', *args, stdout=out)
+        return out.getvalue()
+
+    def test_old_messages_move_to_segment_files(self):
+        before = self.get('/topics/1/messages/').content
+
+        self.assertIn('Archived 9 messages', self.archive_messages())
+
+        self.assertEqual(list(Message.objects.order_by('id').values_list('id', flat=True)), [10, 11, 12])
+        self.assertEqual([(block.topic_id, block.count, block.first_id, block.last_id, block.codec)
+                          for block in ArchiveBlock.objects.order_by('first_id')],
+                         [(1, 3, 1, 3, 'zlib'), (1, 3, 4, 6, 'zlib'), (1, 1, 7, 7, 'zlib'), (2, 2, 8, 9, 'zlib')])
+        self.assertTrue(os.path.exists(os.path.join(self.directory.name, '1', '000001.seg')))
+        self.assertEqual(self.get('/topics/1/messages/').content, before)
+        self.assertEqual(self.get('/topics/1/').json()['message_count'], 10)
+        self.assertIn('Archived 0 messages', self.archive_messages())
+
+    def test_archiving_drops_cached_responses_of_the_topic(self):
+        with override_settings(CHAT_RESPONSE_CACHE='chat'):
+            generation = get_response_cache().get_generation(topic_scope(2))
+            with self.captureOnCommitCallbacks(execute=True):
+                self.archive_messages('2')
+
+            self.assertEqual(get_response_cache().get_generation(topic_scope(2)), generation + 1)
+
+    def test_dry_run_and_topics(self):
+        self.assertIn('Would archive 9 messages', self.archive_messages('--dry-run'))
+        self.assertEqual(Message.objects.count(), 12)
+
+        self.assertIn('Archived 2 messages', self.archive_messages('2'))
+        self.assertIn('Archived 4 messages', self.archive_messages('1', '--age-days', '55.5'))
+        self.assertEqual(Message.objects.filter(topic=1).count(), 6)
+
+    def test_pages_cross_the_tiers(self):
+        expected = [message['id'] for message in self.get('/topics/1/messages/').json()]
+        self.archive_messages()
+
+        for path in ('/topics/1/messages/', '/messages/'):
+            pages = []
+            response = self.get(path, page_size=4)
+            while True:
+                pages.append([message['id'] for message in response.json()])
+                if 'next' not in get_links(response):
+                    break
+                response = self.get(get_links(response)['next'])
+            backwards = self.get(get_links(response)['prev'])
+
+            ids = [id for page in pages for id in page]
+            self.assertEqual(ids, expected if path != '/messages/' else [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12])
+            self.assertEqual([message['id'] for message in backwards.json()], ids[-len(pages[-1]) - 4:-len(pages[-1])])
+
+    def test_retrieve_from_the_archive(self):
+        before = self.get('/topics/1/messages/2/').json()
+        self.archive_messages()
+
+        self.assertEqual(self.get('/topics/1/messages/2/').json(), before)
+        self.assertEqual(self.get('/messages/2/').json(), before)
+        self.assertEqual(self.get('/messages/2/', format='api').status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get('/topics/2/messages/2/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get('/messages/99/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_archived_messages_are_read_only(self):
+        self.archive_messages()
+
+        response = self.client.patch('/messages/2/', {'text': 'An edited message'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.client.delete('/topics/1/messages/2/').status_code, status.HTTP_409_CONFLICT)
+
+    def test_export_includes_archived_messages(self):
+        before = b''.join(self.client.get('/topics/1/messages/export/').streaming_content)
+        self.archive_messages()
+
+        self.assertEqual(b''.join(self.client.get('/topics/1/messages/export/').streaming_content), before)
+
+    def test_export_command_includes_archived_messages(self):
+        directory = os.path.join(self.directory.name, 'dump')
+
+        def export(*args):
+            call_command('chat_export', directory, '--chunk-size', '2', *args, stdout=StringIO(), verbosity=0)
+            with open(os.path.join(directory, 'messages.ndjson'), 'rb') as file:
+                return file.read()
+
+        before = export()
+        self.archive_messages()
+
+        self.assertEqual(export(), before)
+        # the export is interrupted after the archived messages 1 and 2 and resumes in the archive
+        with interrupt_after(3), self.assertRaises(Interrupted):
+            export()
+        self.assertEqual(export('--resume'), before)
+
+    def test_blocks_out_of_order(self):
+        self.archive_messages('--age-days', '55')
+        # a message older than archived ones, e.g. imported, is archived in a later block
+        create_message(self.topic, 13, days_ago=58.5)
+        self.archive_messages()
+
+        ids = [message['id'] for message in self.get('/topics/1/messages/').json()]
+        self.assertEqual(ids, [1, 13, 2, 3, 4, 5, 6, 7, 10, 11, 12])
+        self.assertEqual([message['id'] for message in self.get('/topics/1/messages/', page_size=2).json()], [1, 13])
+
+    def test_counters_include_archived_messages(self):
+        last_message_at = Topic.objects.get(id=2).last_message_at
+        self.archive_messages()
+
+        self.assertEqual(Topic.objects.all().repair_activity(), [])
+        self.assertEqual(Topic.objects.get(id=2).last_message_at, last_message_at)
+
+    def test_deleting_the_recent_messages(self):
+        last_archived_at = Message.objects.get(id=7).created_at
+        self.archive_messages()
+        self.assertEqual(self.client.delete('/messages/10/').status_code, status.HTTP_204_NO_CONTENT)
+        response = self.client.delete('/messages/bulk/', [11, 12], content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        topic = Topic.objects.get(id=1)
+        self.assertEqual((topic.message_count, topic.last_message_at), (7, last_archived_at))
+        self.assertEqual(Topic.objects.all().repair_activity(), [])
+
+    def test_segments_and_topic_deletion(self):
+        with override_settings(CHAT_ARCHIVE={'DIRECTORY': self.directory.name, 'BLOCK_MESSAGES': 3,
+                                             'SEGMENT_BYTES': 1}):
+            self.archive_messages('1')
+
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory.name, '1'))),
+                         ['000001.seg', '000002.seg', '000003.seg'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete('/topics/1/').status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(os.path.exists(os.path.join(self.directory.name, '1')))
+        self.assertFalse(ArchiveBlock.objects.filter(topic=1).exists())
+
+    def test_topic_recreated_with_the_same_id(self):
+        def archive_topic(text):
+            topic = Topic.objects.create(id=3, title='Recreated')
+            with mock.patch('django.utils.timezone.now', mock.Mock(return_value=created_at)):
+                Message.objects.create(id=20, text=text, topic=topic)
+            self.archive_messages('3')
+            return ArchiveBlock.objects.get(topic=3)
+
+        created_at = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+        block = archive_topic('The first text')
+        self.assertEqual(self.get('/messages/20/').json()['text'], 'The first text')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete('/topics/3/')
+
+        # the new segment has the block at the same place with the same length
+        self.assertEqual(archive_topic('The other text').length, block.length)
+        self.assertEqual(self.get('/messages/20/').json()['text'], 'The other text')
+
+    @unittest.skipIf(archive.zstandard is None, 'zstandard is not installed')
+    def test_zstd(self):
+        with override_settings(CHAT_ARCHIVE={'DIRECTORY': self.directory.name, 'COMPRESSION': 'zstd'}):
+            self.archive_messages()
+            self.assertEqual(self.get('/messages/2/').json()['id'], 2)
@@ -0,0 +1,131 @@
+import asyncio
+import importlib
+import json
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.test import AsyncClient, SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import resolve, reverse
+from rest_framework import status
+
+from chat.async_views import AsyncViewSetMixin
+from chat.models import Topic, Message
+
+
+@override_settings(ROOT_URLCONF='chatting.urls_async', CHAT_RESPONSE_CACHE='chat')
+class AsyncViewsTest(TransactionTestCase):
+    """
+    Async views answer like the sync views of chatting.urls.
+
+    Runs in autocommit like production requests, the async views cannot see the test case transaction (which is
+    on the connection of another thread), so they would fill the response cache from it.
+    """
+
+    def setUp(self) -> None:
+        caches['chat'].clear()
+        self.topics_saved = [Topic.objects.create(id=1, title='What is the weather like?'),
+                             Topic.objects.create(id=2, title='The Most Popular Color in the World')]
+        for id in range(1, 5):
+            Message.objects.create(id=id, text=f'Typical message number {id}', topic=self.topics_saved[id % 2])
+        self.async_client = AsyncClient()
+
+    def sync_get(self, url):
+        with override_settings(ROOT_URLCONF='chatting.urls'):
+            return self.client.get(url)
+
+    def assertSameResponse(self, response, expected):
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        for header in ('Content-Type', 'Link', 'ETag'):
+            self.assertEqual(response.get(header), expected.get(header))
+
+    def test_read_views_are_async(self):
+        for url in ('/topics/', '/topics/1/', '/messages/', '/messages/1/', '/topics/1/messages/',
+                    '/topics/1/messages/2/'):
+            self.assertTrue(asyncio.iscoroutinefunction(resolve(url).func), url)
+
+    async def test_same_responses_as_sync_views(self):
+        for url in ('/topics/', '/topics/2/', '/messages/', '/messages/3/', '/topics/1/messages/',
+                    '/topics/2/messages/3/', '/topics/1/messages/?page_size=1', '/topics/99/', '/messages/abc/',
+                    '/topics/1/messages/3/'):
+            response = await self.async_client.get(url)
+            expected = await sync_to_async(self.sync_get)(url)
+            self.assertSameResponse(response, expected)
+
+    async def test_next_page(self):
+        first_page = await self.async_client.get('/topics/1/messages/?page_size=1')
+        next_url = first_page['Link'].split('<')[1].split('>')[0]
+
+        response = await self.async_client.get(next_url)
+
+        self.assertEqual([msg['id'] for msg in json.loads(response.content)], [4])
+
+    async def test_matching_etag_is_not_modified(self):
+        etag = (await self.async_client.get('/topics/1/messages/'))['ETag']
+
+        response = await self.async_client.get('/topics/1/messages/', headers={'If-None-Match': etag})
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    async def test_create_message_in_topic(self):
+        response = await self.async_client.post(reverse('message-from-topic-list', args=(1,)),
+                                                {'text': 'Hot and sunny day', 'topic': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        message = await Message.objects.aget(id=response.json()['id'])
+        self.assertEqual(message.topic_id, 1)
+        topic = await Topic.objects.aget(id=1)
+        self.assertEqual(topic.message_count, 3)
+
+    async def test_create_message_and_topic_with_json(self):
+        response = await self.async_client.post('/messages/', {'text': 'Hot and sunny day', 'topic': 2},
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['topic'], 2)
+
+        response = await self.async_client.post('/topics/', {'title': 'The best programming language'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.json()['title'], 'The best programming language')
+
+    async def test_invalid_create(self):
+        response = await self.async_client.post('/messages/', {'text': 'Hot and sunny day', 'topic': 99})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('topic', response.json())
+
+        response = await self.async_client.post('/topics/99/messages/', {'text': 'Hot and sunny day'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(await Message.objects.acount(), 4)
+
+    async def test_other_actions_run_sync_view(self):
+        response = await self.async_client.patch('/topics/1/', {'title': 'What is the weather like today?'},
+                                                 content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()['title'], 'What is the weather like today?')
+
+        response = await self.async_client.delete('/topics/1/messages/2/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = await self.async_client.get('/topics/1/messages/search/?q=typical')
+        self.assertEqual([msg['id'] for msg in response.json()], [4])
+
+    async def test_requests_with_credentials_and_browsable_api_run_sync_view(self):
+        with mock.patch.object(AsyncViewSetMixin, 'alist') as alist:
+            response = await self.async_client.get('/topics/', headers={'Authorization': 'Token abc'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = await self.async_client.get('/topics/', headers={'Accept': 'text/html'})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertIn(b'<html', response.content)
+        alist.assert_not_called()
+
+
+class ASGIApplicationTest(SimpleTestCase):
+
+    def test_async_views_are_opt_in(self):
+        from chatting import asgi
+        self.addCleanup(importlib.reload, asgi)
+
+        self.assertEqual(type(importlib.reload(asgi).django_application).__name__, 'ASGIHandler')
+        with override_settings(CHAT_ASYNC_VIEWS=True):
+            self.assertEqual(type(importlib.reload(asgi).django_application).__name__, 'AsyncURLConfHandler')
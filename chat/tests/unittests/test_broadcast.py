@@ -0,0 +1,164 @@
+import asyncio
+import json
+import tempfile
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory
+
+from chat.broadcast import OVERFLOW, InMemoryBroadcast, LocalSocketBroadcast, topic_channel
+from chat.models import Topic, Message
+from chat.views import MessageFromTopicViewSet, MessageViewSet
+from chat.websocket import CLOSE_NOT_FOUND, CLOSE_TRY_AGAIN_LATER, topic_messages_socket
+
+
+class InMemoryBroadcastTest(SimpleTestCase):
+
+    async def test_subscriber_receives_published_message(self):
+        broadcast = InMemoryBroadcast()
+        subscription = broadcast.subscribe(topic_channel(1))
+
+        broadcast.publish(topic_channel(1), {'event': 'created', 'message': {'id': 1}})
+
+        text = await asyncio.wait_for(subscription.get(), timeout=1)
+        self.assertEqual(json.loads(text), {'event': 'created', 'message': {'id': 1}})
+
+    async def test_subscriber_of_other_channel_receives_nothing(self):
+        broadcast = InMemoryBroadcast()
+        subscription = broadcast.subscribe(topic_channel(2))
+
+        broadcast.publish(topic_channel(1), {'event': 'created'})
+        await asyncio.sleep(0)
+
+        self.assertTrue(subscription.queue.empty())
+
+    async def test_slow_subscriber_overflows(self):
+        broadcast = InMemoryBroadcast(max_queue=2)
+        subscription = broadcast.subscribe(topic_channel(1))
+
+        for id in range(3):
+            broadcast.publish(topic_channel(1), {'id': id})
+        await asyncio.sleep(0)
+
+        self.assertIs(await subscription.get(), OVERFLOW)
+        self.assertTrue(subscription.queue.empty())
+
+    async def test_unsubscribe(self):
+        broadcast = InMemoryBroadcast()
+        subscription = broadcast.subscribe(topic_channel(1))
+        subscription.close()
+
+        self.assertEqual(broadcast.subscribers_count(topic_channel(1)), 0)
+
+
+class LocalSocketBroadcastTest(SimpleTestCase):
+
+    async def test_event_crosses_broadcast_instances(self):
+        with tempfile.TemporaryDirectory() as path:
+            receiving = LocalSocketBroadcast(path)
+            publishing = LocalSocketBroadcast(path)
+            subscription = receiving.subscribe(topic_channel(1))
+
+            publishing.publish(topic_channel(1), {'event': 'deleted', 'message': {'id': 1, 'topic': 1}})
+
+            text = await asyncio.wait_for(subscription.get(), timeout=1)
+            self.assertEqual(json.loads(text), {'event': 'deleted', 'message': {'id': 1, 'topic': 1}})
+            receiving.close()
+
+
+class TopicMessagesSocketTest(TestCase):
+
+    def setUp(self) -> None:
+        self.topic = Topic.objects.create(id=1, title='What is the weather like?')
+        self.broadcast = InMemoryBroadcast(max_queue=2)
+
+    async def connect(self, path):
+        received = asyncio.Queue()
+        sent = asyncio.Queue()
+        await received.put({'type': 'websocket.connect'})
+        with mock.patch('chat.websocket.get_broadcast', mock.Mock(return_value=self.broadcast)):
+            task = asyncio.ensure_future(topic_messages_socket({'type': 'websocket', 'path': path}, received.get, sent.put))
+            first = await asyncio.wait_for(sent.get(), timeout=1)
+        return task, received, sent, first
+
+    async def test_unknown_topic_is_closed(self):
+        task, _, _, first = await self.connect('/ws/topics/99/messages/')
+        await task
+
+        self.assertEqual(first, {'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+
+    async def test_events_are_pushed(self):
+        task, received, sent, first = await self.connect('/ws/topics/1/messages/')
+        self.assertEqual(first, {'type': 'websocket.accept'})
+
+        self.broadcast.publish(topic_channel(1), {'event': 'created', 'message': {'id': 1, 'topic': 1}})
+        frame = await asyncio.wait_for(sent.get(), timeout=1)
+        self.assertEqual(frame['type'], 'websocket.send')
+        self.assertEqual(json.loads(frame['text']), {'event': 'created', 'message': {'id': 1, 'topic': 1}})
+
+        await received.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(task, timeout=1)
+        self.assertEqual(self.broadcast.subscribers_count(topic_channel(1)), 0)
+
+    async def test_slow_consumer_is_closed(self):
+        task, received, sent, _ = await self.connect('/ws/topics/1/messages/')
+
+        for id in range(3):
+            self.broadcast.publish(topic_channel(1), {'id': id})
+
+        frame = await asyncio.wait_for(sent.get(), timeout=1)
+        await asyncio.wait_for(task, timeout=1)
+        self.assertEqual(frame, {'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN_LATER})
+
+
+class MessageViewsPublishTest(TestCase):
+
+    def setUp(self) -> None:
+        self.topic = Topic.objects.create(id=1, title='What is the weather like?')
+        self.factory = APIRequestFactory()
+        self.broadcast = mock.Mock()
+        patcher = mock.patch('chat.broadcast.get_broadcast', mock.Mock(return_value=self.broadcast))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_create_from_topic_publishes(self):
+        message_view = MessageFromTopicViewSet.as_view({'post': 'create'})
+        request = self.factory.post(reverse('message-from-topic-list', args=(1,)), {'text': 'Hot and sunny day'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = message_view(request, topic_id=1)
+
+        channel, payload = self.broadcast.publish.call_args[0]
+        self.assertEqual(channel, topic_channel(1))
+        self.assertEqual(payload, {'event': 'created', 'message': response.data})
+
+    def test_update_publishes(self):
+        Message.objects.create(id=1, text='Hot and sunny day', topic=self.topic)
+        message_view = MessageViewSet.as_view({'patch': 'partial_update'})
+        request = self.factory.patch(reverse('messages-detail', args=(1,)), {'text': 'Cold and rainy day'})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = message_view(request, pk=1)
+
+        self.broadcast.publish.assert_called_once_with(topic_channel(1), {'event': 'updated', 'message': response.data})
+
+    def test_delete_publishes(self):
+        Message.objects.create(id=1, text='Hot and sunny day', topic=self.topic)
+        message_view = MessageFromTopicViewSet.as_view({'delete': 'destroy'})
+        request = self.factory.delete(reverse('message-from-topic-detail', args=(1, 1)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            message_view(request, topic_id=1, msg_id=1)
+
+        self.broadcast.publish.assert_called_once_with(
+            topic_channel(1), {'event': 'deleted', 'message': {'id': 1, 'topic': 1}})
+
+    def test_nothing_is_published_without_commit(self):
+        message_view = MessageFromTopicViewSet.as_view({'post': 'create'})
+        request = self.factory.post(reverse('message-from-topic-list', args=(1,)), {'text': 'Hot and sunny day'})
+
+        with self.captureOnCommitCallbacks(execute=False):
+            message_view(request, topic_id=1)
+
+        self.broadcast.publish.assert_not_called()
@@ -0,0 +1,112 @@
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from chat.models import Topic, Message
+from chat.views import MessageFromTopicViewSet, MessageViewSet, TopicViewSet
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self) -> None:
+        self.topics_saved = [Topic.objects.create(id=1, title='What is the weather like?'),
+                             Topic.objects.create(id=2, title='The Most Popular Color in the World')]
+        for id in range(1, 5):
+            Message.objects.create(id=id, text=f'Typical message number {id}', topic=self.topics_saved[id % 2])
+        self.factory = APIRequestFactory()
+
+    def get(self, view, url, etag=None, **kwargs):
+        headers = {'HTTP_IF_NONE_MATCH': etag} if etag is not None else {}
+        response = view(self.factory.get(url, **headers), **kwargs)
+        response.render()
+        return response
+
+    def get_messages(self, topic_id, query='', etag=None):
+        return self.get(MessageFromTopicViewSet.as_view({'get': 'list'}),
+                        reverse('message-from-topic-list', args=(topic_id,)) + query, etag, topic_id=topic_id)
+
+    def get_topic(self, topic_id, etag=None):
+        return self.get(TopicViewSet.as_view({'get': 'retrieve'}), reverse('topics-detail', args=(topic_id,)), etag,
+                        pk=topic_id)
+
+    def test_matching_etag_is_not_modified_without_loading_messages(self):
+        etag = self.get_messages(1)['ETag']
+
+        # only the topic version is read
+        with self.assertNumQueries(1):
+            response = self.get_messages(1, etag=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_etag_is_strong_and_stable(self):
+        etag = self.get_messages(1)['ETag']
+
+        self.assertTrue(etag.startswith('"'))
+        self.assertEqual(self.get_messages(1)['ETag'], etag)
+        self.assertEqual(self.get_messages(1, etag=f'"other", {etag}').status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_message_write_changes_etag_of_its_topic_only(self):
+        etag = self.get_messages(1)['ETag']
+        other_etag = self.get_messages(2)['ETag']
+
+        Message.objects.create(text='Hot and sunny day', topic=self.topics_saved[0])
+
+        response = self.get_messages(1, etag=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.get_messages(2, etag=other_etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_every_page_has_own_etag(self):
+        self.assertNotEqual(self.get_messages(1, '?page_size=1')['ETag'], self.get_messages(1)['ETag'])
+
+    def test_topic_update_changes_its_etag(self):
+        etag = self.get_topic(1)['ETag']
+
+        topic = Topic.objects.get(id=1)
+        topic.title = 'What is the weather like today?'
+        topic.save()
+
+        self.assertEqual(topic.change_seq, 3)
+        response = self.get_topic(1, etag=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['title'], 'What is the weather like today?')
+
+    def test_topic_list_etag_changes_on_delete(self):
+        topics_view = TopicViewSet.as_view({'get': 'list'})
+        etag = self.get(topics_view, reverse('topics-list'))['ETag']
+
+        self.assertEqual(self.get(topics_view, reverse('topics-list'), etag).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        Topic.objects.get(id=1).delete()
+        self.assertEqual(self.get(topics_view, reverse('topics-list'), etag).status_code, status.HTTP_200_OK)
+
+    def test_all_messages_etag_changes_on_write_in_any_topic(self):
+        messages_view = MessageViewSet.as_view({'get': 'list'})
+        etag = self.get(messages_view, reverse('messages-list'))['ETag']
+
+        message = Message.objects.get(id=3)
+        message.text = 'Updated typical message'
+        message.save()
+
+        self.assertEqual(self.get(messages_view, reverse('messages-list'), etag).status_code, status.HTTP_200_OK)
+
+    def test_message_detail(self):
+        message_view = MessageFromTopicViewSet.as_view({'get': 'retrieve'})
+        url = reverse('message-from-topic-detail', args=(2, 3))
+        etag = self.get(message_view, url, topic_id=2, msg_id=3)['ETag']
+
+        self.assertEqual(self.get(message_view, url, etag, topic_id=2, msg_id=3).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+        Message.objects.get(id=1).delete()
+        # deleting another message of the topic does not change this one
+        self.assertEqual(self.get(message_view, url, etag, topic_id=2, msg_id=3).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+    def test_missing_object_has_no_etag(self):
+        response = self.get_topic(99, etag='*')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(response.has_header('ETag'))
@@ -0,0 +1,100 @@
+from pathlib import Path
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import OperationalError, connection
+from django.test import SimpleTestCase, TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from chat.views import health
+from chatting.database import database_from_env, search_from_database
+
+BASE_DIR = Path('/srv/chat')
+POSTGRESQL = {'CHAT_DB_ENGINE': 'postgresql', 'CHAT_DB_NAME': 'chat', 'CHAT_DB_HOST': 'db.local',
+              'CHAT_DB_PORT': '6432', 'CHAT_DB_USER': 'chat', 'CHAT_DB_PASSWORD': 'secret'}
+
+
+class DatabaseFromEnvTest(SimpleTestCase):
+
+    def test_sqlite_by_default(self):
+        self.assertEqual(database_from_env({}, BASE_DIR),
+                         {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / 'db.sqlite3'})
+        self.assertEqual(database_from_env({'CHAT_DB_NAME': 'other.sqlite3'}, BASE_DIR)['NAME'],
+                         BASE_DIR / 'other.sqlite3')
+
+    def test_sqlite_tuned_for_concurrency(self):
+        database = database_from_env({'CHAT_DB_SQLITE_WAL': '1', 'CHAT_DB_SQLITE_BUSY_TIMEOUT': '10'}, BASE_DIR)
+
+        self.assertEqual(database['ENGINE'], 'chatting.backends.sqlite3')
+        self.assertEqual(database['OPTIONS'], {'timeout': 10, 'synchronous': 'NORMAL', 'mmap_size': 256 * 1024 * 1024,
+                                               'serialize_writes': False})
+        database = database_from_env({'CHAT_DB_SQLITE_WAL': '1', 'CHAT_DB_SQLITE_SERIALIZE_WRITES': '1'}, BASE_DIR)
+        self.assertTrue(database['OPTIONS']['serialize_writes'])
+
+    def test_postgresql_keeps_connections_with_health_checks(self):
+        database = database_from_env(POSTGRESQL, BASE_DIR)
+
+        self.assertEqual(database['ENGINE'], 'django.db.backends.postgresql')
+        self.assertEqual((database['HOST'], database['PORT'], database['USER']), ('db.local', '6432', 'chat'))
+        self.assertEqual(database['CONN_MAX_AGE'], 600)
+        self.assertTrue(database['CONN_HEALTH_CHECKS'])
+        self.assertNotIn('DISABLE_SERVER_SIDE_CURSORS', database)
+
+    def test_pool_modes(self):
+        none = database_from_env(dict(POSTGRESQL, CHAT_DB_POOL='none'), BASE_DIR)
+        self.assertEqual(none['CONN_MAX_AGE'], 0)
+
+        pgbouncer = database_from_env(dict(POSTGRESQL, CHAT_DB_POOL='pgbouncer', CHAT_DB_CONN_MAX_AGE='60',
+                                           CHAT_DB_HEALTH_CHECKS='0'), BASE_DIR)
+        self.assertEqual(pgbouncer['CONN_MAX_AGE'], 60)
+        self.assertFalse(pgbouncer['CONN_HEALTH_CHECKS'])
+        self.assertTrue(pgbouncer['DISABLE_SERVER_SIDE_CURSORS'])
+
+    def test_native_pool(self):
+        environ = dict(POSTGRESQL, CHAT_DB_POOL='native', CHAT_DB_POOL_MAX_SIZE='8')
+        with mock.patch('django.VERSION', (5, 1, 0, 'final', 0)):
+            database = database_from_env(environ, BASE_DIR)
+        self.assertEqual(database['CONN_MAX_AGE'], 0)
+        self.assertEqual(database['OPTIONS']['pool'], {'min_size': 2, 'max_size': 8, 'timeout': 10})
+
+        with mock.patch('django.VERSION', (4, 2, 0, 'final', 0)), self.assertRaises(ImproperlyConfigured):
+            database_from_env(environ, BASE_DIR)
+
+    def test_invalid_values(self):
+        for environ in ({'CHAT_DB_ENGINE': 'mysql'}, dict(POSTGRESQL, CHAT_DB_POOL='sometimes'),
+                        dict(POSTGRESQL, CHAT_DB_CONN_MAX_AGE='forever'),
+                        dict(POSTGRESQL, CHAT_DB_HEALTH_CHECKS='maybe')):
+            with self.subTest(environ=environ), self.assertRaises(ImproperlyConfigured):
+                database_from_env(environ, BASE_DIR)
+
+    def test_search_follows_the_engine(self):
+        for environ, backend in (({}, 'SQLiteFullTextSearch'), ({'CHAT_DB_SQLITE_WAL': '1'}, 'SQLiteFullTextSearch'),
+                                 (POSTGRESQL, 'PostgreSQLFullTextSearch')):
+            with self.subTest(environ=environ):
+                self.assertEqual(search_from_database(database_from_env(environ, BASE_DIR)),
+                                 {'BACKEND': f'chat.search.{backend}'})
+        self.assertEqual(search_from_database({'ENGINE': 'django.db.backends.mysql'}),
+                         {'BACKEND': 'chat.search.ContainsSearch'})
+
+
+class HealthTest(TestCase):
+
+    def get(self):
+        return health(APIRequestFactory().get(reverse('health')))
+
+    def test_database_answers(self):
+        response = self.get()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'database': 'ok'})
+
+    def test_database_down(self):
+        with mock.patch.object(connection, 'cursor', side_effect=OperationalError('connection to db.local refused')), \
+                self.assertLogs('chat.views', 'ERROR') as logs:
+            response = self.get()
+
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.data, {'database': 'unavailable'})
+        self.assertIn('connection to db.local refused', logs.output[0])
@@ -0,0 +1,77 @@
+import threading
+
+from django.test import TransactionTestCase, override_settings
+from rest_framework import status
+
+from chat import ingest
+from chat.models import Message, Topic
+from chat.serializers import MessageSerializer
+
+
+@override_settings(CHAT_INGEST={'MAX_BATCH': 50, 'MAX_DELAY_MS': 20}, CHAT_RESPONSE_CACHE=None)
+class IngestTest(TransactionTestCase):
+
+    def setUp(self):
+        self.topic = Topic.objects.create(title='What is the weather like?')
+
+    def test_create_answers_once_committed(self):
+        response = self.client.post(f'/topics/{self.topic.id}/messages/', {'text': 'Written through the queue'},
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        message = Message.objects.get(id=response.json()['id'])
+        self.assertEqual((message.text, message.topic_id), ('Written through the queue', self.topic.id))
+        self.assertEqual(response.json(), MessageSerializer(message).data)
+        topic = Topic.objects.get(id=self.topic.id)
+        self.assertEqual((topic.message_count, topic.change_seq, message.change_seq), (1, 1, 1))
+        response = self.client.post('/messages/', {'text': 'Written through the queue', 'topic': self.topic.id},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Topic.objects.get(id=self.topic.id).message_count, 2)
+
+    def test_invalid_messages_are_not_queued(self):
+        response = self.client.post(f'/topics/{self.topic.id}/messages/', {'text': 'Short'},
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ingest.get_writer().queue.qsize(), 0)
+
+    def test_concurrent_creates_share_commits(self):
+        writer = ingest.GroupCommitWriter(max_batch=50, max_delay=0.05)
+        messages = [Message(text=f'Typical message number {number}', topic=self.topic) for number in range(20)]
+        futures = [writer.submit(message) for message in messages]
+
+        # ids are known before the insert
+        self.assertEqual(len({message.id for message in messages}), 20)
+        self.assertEqual([future.result(timeout=10) for future in futures], messages)
+        self.assertEqual(sorted(Message.objects.values_list('id', flat=True)), sorted(msg.id for msg in messages))
+        self.assertEqual(writer.batches, 1)
+        self.assertEqual(Topic.objects.get(id=self.topic.id).message_count, 20)
+
+    def test_failing_message_fails_alone(self):
+        writer = ingest.GroupCommitWriter(max_batch=50, max_delay=0.05)
+        good = writer.submit(Message(text='Typical message number 1', topic=self.topic))
+        bad = writer.submit(Message(text='Typical message number 2', topic_id=self.topic.id + 1))
+
+        self.assertEqual(good.result(timeout=10).text, 'Typical message number 1')
+        with self.assertRaises(Topic.DoesNotExist):
+            bad.result(timeout=10)
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_requests_in_threads(self):
+        statuses = []
+
+        def post(number):
+            response = self.client_class().post(f'/topics/{self.topic.id}/messages/',
+                                                {'text': f'Typical message number {number}'},
+                                                content_type='application/json')
+            statuses.append(response.status_code)
+
+        threads = [threading.Thread(target=post, args=(number,)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(statuses, [status.HTTP_201_CREATED] * 8)
+        self.assertEqual(Topic.objects.get(id=self.topic.id).message_count, 8)
@@ -66,6 +66,25 @@ class MessageModelTest(TestCase):
             msg.save()
             msg.full_clean()
 
+    def test_update_loaded_message_cannot_change_topic_without_queries(self):
+        Message.objects.create(id=1, text='Typical message', topic=self.topic)
+        another_topic = Topic.objects.create(title='Best Topic ever')
+
+        msg = Message.objects.get(id=1)
+        msg.topic_id = another_topic.id
+        with self.assertNumQueries(0):
+            with self.assertRaisesMessage(ValueError, 'You cannot change the topic of the message'):
+                msg.save()
+
+    def test_update_loaded_message_queries(self):
+        """Only the topic change sequence bump and the UPDATE, no reads"""
+        Message.objects.create(id=1, text='Typical message', topic=self.topic)
+
+        msg = Message.objects.get(id=1)
+        msg.text = 'Updated typical message'
+        with self.assertNumQueries(2):
+            msg.save()
+
     def test_message_has_all_fields(self):
         date_to_mock = datetime.datetime(2020, 1, 1, 0, 0, 0, tzinfo=pytz.utc)
 
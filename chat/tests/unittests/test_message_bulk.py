@@ -0,0 +1,162 @@
+import json
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from chat.models import Topic, Message, MessageTombstone
+from chat.serializers import MessageSerializer
+from chat.views import MessageFromTopicViewSet, MessageViewSet
+
+BULK_ACTIONS = {'post': 'bulk_create', 'patch': 'bulk_update', 'delete': 'bulk_destroy'}
+
+
+def create_topics_obj():
+    topics = [{'id': 1, 'title': 'What is the weather like?'},
+              {'id': 2, 'title': 'The Most Popular Color in the World'}]
+    return [Topic.objects.create(**topic) for topic in topics]
+
+
+class MessageFromTopicBulkTest(TestCase):
+
+    def setUp(self) -> None:
+        self.topics_saved = create_topics_obj()
+        self.factory = APIRequestFactory()
+        self.message_view = MessageFromTopicViewSet.as_view(BULK_ACTIONS)
+        self.url = reverse('message-from-topic-bulk', args=(1,))
+
+    def send(self, method, data, topic_id=1):
+        request = getattr(self.factory, method)(self.url, data, format='json')
+        response = self.message_view(request, topic_id=topic_id)
+        response.render()
+        return response
+
+    def test_bulk_create(self):
+        items = [{'text': f'Typical message number {id}'} for id in range(3)]
+        # topic in data is overwritten by the topic from URL
+        items[0]['topic'] = 2
+
+        response = self.send('post', items)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        messages = Message.objects.filter(topic=1).order_by('id')
+        self.assertEqual(json.loads(response.content), MessageSerializer(messages, many=True).data)
+        self.assertEqual([msg.text for msg in messages], [item['text'] for item in items])
+        self.assertEqual([msg.change_seq for msg in messages], [1, 2, 3])
+        self.assertEqual(Topic.objects.get(id=1).change_seq, 3)
+
+    def test_bulk_create_query_count_does_not_depend_on_batch_size(self):
+        # topics lookup, savepoint, change sequence bump and read, INSERT, release
+        with self.assertNumQueries(6):
+            self.send('post', [{'text': f'Typical message number {id}'} for id in range(3)])
+        with self.assertNumQueries(6):
+            self.send('post', [{'text': f'Typical message number {id}'} for id in range(100)])
+
+    def test_bulk_create_with_invalid_item_writes_nothing(self):
+        items = [{'text': 'Typical message'}, {'text': 'H' * 9}]
+
+        response = self.send('post', items)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content),
+                         [{}, {'text': ['Ensure this value has at least 10 characters (it has 9).']}])
+        self.assertFalse(Message.objects.exists())
+
+    def test_bulk_create_requires_list(self):
+        response = self.send('post', {'text': 'Typical message'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content),
+                         {'non_field_errors': ['Expected a list of items but got type "dict".']})
+
+    def test_bulk_create_too_many_items(self):
+        with mock.patch.object(MessageFromTopicViewSet, 'bulk_max_items', 2):
+            response = self.send('post', [{'text': 'Typical message'}] * 3)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content),
+                         {'non_field_errors': ['Ensure this list has no more than 2 items.']})
+
+    def test_bulk_update(self):
+        for id in range(1, 4):
+            Message.objects.create(id=id, text=f'Typical message number {id}', topic=self.topics_saved[0])
+
+        response = self.send('patch', [{'id': 1, 'text': 'Updated message one'},
+                                       {'id': 3, 'text': 'Updated message three'}])
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content),
+                         MessageSerializer(Message.objects.filter(id__in=[1, 3]).order_by('id'), many=True).data)
+        self.assertEqual(Message.objects.get(id=1).text, 'Updated message one')
+        self.assertEqual(Message.objects.get(id=2).text, 'Typical message number 2')
+        self.assertEqual(Message.objects.get(id=3).change_seq, 5)
+
+    def test_bulk_update_message_from_other_topic(self):
+        Message.objects.create(id=1, text='Typical message one', topic=self.topics_saved[0])
+        Message.objects.create(id=2, text='Typical message two', topic=self.topics_saved[1])
+
+        response = self.send('patch', [{'id': 1, 'text': 'Updated message one'},
+                                       {'id': 2, 'text': 'Updated message two'}])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content), [{}, {'id': ['Not found.']}])
+        self.assertEqual(Message.objects.get(id=1).text, 'Typical message one')
+
+    def test_bulk_destroy(self):
+        for id in range(1, 4):
+            Message.objects.create(id=id, text=f'Typical message number {id}', topic=self.topics_saved[0])
+
+        response = self.send('delete', [1, 3])
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), [2])
+        self.assertEqual(sorted(MessageTombstone.objects.values_list('message_id', 'change_seq')), [(1, 4), (3, 5)])
+
+    def test_bulk_destroy_with_missing_id_deletes_nothing(self):
+        Message.objects.create(id=1, text='Typical message one', topic=self.topics_saved[0])
+
+        response = self.send('delete', [1, 22, 'abc'])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content), [{}, {'id': ['Not found.']}, {'id': ['Not found.']}])
+        self.assertTrue(Message.objects.filter(id=1).exists())
+
+
+class MessageBulkTest(TestCase):
+
+    def setUp(self) -> None:
+        self.topics_saved = create_topics_obj()
+        self.factory = APIRequestFactory()
+        self.message_view = MessageViewSet.as_view(BULK_ACTIONS)
+
+    def send(self, method, data):
+        request = getattr(self.factory, method)(reverse('messages-bulk'), data, format='json')
+        response = self.message_view(request)
+        response.render()
+        return response
+
+    def test_bulk_create_in_many_topics(self):
+        response = self.send('post', [{'text': 'Hot and sunny day', 'topic': 1},
+                                      {'text': 'The best color is Blue', 'topic': 2},
+                                      {'text': 'It will be a rainstorm', 'topic': 1}])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([msg['topic'] for msg in json.loads(response.content)], [1, 2, 1])
+        self.assertEqual(list(Topic.objects.order_by('id').values_list('change_seq', flat=True)), [2, 1])
+
+    def test_bulk_create_with_unknown_topic(self):
+        response = self.send('post', [{'text': 'Hot and sunny day', 'topic': 1},
+                                      {'text': 'The best color is Blue', 'topic': 22}])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content), [{}, {'topic': ['Invalid pk "22" - object does not exist.']}])
+
+    def test_bulk_update_cannot_change_topic(self):
+        Message.objects.create(id=1, text='Typical message one', topic=self.topics_saved[0])
+
+        response = self.send('patch', [{'id': 1, 'topic': 2}])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content), [{'topic': ['Cannot update message topic']}])
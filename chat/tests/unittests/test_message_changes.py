@@ -0,0 +1,135 @@
+import datetime
+import json
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+from django.utils import timezone
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from chat.models import Topic, Message, MessageTombstone
+from chat.tombstones import PRUNED_MESSAGE_ID
+from chat.serializers import MessageSerializer
+from chat.views import MessageFromTopicViewSet
+
+
+class MessageChangesTest(TestCase):
+
+    def setUp(self) -> None:
+        self.topic = Topic.objects.create(id=1, title='What is the weather like?')
+        self.other_topic = Topic.objects.create(id=2, title='The Most Popular Color in the World')
+        self.messages_saved = [Message.objects.create(id=id, text=f'Typical message number {id}', topic=self.topic)
+                               for id in range(1, 4)]
+        Message.objects.create(id=4, text='The best color is Blue', topic=self.other_topic)
+
+    def get_changes(self, topic_id, query=''):
+        factory = APIRequestFactory()
+        message_view = MessageFromTopicViewSet.as_view({'get': 'changes'})
+        request = factory.get(reverse('message-from-topic-changes', args=(topic_id,)) + query)
+        response = message_view(request, topic_id=topic_id)
+        response.render()
+        return response
+
+    def test_full_sync(self):
+        response = self.get_changes(self.topic.id)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), {
+            'messages': MessageSerializer(self.messages_saved, many=True).data,
+            'deleted': [],
+            'token': '3',
+            'has_more': False,
+        })
+
+    def test_no_changes_keeps_token(self):
+        response = self.get_changes(self.topic.id, '?since=3')
+
+        self.assertEqual(json.loads(response.content), {'messages': [], 'deleted': [], 'token': '3',
+                                                        'has_more': False})
+
+    def test_only_changes_after_token(self):
+        token = json.loads(self.get_changes(self.topic.id).content)['token']
+
+        updated = Message.objects.get(id=2)
+        updated.text = 'Updated typical message'
+        updated.save()
+        Message.objects.get(id=1).delete()
+        created = Message.objects.create(id=5, text='Brand new typical message', topic=self.topic)
+
+        response = self.get_changes(self.topic.id, f'?since={token}')
+
+        self.assertEqual(json.loads(response.content), {
+            'messages': MessageSerializer([Message.objects.get(id=2), created], many=True).data,
+            'deleted': [1],
+            'token': '6',
+            'has_more': False,
+        })
+
+    def test_changes_are_paged(self):
+        Message.objects.get(id=1).delete()
+
+        first = json.loads(self.get_changes(self.topic.id, '?limit=2').content)
+        second = json.loads(self.get_changes(self.topic.id, f'?limit=2&since={first["token"]}').content)
+
+        self.assertEqual([msg['id'] for msg in first['messages']], [2, 3])
+        self.assertTrue(first['has_more'])
+        self.assertEqual(second, {'messages': [], 'deleted': [1], 'token': '4', 'has_more': False})
+
+    def test_delete_leaves_tombstone(self):
+        Message.objects.get(id=3).delete()
+
+        tombstone = MessageTombstone.objects.get(message_id=3)
+        self.assertEqual(tombstone.topic_id, self.topic.id)
+        self.assertEqual(tombstone.change_seq, 4)
+
+    def test_invalid_token(self):
+        response = self.get_changes(self.topic.id, '?since=abc')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content), {'since': ['Invalid token']})
+
+    def test_nonexisting_topic(self):
+        response = self.get_changes(99)
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_query_count_does_not_depend_on_changes(self):
+        for id in range(5, 25):
+            Message.objects.create(id=id, text=f'Typical message number {id}', topic=self.topic).delete()
+
+        with self.assertNumQueries(3):
+            self.get_changes(self.topic.id)
+
+    def prune_tombstones(self, *args):
+        out = StringIO()
+        call_command('prune_tombstones', *args, stdout=out)
+        return out.getvalue()
+
+    def test_pruned_tombstones(self):
+        Message.objects.get(id=1).delete()
+        Message.objects.get(id=2).delete()
+        MessageTombstone.objects.update(deleted_at=timezone.now() - datetime.timedelta(days=31))
+        Message.objects.get(id=3).delete()
+
+        self.assertIn('Pruned 2 tombstones', self.prune_tombstones())
+
+        self.assertEqual(list(MessageTombstone.objects.order_by('change_seq').values_list('message_id', 'change_seq')),
+                         [(PRUNED_MESSAGE_ID, 5), (3, 6)])
+        # deletions after the token are lost
+        response = self.get_changes(self.topic.id, '?since=4')
+        self.assertEqual(response.status_code, status.HTTP_410_GONE)
+        self.assertEqual(json.loads(self.get_changes(self.topic.id, '?since=5').content)['deleted'], [3])
+        self.assertEqual(json.loads(self.get_changes(self.topic.id).content),
+                         {'messages': [], 'deleted': [3], 'token': '6', 'has_more': False})
+
+        # the marker is folded into the next one
+        self.assertIn('Pruned 0 tombstones', self.prune_tombstones())
+        self.assertIn('Pruned 1 tombstones', self.prune_tombstones('--days', '0'))
+        self.assertEqual(list(MessageTombstone.objects.values_list('message_id', 'change_seq')),
+                         [(PRUNED_MESSAGE_ID, 6)])
+
+    def test_tombstones_kept_without_retention(self):
+        with self.settings(CHAT_TOMBSTONE_RETENTION_DAYS=None), self.assertRaises(CommandError):
+            self.prune_tombstones()
@@ -0,0 +1,99 @@
+import json
+import tracemalloc
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.test import AsyncClient, TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from chat.models import Topic, Message
+from chat.views import MessageFromTopicViewSet
+
+
+class MessageExportTest(TestCase):
+
+    def setUp(self) -> None:
+        self.topics_saved = [Topic.objects.create(id=1, title='What is the weather like?'),
+                             Topic.objects.create(id=2, title='The Most Popular Color in the World')]
+        for id in range(1, 6):
+            Message.objects.create(id=id, text=f'Typical message number {id}', topic=self.topics_saved[id % 2])
+        self.factory = APIRequestFactory()
+
+    def export(self, topic_id, query='', chunk_size=None, **headers):
+        initkwargs = {'export_chunk_size': chunk_size} if chunk_size else {}
+        view = MessageFromTopicViewSet.as_view({'get': 'export'}, **initkwargs)
+        return view(self.factory.get(reverse('message-from-topic-export', args=(topic_id,)) + query, **headers),
+                    topic_id=topic_id)
+
+    def list(self, topic_id):
+        view = MessageFromTopicViewSet.as_view({'get': 'list'})
+        response = view(self.factory.get(reverse('message-from-topic-list', args=(topic_id,))), topic_id=topic_id)
+        response.render()
+        return response
+
+    def test_json_array_is_list_body(self):
+        for chunk_size in (1, 2, 100):
+            response = self.export(1, chunk_size=chunk_size)
+
+            self.assertTrue(response.streaming)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            self.assertEqual(b''.join(response.streaming_content), self.list(1).content)
+
+    def test_ndjson(self):
+        for response in (self.export(2, chunk_size=2, HTTP_ACCEPT='application/x-ndjson'),
+                         self.export(2, '?format=ndjson')):
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            lines = b''.join(response.streaming_content).decode().splitlines()
+            self.assertEqual([json.loads(line) for line in lines], json.loads(self.list(2).content))
+
+    def test_empty_topic(self):
+        Message.objects.filter(topic=1).delete()
+
+        self.assertEqual(b''.join(self.export(1).streaming_content), b'[]')
+        self.assertEqual(b''.join(self.export(1, '?format=ndjson').streaming_content), b'')
+
+    def test_missing_topic(self):
+        self.assertEqual(self.export(99).status_code, status.HTTP_404_NOT_FOUND)
+
+    def create_long_messages(self):
+        text = 'Long message ' * 80
+        Message.objects.bulk_create([Message(text=text, topic=self.topics_saved[0]) for _ in range(6000)])
+
+    def test_memory_does_not_grow_with_topic(self):
+        self.create_long_messages()
+
+        tracemalloc.start()
+        try:
+            response = self.export(1, chunk_size=100)
+            exported = 0
+            for part in response.streaming_content:
+                exported += len(part)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        # 6000 rows of about 1kB, only a few chunks of 100 rows are held at once (the peak is about 0.8MB for
+        # any number of rows)
+        self.assertGreater(exported, 6_000_000)
+        self.assertLess(peak, 1_500_000)
+
+    async def test_memory_does_not_grow_with_topic_under_asgi(self):
+        await sync_to_async(self.create_long_messages)()
+
+        tracemalloc.start()
+        try:
+            with mock.patch.object(MessageFromTopicViewSet, 'export_chunk_size', 100):
+                response = await AsyncClient().get(reverse('message-from-topic-export', args=(1,)))
+                exported = 0
+                # like ASGIHandler.send_response()
+                async for part in response:
+                    exported += len(part)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        self.assertTrue(response.is_async)
+        self.assertGreater(exported, 6_000_000)
+        self.assertLess(peak, 1_500_000)
@@ -0,0 +1,105 @@
+import json
+from unittest import mock
+
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from chat import search
+from chat.models import Topic, Message
+from chat.views import MessageFromTopicViewSet, MessageViewSet
+
+
+def get_next_link(response):
+    return response['Link'].split('<')[1].split('>')[0]
+
+
+class MessageSearchTest(TestCase):
+
+    def setUp(self) -> None:
+        self.topic = Topic.objects.create(id=1, title='What is the weather like?')
+        self.other_topic = Topic.objects.create(id=2, title='The Most Popular Color in the World')
+        texts = [(1, 'Hot and sunny day'), (2, 'Sunny, sunny, sunny weekend'), (3, 'It will be a rainstorm'),
+                 (4, 'The best color is sunny yellow'), (5, 'The best color is Blue')]
+        for id, text in texts:
+            Message.objects.create(id=id, text=text, topic=self.topic if id < 4 else self.other_topic)
+        self.factory = APIRequestFactory()
+
+    def search(self, query, topic_id=None):
+        if topic_id is None:
+            view, url, kwargs = MessageViewSet.as_view({'get': 'search'}), reverse('messages-search'), {}
+        else:
+            view = MessageFromTopicViewSet.as_view({'get': 'search'})
+            url, kwargs = reverse('message-from-topic-search', args=(topic_id,)), {'topic_id': topic_id}
+        response = view(self.factory.get(url + query), **kwargs)
+        response.render()
+        return response
+
+    def ids(self, response):
+        return [msg['id'] for msg in json.loads(response.content)]
+
+    def test_results_are_ranked(self):
+        response = self.search('?q=sunny')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # the message repeating the word is the most relevant
+        self.assertEqual(self.ids(response)[0], 2)
+        self.assertCountEqual(self.ids(response), [1, 2, 4])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.ids(self.search('?q=best%20COLOR%20blue')), [5])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.ids(self.search('?q=sunny%20OR%20"rainstorm')), [])
+        self.assertEqual(self.ids(self.search('?q=rainstorm*')), [3])
+
+    def test_topic_search(self):
+        self.assertCountEqual(self.ids(self.search('?q=sunny', topic_id=1)), [1, 2])
+
+    def test_topic_search_of_nonexisting_topic(self):
+        self.assertEqual(self.search('?q=sunny', topic_id=99).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_results_are_paged(self):
+        first = self.search('?q=sunny&page_size=2')
+        second = self.search('?' + get_next_link(first).split('?')[1])
+
+        self.assertEqual(len(self.ids(first)), 2)
+        self.assertCountEqual(self.ids(first) + self.ids(second), [1, 2, 4])
+        self.assertFalse(second.has_header('Link'))
+
+    def test_index_follows_writes(self):
+        message = Message.objects.get(id=3)
+        message.text = 'It will be a sunny afternoon'
+        message.save()
+        Message.objects.get(id=1).delete()
+        Message.objects.bulk_create_messages([Message(text='Sunny days are here', topic=self.topic)])
+
+        self.assertEqual(self.ids(self.search('?q=rainstorm')), [])
+        self.assertEqual(len(self.ids(self.search('?q=sunny'))), 4)
+        self.assertNotIn(1, self.ids(self.search('?q=sunny')))
+
+    def test_missing_query(self):
+        response = self.search('?q=%20-')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(json.loads(response.content), {'q': ['Enter at least one word to search for.']})
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.search('?q=sunny&after=abc').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_only_the_newest_matches_are_ranked(self):
+        with mock.patch.object(search, '_search', search.SQLiteFullTextSearch(max_ranked=2)):
+            self.assertEqual(self.ids(self.search('?q=sunny')), [2, 4])
+            self.assertEqual(self.ids(self.search('?q=sunny', topic_id=1)), [2, 1])
+            first = self.search('?q=sunny&page_size=1')
+            self.assertEqual(self.ids(first) + self.ids(self.search('?' + get_next_link(first).split('?')[1])), [2, 4])
+        with mock.patch.object(search, '_search', search.SQLiteFullTextSearch(max_ranked=1)):
+            self.assertEqual(self.ids(self.search('?q=sunny', topic_id=1)), [2])
+
+    def test_contains_backend(self):
+        with mock.patch.object(search, '_search', search.ContainsSearch()):
+            first = self.search('?q=SUNNY&page_size=2')
+            second = self.search('?' + get_next_link(first).split('?')[1])
+
+        self.assertEqual(self.ids(first) + self.ids(second), [1, 2, 4])
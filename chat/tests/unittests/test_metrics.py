@@ -0,0 +1,122 @@
+import re
+
+from django.core.cache import caches
+from django.db import connection
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from chat.metrics import registry
+from chat.models import Topic, Message
+
+METRICS = {'SERVER_TIMING': True, 'ALLOWED_IPS': ['127.0.0.1']}
+
+
+def server_timing(response):
+    """{metric: (duration in ms, description)} of the Server-Timing header"""
+    timings = {}
+    for metric in response['Server-Timing'].split(', '):
+        name, *params = metric.split(';')
+        params = dict(param.split('=', 1) for param in params)
+        timings[name] = (float(params['dur']), params.get('desc', '').strip('"'))
+    return timings
+
+
+def scraped_value(text, name, view, status_code=None):
+    labels = f'view="{view}"' + (f',status="{status_code}"' if status_code else '')
+    match = re.search(rf'^{name}{{{re.escape(labels)}}} (\S+)$', text, re.MULTILINE)
+    return float(match.group(1)) if match else None
+
+
+@override_settings(CHAT_METRICS=METRICS)
+class MetricsTest(TestCase):
+
+    def setUp(self) -> None:
+        caches['chat'].clear()
+        registry.reset()
+        self.topics_saved = [Topic.objects.create(id=1, title='What is the weather like?'),
+                             Topic.objects.create(id=2, title='The Most Popular Color in the World')]
+        for id in range(1, 5):
+            Message.objects.create(id=id, text=f'Typical message number {id}', topic=self.topics_saved[id % 2])
+        # the middleware is loaded by the first request of a client, with the settings of the test
+        self.client = Client()
+
+    def scrape(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        return response.content.decode()
+
+    def test_server_timing_counts_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/topics/1/messages/')
+
+        timings = server_timing(response)
+        self.assertEqual(timings['db'][1], f'{len(queries)} queries')
+        self.assertGreater(timings['serializer'][0], 0)
+        self.assertGreaterEqual(timings['total'][0], timings['db'][0] + timings['serializer'][0])
+
+    def test_requests_are_filed_under_viewset_actions(self):
+        self.client.get('/topics/')
+        self.client.get('/topics/')
+        self.client.get('/topics/99/')
+        self.client.patch('/topics/2/messages/1/', 'text=Edited+message', content_type='application/x-www-form-urlencoded')
+        response = self.client.post('/messages/', {'text': 'Fresh message', 'topic': 2}, content_type='application/json')
+
+        text = self.scrape()
+        self.assertEqual(scraped_value(text, 'chat_requests_total', 'TopicViewSet.list', 200), 2)
+        self.assertEqual(scraped_value(text, 'chat_requests_total', 'TopicViewSet.retrieve', 404), 1)
+        self.assertEqual(scraped_value(text, 'chat_requests_total', 'MessageFromTopicViewSet.partial_update', 200), 1)
+        self.assertEqual(scraped_value(text, 'chat_requests_total', 'MessageViewSet.create', 201), 1)
+        self.assertEqual(scraped_value(text, 'chat_request_duration_seconds_count', 'TopicViewSet.list'), 2)
+        self.assertEqual(scraped_value(text, 'chat_response_size_bytes_total', 'MessageViewSet.create'),
+                         len(response.content))
+        self.assertGreater(scraped_value(text, 'chat_db_queries_total', 'MessageViewSet.create'), 0)
+        self.assertIsNone(scraped_value(text, 'chat_requests_total', 'metrics', 200))
+
+    def test_streamed_response_size(self):
+        response = self.client.get('/topics/1/messages/export/')
+        size = len(b''.join(response.streaming_content))
+
+        text = self.scrape()
+        self.assertEqual(scraped_value(text, 'chat_response_size_bytes_total', 'MessageFromTopicViewSet.export'), size)
+
+    def test_function_views_and_unmatched_urls(self):
+        self.client.get('/stats/cache/')
+        self.client.get('/nowhere/')
+
+        text = self.scrape()
+        self.assertEqual(scraped_value(text, 'chat_requests_total', 'response_cache_stats', 200), 1)
+        self.assertEqual(scraped_value(text, 'chat_requests_total', 'unmatched', 404), 1)
+
+    def test_metrics_only_for_allowed_addresses(self):
+        response = self.client.get('/metrics', REMOTE_ADDR='10.1.2.3')
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    @override_settings(CHAT_METRICS=None)
+    def test_disabled(self):
+        client = Client()
+
+        self.assertNotIn('Server-Timing', client.get('/topics/'))
+        self.assertEqual(client.get('/metrics').status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CHAT_METRICS=METRICS, ROOT_URLCONF='chatting.urls_async')
+class AsyncMetricsTest(TransactionTestCase):
+
+    def setUp(self) -> None:
+        caches['chat'].clear()
+        registry.reset()
+        topic = Topic.objects.create(id=1, title='What is the weather like?')
+        Message.objects.create(id=1, text='Typical message', topic=topic)
+
+    async def test_async_views_are_measured(self):
+        response = await AsyncClient().get('/topics/1/messages/')
+
+        timings = server_timing(response)
+        # the version query and the page, run by the ORM in other threads
+        self.assertEqual(timings['db'][1], '2 queries')
+        self.assertGreater(timings['serializer'][0], 0)
+        self.assertEqual(scraped_value(registry.render(), 'chat_requests_total', 'MessageFromTopicViewSet.list', 200),
+                         1)
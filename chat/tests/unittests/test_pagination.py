@@ -0,0 +1,108 @@
+import datetime
+import json
+import re
+from unittest import mock
+
+import pytz
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from chat.models import Topic, Message
+from chat.serializers import MessageSerializer
+from chat.views import MessageFromTopicViewSet, MessageViewSet
+
+
+def create_topic_with_messages(messages_number):
+    mocked_date = datetime.datetime(2020, 1, 1, 0, 0, 0, tzinfo=pytz.utc)
+
+    topic = Topic.objects.create(id=1, title='What is the weather like?')
+    messages_saved = []
+    # half of the messages share created_at, so the id has to break ties
+    for id in range(1, messages_number + 1):
+        created_at = mocked_date + datetime.timedelta(minutes=id // 2)
+        with mock.patch('django.utils.timezone.now', mock.Mock(return_value=created_at)):
+            messages_saved.append(Message.objects.create(id=id, text=f'Typical message number {id}', topic=topic))
+
+    return topic, messages_saved
+
+
+def get_links(response):
+    return dict((rel, url) for url, rel in re.findall(r'<([^>]+)>; rel="(\w+)"', response.get('Link', '')))
+
+
+class KeysetCursorPaginationTest(TestCase):
+
+    def setUp(self) -> None:
+        self.topic, self.messages_saved = create_topic_with_messages(7)
+        self.factory = APIRequestFactory()
+        self.message_view = MessageFromTopicViewSet.as_view({'get': 'list'})
+
+    def get_page(self, url):
+        request = self.factory.get(url)
+        response = self.message_view(request, topic_id=self.topic.id)
+        response.render()
+        return response
+
+    def test_first_page(self):
+        url = reverse('message-from-topic-list', args=(self.topic.id,))
+        response = self.get_page(f'{url}?page_size=3')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content), MessageSerializer(self.messages_saved[:3], many=True).data)
+        self.assertIn('next', get_links(response))
+        self.assertNotIn('prev', get_links(response))
+
+    def test_forward_traversal_returns_every_message_once(self):
+        url = reverse('message-from-topic-list', args=(self.topic.id,)) + '?page_size=3'
+        pages = []
+        while url is not None:
+            response = self.get_page(url)
+            pages.append(json.loads(response.content))
+            url = get_links(response).get('next')
+
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual([msg for page in pages for msg in page],
+                         MessageSerializer(self.messages_saved, many=True).data)
+
+    def test_backward_traversal(self):
+        url = reverse('message-from-topic-list', args=(self.topic.id,)) + '?page_size=3'
+        last_page = None
+        while url is not None:
+            last_page = self.get_page(url)
+            url = get_links(last_page).get('next')
+
+        previous = self.get_page(get_links(last_page)['prev'])
+        self.assertEqual(json.loads(previous.content), MessageSerializer(self.messages_saved[3:6], many=True).data)
+
+        first = self.get_page(get_links(previous)['prev'])
+        self.assertEqual(json.loads(first.content), MessageSerializer(self.messages_saved[:3], many=True).data)
+        self.assertNotIn('prev', get_links(first))
+        self.assertIn('next', get_links(first))
+
+    def test_invalid_cursor(self):
+        url = reverse('message-from-topic-list', args=(self.topic.id,))
+        response = self.get_page(f'{url}?after=not-a-cursor')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(json.loads(response.content), {'detail': 'Invalid cursor'})
+
+    def test_deep_page_costs_single_query(self):
+        url = reverse('message-from-topic-list', args=(self.topic.id,)) + '?page_size=2'
+        response = self.get_page(url)
+        deep_url = get_links(self.get_page(get_links(response)['next']))['next']
+
+        # the page itself and the topic version for the ETag
+        with self.assertNumQueries(2):
+            self.get_page(deep_url)
+
+    def test_all_messages_view_is_paginated(self):
+        factory = APIRequestFactory()
+        message_view = MessageViewSet.as_view({'get': 'list'})
+        request = factory.get(reverse('messages-list') + '?page_size=5')
+        response = message_view(request)
+        response.render()
+
+        self.assertEqual(json.loads(response.content), MessageSerializer(self.messages_saved[:5], many=True).data)
+        self.assertIn('next', get_links(response))
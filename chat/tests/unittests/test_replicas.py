@@ -0,0 +1,154 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection, connections
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from rest_framework import status
+
+from chat.models import Message, Topic
+from chat.routers import STICKY_COOKIE, ReplicaMiddleware, _read_database
+from chatting.database import replicas_from_env
+
+REPLICAS = ('replica1', 'replica2')
+
+
+def replicas_config(selection='round_robin', sticky_seconds=5):
+    return {'DATABASES': list(REPLICAS), 'SELECTION': selection, 'STICKY_SECONDS': sticky_seconds}
+
+
+@override_settings(CHAT_REPLICAS=replicas_config(), CHAT_RESPONSE_CACHE=None)
+class ReplicaRoutingTest(TestCase):
+    """Two replicas in SQLite files of their own, every database has a topic 1 of a different title"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        for alias in REPLICAS:
+            connections.settings[alias] = dict(connection.settings_dict, NAME=os.path.join(cls.directory.name, alias),
+                                               TEST={})
+            call_command('migrate', database=alias, verbosity=0)
+            topic = Topic.objects.using(alias).create(id=1, title=f'Topic of {alias}')
+            Message.objects.using(alias).create(id=1, text=f'Message in {alias}', topic=topic)
+
+    @classmethod
+    def tearDownClass(cls):
+        # the replicas have to be gone before TestCase checks the databases the test was allowed to use
+        for alias in REPLICAS:
+            connections[alias].close()
+            del connections.settings[alias]
+            if hasattr(connections._connections, alias):
+                delattr(connections._connections, alias)
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        topic = Topic.objects.create(id=1, title='Topic of default')
+        Message.objects.create(id=1, text='Message in default', topic=topic)
+
+    def get_title(self):
+        response = self.client.get('/topics/1/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.json()['title']
+
+    def test_reads_go_round_robin_to_replicas(self):
+        titles = [self.get_title() for _ in range(4)]
+
+        self.assertEqual(titles, ['Topic of replica1', 'Topic of replica2'] * 2)
+        self.assertEqual(self.client.get('/messages/1/').json()['text'], 'Message in replica1')
+        self.assertEqual(self.client.get('/messages/', {'search': 'message'}).json()[0]['text'],
+                         'Message in replica2')
+
+    def test_writes_go_to_default(self):
+        response = self.client.patch('/topics/1/', {'title': 'Renamed topic'}, content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(Topic.objects.get(id=1).title, 'Renamed topic')
+        self.assertEqual(Topic.objects.using('replica1').get(id=1).title, 'Topic of replica1')
+
+    def test_client_reads_its_writes(self):
+        response = self.client.post('/topics/1/messages/', {'text': 'A message written just now'},
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.cookies[STICKY_COOKIE]['max-age'], 5)
+        self.assertEqual(self.get_title(), 'Topic of default')
+        self.assertEqual(self.client.get(f'/messages/{response.json()["id"]}/').status_code, status.HTTP_200_OK)
+        # other clients and the same client once the window is over read from the replicas
+        self.client.cookies.clear()
+        self.assertEqual(self.get_title(), 'Topic of replica1')
+
+    @override_settings(CHAT_REPLICAS=replicas_config(sticky_seconds=0))
+    def test_without_sticky_window(self):
+        response = self.client.delete('/messages/1/')
+
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+        self.assertEqual(self.client.get('/messages/1/').status_code, status.HTTP_200_OK)
+
+    @override_settings(CHAT_RESPONSE_CACHE='chat')
+    def test_response_cache_is_filled_from_default_only(self):
+        caches['chat'].clear()
+        self.addCleanup(caches['chat'].clear)
+        # requests of TestCase run in its transaction, which keeps them away from the cache
+        with mock.patch.object(connection, 'in_atomic_block', False):
+            self.assertEqual([self.get_title() for _ in range(2)], ['Topic of replica1', 'Topic of replica2'])
+            self.client.cookies[STICKY_COOKIE] = '1'
+            self.assertEqual(self.get_title(), 'Topic of default')
+            # what the default database returned is served to everyone until the next write
+            self.client.cookies.clear()
+            self.assertEqual(self.get_title(), 'Topic of default')
+
+    @override_settings(CHAT_REPLICAS=None)
+    def test_reads_go_to_default_without_replicas(self):
+        self.assertEqual(self.get_title(), 'Topic of default')
+
+    @staticmethod
+    def middleware(selection):
+        with override_settings(CHAT_REPLICAS=replicas_config(selection)):
+            return ReplicaMiddleware(lambda request: HttpResponse(_read_database.get()))
+
+    def test_least_loaded(self):
+        middleware = self.middleware('least_loaded')
+        request = RequestFactory().get('/topics/')
+
+        self.assertEqual([middleware.start(request) for _ in range(4)], ['replica1', 'replica2'] * 2)
+        middleware.finish('replica2')
+        self.assertEqual(middleware.start(request), 'replica2')
+        middleware.in_flight['replica1'] = 0
+        self.assertEqual(middleware.start(request), 'replica1')
+
+    def test_unsafe_and_sticky_requests_read_from_default(self):
+        middleware = self.middleware('round_robin')
+        factory = RequestFactory()
+        sticky = factory.get('/topics/')
+        sticky.COOKIES[STICKY_COOKIE] = '1'
+
+        self.assertEqual(middleware(factory.post('/topics/')).content, b'default')
+        self.assertEqual(middleware(sticky).content, b'default')
+        self.assertEqual(middleware(factory.get('/topics/')).content, b'replica1')
+        self.assertEqual(middleware.in_flight, {'replica1': 0, 'replica2': 0})
+
+
+class ReplicasFromEnvTest(SimpleTestCase):
+
+    def test_replicas(self):
+        default = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': Path('/srv/chat/db.sqlite3')}
+
+        self.assertEqual(replicas_from_env({}, Path('/srv/chat'), default), ({}, None))
+        databases, config = replicas_from_env({'CHAT_DB_REPLICAS': 'a.sqlite3, b.sqlite3',
+                                               'CHAT_DB_REPLICA_SELECTION': 'least_loaded'}, Path('/srv/chat'), default)
+        self.assertEqual(databases['replica2'], {'ENGINE': 'django.db.backends.sqlite3', 'TEST': {'MIRROR': 'default'},
+                                                 'NAME': Path('/srv/chat/b.sqlite3')})
+        self.assertEqual(config, {'DATABASES': ['replica1', 'replica2'], 'SELECTION': 'least_loaded',
+                                  'STICKY_SECONDS': 5})
+
+        default = {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'chat', 'HOST': 'primary', 'PORT': '5432'}
+        databases, _ = replicas_from_env({'CHAT_DB_REPLICAS': 'standby1,standby2:5433'}, Path('/srv/chat'), default)
+        self.assertEqual([(database['HOST'], database['PORT']) for database in databases.values()],
+                         [('standby1', '5432'), ('standby2', '5433')])
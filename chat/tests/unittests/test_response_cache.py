@@ -0,0 +1,161 @@
+import json
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIRequestFactory
+
+from chat.cache import LRULocMemCache, get_response_cache
+from chat.models import Topic, Message
+from chat.views import MessageFromTopicViewSet, MessageViewSet, TopicViewSet, response_cache_stats
+
+
+@override_settings(CHAT_RESPONSE_CACHE='chat')
+class ResponseCacheTest(TransactionTestCase):
+    """Runs in autocommit like production requests, responses read inside a transaction are never cached"""
+
+    def setUp(self) -> None:
+        caches['chat'].clear()
+        self.response_cache = get_response_cache()
+        self.response_cache.hits = self.response_cache.misses = 0
+
+        self.topics_saved = [Topic.objects.create(id=1, title='What is the weather like?'),
+                             Topic.objects.create(id=2, title='The Most Popular Color in the World')]
+        for id in range(1, 5):
+            Message.objects.create(id=id, text=f'Typical message number {id}', topic=self.topics_saved[id % 2])
+        self.factory = APIRequestFactory()
+
+    def get(self, view, url, **kwargs):
+        response = view(self.factory.get(url), **kwargs)
+        response.render()
+        return response
+
+    def get_topics(self):
+        return self.get(TopicViewSet.as_view({'get': 'list'}), reverse('topics-list'))
+
+    def get_messages(self, topic_id, query=''):
+        return self.get(MessageFromTopicViewSet.as_view({'get': 'list'}),
+                        reverse('message-from-topic-list', args=(topic_id,)) + query, topic_id=topic_id)
+
+    def test_second_read_is_served_from_cache(self):
+        first = self.get_topics()
+
+        with self.assertNumQueries(0):
+            second = self.get_topics()
+
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(self.response_cache.stats()['hits'], 1)
+        self.assertEqual(self.response_cache.stats()['misses'], 1)
+
+    def test_cached_response_answers_if_none_match(self):
+        etag = self.get_topics()['ETag']
+
+        request = self.factory.get(reverse('topics-list'), HTTP_IF_NONE_MATCH=etag)
+        with self.assertNumQueries(0):
+            response = TopicViewSet.as_view({'get': 'list'})(request)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.get_topics()['ETag'], etag)
+
+    def test_list_versions_need_no_query(self):
+        messages_view = MessageViewSet.as_view({'get': 'list'})
+        etag = self.get(messages_view, reverse('messages-list'))['ETag']
+
+        # messages of all topics are not cached, their version is the generation every write changes
+        request = self.factory.get(reverse('messages-list'), HTTP_IF_NONE_MATCH=etag)
+        with self.assertNumQueries(0):
+            self.assertEqual(messages_view(request).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        message = Message.objects.get(id=1)
+        message.text = 'Updated typical message'
+        message.save()
+        self.assertNotEqual(self.get(messages_view, reverse('messages-list'))['ETag'], etag)
+
+    def test_every_page_is_cached_separately(self):
+        first_page = self.get_messages(1, '?page_size=1')
+        cursor = first_page['Link'].split('after=')[1].split('>')[0]
+        second_page = self.get_messages(1, f'?page_size=1&after={cursor}')
+
+        with self.assertNumQueries(0):
+            cached_second_page = self.get_messages(1, f'?page_size=1&after={cursor}')
+
+        self.assertNotEqual(json.loads(first_page.content), json.loads(second_page.content))
+        self.assertEqual(cached_second_page.content, second_page.content)
+        self.assertEqual(cached_second_page['Link'], second_page['Link'])
+
+    def test_creating_topic_invalidates_topic_list(self):
+        self.get_topics()
+
+        request = self.factory.post(reverse('topics-list'), {'title': 'The best programming language'})
+        TopicViewSet.as_view({'post': 'create'})(request)
+
+        self.assertEqual(len(json.loads(self.get_topics().content)), 3)
+
+    def test_message_write_invalidates_only_its_topic(self):
+        self.get_messages(1)
+        self.get_messages(2)
+
+        request = self.factory.post(reverse('message-from-topic-list', args=(1,)), {'text': 'Hot and sunny day'})
+        MessageFromTopicViewSet.as_view({'post': 'create'})(request, topic_id=1)
+
+        self.assertEqual(len(json.loads(self.get_messages(1).content)), 3)
+        with self.assertNumQueries(0):
+            self.get_messages(2)
+
+    def test_message_create_invalidates_topic_list(self):
+        self.get_topics()
+
+        Message.objects.create(text='Hot and sunny day', topic=self.topics_saved[0])
+
+        self.assertEqual([topic['message_count'] for topic in json.loads(self.get_topics().content)], [3, 2])
+
+    def test_message_write_through_messages_view_invalidates_topic(self):
+        self.get_messages(1)
+
+        request = self.factory.delete(reverse('messages-detail', args=(2,)))
+        MessageViewSet.as_view({'delete': 'destroy'})(request, pk=2)
+
+        self.assertEqual([msg['id'] for msg in json.loads(self.get_messages(1).content)], [4])
+
+    def test_topic_delete_invalidates_topic_and_its_messages(self):
+        self.get(TopicViewSet.as_view({'get': 'retrieve'}), reverse('topics-detail', args=(1,)), pk=1)
+        self.get_messages(1)
+
+        request = self.factory.delete(reverse('topics-detail', args=(1,)))
+        TopicViewSet.as_view({'delete': 'destroy'})(request, pk=1)
+
+        response = self.get(TopicViewSet.as_view({'get': 'retrieve'}), reverse('topics-detail', args=(1,)), pk=1)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(json.loads(self.get_messages(1).content), [])
+
+    def test_stats_view(self):
+        self.get_topics()
+        self.get_topics()
+
+        response = response_cache_stats(self.factory.get(reverse('response-cache-stats')))
+        response.render()
+
+        self.assertEqual(json.loads(response.content), {'hits': 1, 'misses': 1, 'evictions': 0})
+
+    def test_stats_only_for_allowed_addresses(self):
+        response = response_cache_stats(self.factory.get(reverse('response-cache-stats'), REMOTE_ADDR='10.1.2.3'))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class LRULocMemCacheTest(SimpleTestCase):
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = LRULocMemCache('lru-test', {'OPTIONS': {'MAX_ENTRIES': 2}})
+        cache.clear()
+
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.evictions, 1)
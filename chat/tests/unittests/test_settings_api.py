@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+# settings are global to a process, the API-only ones are tried in a process of their own
+SCRIPT = '''
+import json
+import django
+django.setup()
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment
+setup_test_environment()
+connection.creation.create_test_db(verbosity=0)
+from chat.models import Topic
+Topic.objects.create(id=1, title='What is the weather like?')
+client = Client()
+responses = {
+    'post': client.post('/topics/1/messages/', {'text': 'Hot and sunny day'}, content_type='application/json'),
+    'list': client.get('/topics/1/messages/'),
+    'html': client.get('/topics/1/messages/', HTTP_ACCEPT='text/html'),
+    'admin': client.get('/admin/'),
+}
+print(json.dumps({name: [response.status_code, dict(response.items()), response.content.decode()]
+                  for name, response in responses.items()}))
+'''
+
+
+class ApiSettingsTest(SimpleTestCase):
+
+    def test_json_api_without_browser_middleware(self):
+        result = subprocess.run([sys.executable, '-c', SCRIPT], cwd=settings.BASE_DIR, capture_output=True, text=True,
+                                env=dict(os.environ, DJANGO_SETTINGS_MODULE='chatting.settings_api'))
+        self.assertEqual(result.returncode, 0, result.stderr)
+        responses = json.loads(result.stdout.splitlines()[-1])
+
+        status_code, headers, content = responses['list']
+        self.assertEqual(status_code, 200)
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertEqual([message['text'] for message in json.loads(content)], ['Hot and sunny day'])
+        self.assertEqual(responses['post'][0], 201)
+        for header in ('Set-Cookie', 'X-Frame-Options', 'Vary'):
+            self.assertNotIn(header, headers)
+        # no browsable API and no admin
+        self.assertEqual(responses['html'][0], 406)
+        self.assertEqual(responses['admin'][0], 404)
@@ -0,0 +1,276 @@
+import os
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework import status
+
+from chat import sharding
+from chat.cache import TOPICS_SCOPE, get_response_cache, topic_scope
+from chat.models import ArchiveBlock, IdSequence, Message, MessageTombstone, Topic, TopicShard
+from chat.tests.unittests.test_pagination import get_links
+from chatting.database import shards_from_env
+
+SHARDS = ('shard1', 'shard2', 'shard3')
+
+
+def shards_config(*shards):
+    return {'DATABASES': list(shards or SHARDS), 'VIRTUAL_NODES': 64}
+
+
+@override_settings(CHAT_SHARDS=shards_config(), CHAT_RESPONSE_CACHE=None)
+class ShardingTest(TestCase):
+    """Three shards in SQLite files of their own, the default database holds the directory"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        for alias in SHARDS:
+            connections.settings[alias] = dict(connection.settings_dict, NAME=os.path.join(cls.directory.name, alias),
+                                               TEST={})
+            call_command('migrate', database=alias, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        # the shards have to be gone before TestCase checks the databases the test was allowed to use
+        for alias in SHARDS:
+            connections[alias].close()
+            del connections.settings[alias]
+            if hasattr(connections._connections, alias):
+                delattr(connections._connections, alias)
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        # the shards are not rolled back by TestCase, nor are the id blocks of the rolled back sequences
+        for alias in SHARDS:
+            for model in (MessageTombstone, Message, Topic):
+                model.objects.using(alias).all().delete()
+        IdSequence._blocks.clear()
+
+    def post(self, path, data):
+        response = self.client.post(path, data, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.content)
+        return response.json()
+
+    def create_topics(self, count, messages=2):
+        topics = [self.post('/topics/', {'title': f'Topic {number}'}) for number in range(count)]
+        for topic in topics:
+            for number in range(messages):
+                self.post(f'/topics/{topic["id"]}/messages/', {'text': f'Message {number} of {topic["title"]}'})
+        return topics
+
+    def shard_of(self, topic_id):
+        return TopicShard.objects.get(topic_id=topic_id).shard
+
+    def test_topics_live_in_their_ring_shard_with_their_messages(self):
+        topics = self.create_topics(12)
+
+        shards = {self.shard_of(topic['id']) for topic in topics}
+        self.assertEqual(shards, set(SHARDS))
+        for topic in topics:
+            shard = self.shard_of(topic['id'])
+            self.assertEqual(shard, sharding.ring_shard(topic['id']))
+            self.assertEqual(Topic.objects.using(shard).get(id=topic['id']).message_count, 2)
+            self.assertEqual(Message.objects.using(shard).filter(topic=topic['id']).count(), 2)
+        self.assertFalse(Topic.objects.exists())
+
+    def test_topic_routes(self):
+        topic, = self.create_topics(1)
+        path = f'/topics/{topic["id"]}/'
+
+        self.assertEqual(self.client.get(path).json()['message_count'], 2)
+        messages = self.client.get(f'{path}messages/').json()
+        self.assertEqual([message['text'] for message in messages], ['Message 0 of Topic 0', 'Message 1 of Topic 0'])
+        self.assertEqual(self.client.get(f'/messages/{messages[0]["id"]}/').json()['text'], 'Message 0 of Topic 0')
+
+        response = self.client.patch(f'/messages/{messages[0]["id"]}/', {'text': 'An edited message'},
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.delete(f'/messages/{messages[1]["id"]}/').status_code,
+                         status.HTTP_204_NO_CONTENT)
+        changes = self.client.get(f'{path}messages/changes/', {'since': 0}).json()
+        self.assertEqual(len(changes['deleted']), 1)
+
+        self.assertEqual(self.client.delete(path).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(TopicShard.objects.filter(topic_id=topic['id']).exists())
+        self.assertEqual(self.client.get(path).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_lists_merge_the_shards(self):
+        topics = self.create_topics(6, messages=1)
+
+        first = self.client.get('/topics/', {'page_size': 4})
+        self.assertEqual([topic['id'] for topic in first.json()], [topic['id'] for topic in topics[:4]])
+        second = self.client.get(get_links(first)['next'])
+        self.assertEqual([topic['id'] for topic in second.json()], [topic['id'] for topic in topics[4:]])
+        self.assertNotIn('next', get_links(second))
+        previous = self.client.get(get_links(second)['prev'])
+        self.assertEqual([topic['id'] for topic in previous.json()], [topic['id'] for topic in topics[:4]])
+
+        messages = self.client.get('/messages/').json()
+        self.assertEqual([message['topic'] for message in messages], [topic['id'] for topic in topics])
+
+    def test_latest_messages_of_topics_across_shards(self):
+        topics = self.create_topics(6, messages=3)
+
+        listed = self.client.get('/topics/', {'include': 'latest_messages', 'n': 2}).json()
+        self.assertEqual([[message['text'] for message in topic['latest_messages']] for topic in listed],
+                         [[f'Message 1 of {topic["title"]}', f'Message 2 of {topic["title"]}'] for topic in topics])
+        topic = self.client.get(f'/topics/{topics[0]["id"]}/', {'include': 'latest_messages', 'n': 1}).json()
+        self.assertEqual([message['text'] for message in topic['latest_messages']], ['Message 2 of Topic 0'])
+
+    def test_search_across_shards(self):
+        self.create_topics(6, messages=1)
+
+        found = self.client.get('/messages/', {'search': 'message'}).json()
+        self.assertEqual(len(found), 6)
+        topic = found[0]['topic']
+        found = self.client.get(f'/topics/{topic}/messages/', {'search': 'message'}).json()
+        self.assertEqual([message['topic'] for message in found], [topic])
+
+    def test_create_with_invalid_body(self):
+        for data in ([{'text': 'A message in a list', 'topic': 1}], 'A message as a string'):
+            response = self.client.post('/messages/', data, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+
+    def test_batches_stay_in_one_shard(self):
+        topics = self.create_topics(12, messages=0)
+        by_shard = {}
+        for topic in topics:
+            by_shard.setdefault(self.shard_of(topic['id']), []).append(topic['id'])
+        (first, *_), (second, *_) = list(by_shard.values())[:2]
+
+        response = self.client.post('/messages/bulk/', [{'text': 'First message', 'topic': first},
+                                                        {'text': 'Second message', 'topic': second}],
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(),
+                         {'non_field_errors': ['Items of a batch must belong to topics of one shard.']})
+        response = self.client.post('/messages/bulk/', [{'text': 'First message', 'topic': first},
+                                                        {'text': 'Second message', 'topic': first}],
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.content)
+        self.assertEqual(Message.objects.using(self.shard_of(first)).filter(topic=first).count(), 2)
+
+    def test_move_topic(self):
+        topic, = self.create_topics(1, messages=3)
+        source = self.shard_of(topic['id'])
+        target = next(alias for alias in SHARDS if alias != source)
+        deleted = self.client.get(f'/topics/{topic["id"]}/messages/').json()[0]['id']
+        self.client.delete(f'/messages/{deleted}/')
+
+        self.assertEqual(sharding.move_topic(topic['id'], target, chunk_size=1), 2)
+
+        self.assertEqual(self.shard_of(topic['id']), target)
+        self.assertFalse(Topic.objects.using(source).filter(id=topic['id']).exists())
+        self.assertFalse(Message.objects.using(source).exists())
+        self.assertEqual(MessageTombstone.objects.using(target).get().message_id, deleted)
+        self.assertEqual(self.client.get(f'/topics/{topic["id"]}/').json()['message_count'], 2)
+        self.post(f'/topics/{topic["id"]}/messages/', {'text': 'Written after the move'})
+        self.assertEqual(Message.objects.using(target).count(), 3)
+
+    def test_move_topic_drops_its_cached_responses(self):
+        topic, = self.create_topics(1)
+        target = next(alias for alias in SHARDS if alias != self.shard_of(topic['id']))
+        with override_settings(CHAT_RESPONSE_CACHE='chat'):
+            scopes = (topic_scope(topic['id']), TOPICS_SCOPE)
+            generations = [get_response_cache().get_generation(scope) for scope in scopes]
+
+            sharding.move_topic(topic['id'], target)
+
+            self.assertEqual([get_response_cache().get_generation(scope) for scope in scopes],
+                             [generation + 1 for generation in generations])
+
+    def test_move_archived_topic(self):
+        topic, = self.create_topics(1, messages=3)
+        source = self.shard_of(topic['id'])
+        target = next(alias for alias in SHARDS if alias != source)
+        messages = self.client.get(f'/topics/{topic["id"]}/messages/').json()
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(CHAT_ARCHIVE={'DIRECTORY': directory, 'BLOCK_MESSAGES': 2}):
+            call_command('archive_messages', '--age-days', '0', stdout=StringIO())
+
+            sharding.move_topic(topic['id'], target)
+
+            self.assertEqual(ArchiveBlock.objects.using(target).count(), 2)
+            self.assertEqual(self.client.get(f'/topics/{topic["id"]}/messages/').json(), messages)
+            self.assertEqual(self.client.get(f'/messages/{messages[0]["id"]}/').json(), messages[0])
+
+    def test_write_of_moved_topic_is_retried(self):
+        topic, = self.create_topics(1, messages=0)
+
+        # the topic moved after the request looked it up
+        with mock.patch.object(Topic, 'bump_change_seq', side_effect=Topic.DoesNotExist):
+            response = self.client.post(f'/topics/{topic["id"]}/messages/', {'text': 'Written during the move'},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '1')
+
+    def test_rebalance_after_adding_a_shard(self):
+        with override_settings(CHAT_SHARDS=shards_config('shard1', 'shard2')):
+            topics = self.create_topics(20, messages=1)
+            out = StringIO()
+            call_command('rebalance_shards', stdout=out)
+            self.assertEqual(out.getvalue(), 'Moved 0 topics with 0 messages\n')
+
+        out = StringIO()
+        call_command('rebalance_shards', '--dry-run', stdout=out)
+        moves = out.getvalue().splitlines()[:-1]
+        self.assertTrue(moves)
+        self.assertTrue(all(move.endswith('-> shard3') for move in moves))
+        self.assertFalse(Topic.objects.using('shard3').exists())
+
+        call_command('rebalance_shards', stdout=StringIO())
+        self.assertEqual(Topic.objects.using('shard3').count(), len(moves))
+        self.assertEqual(list(sharding.misplaced_topics()), [])
+        listed = self.client.get('/topics/').json()
+        self.assertEqual([topic['id'] for topic in listed], [topic['id'] for topic in topics])
+
+    def test_rebalance_registers_unknown_topics(self):
+        Topic.objects.using('shard2').create(id=1000, title='Sharded later')
+        out = StringIO()
+
+        call_command('rebalance_shards', '--topic', '1000', '--to', 'shard1', stdout=out)
+
+        self.assertEqual(out.getvalue(), 'Registered 1 topics missing from the directory\n'
+                                         'Moved 1 topics with 0 messages\n')
+        self.assertEqual(self.shard_of(1000), 'shard1')
+        # new ids start after the rows already in the shards
+        self.assertGreater(self.post('/topics/', {'title': 'New topic'})['id'], 1000)
+
+
+class HashRingTest(SimpleTestCase):
+
+    def test_adding_a_node_moves_a_share_of_the_keys(self):
+        before = sharding.HashRing(['shard1', 'shard2', 'shard3'])
+        after = sharding.HashRing(['shard1', 'shard2', 'shard3', 'shard4'])
+        keys = range(10000)
+
+        moved = [key for key in keys if before.get(key) != after.get(key)]
+        self.assertTrue(all(after.get(key) == 'shard4' for key in moved))
+        self.assertAlmostEqual(len(moved) / len(keys), 1 / 4, delta=0.08)
+        counts = [sum(before.get(key) == node for key in keys) for node in ('shard1', 'shard2', 'shard3')]
+        self.assertLess(max(counts) / min(counts), 1.5)
+
+
+class ShardsFromEnvTest(SimpleTestCase):
+
+    def test_shards(self):
+        default = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': Path('/srv/chat/db.sqlite3')}
+
+        self.assertEqual(shards_from_env({}, Path('/srv/chat'), default), ({}, None))
+        databases, config = shards_from_env({'CHAT_DB_SHARDS': 'a.sqlite3,b.sqlite3'}, Path('/srv/chat'), default)
+        self.assertEqual(databases['shard2'], {'ENGINE': 'django.db.backends.sqlite3',
+                                               'NAME': Path('/srv/chat/b.sqlite3')})
+        self.assertEqual(config, {'DATABASES': ['shard1', 'shard2'], 'VIRTUAL_NODES': 64})
+
+        default = {'ENGINE': 'django.db.backends.postgresql', 'NAME': 'chat', 'HOST': 'primary', 'PORT': '5432'}
+        databases, _ = shards_from_env({'CHAT_DB_SHARDS': 'primary/chat1,other:5433/chat2'}, Path('/srv/chat'),
+                                       default)
+        self.assertEqual([(database['HOST'], database['PORT'], database['NAME']) for database in databases.values()],
+                         [('primary', '5432', 'chat1'), ('other', '5433', 'chat2')])
@@ -0,0 +1,174 @@
+import os
+import tempfile
+import threading
+import time
+
+from django.db import OperationalError, connection, connections, transaction
+from django.test import SimpleTestCase
+
+ALIAS = 'sqlite_concurrency'
+OTHER_ALIAS = 'sqlite_concurrency_other'
+
+
+class SQLiteBackendTest(SimpleTestCase):
+    """Connections to a database file of their own, ENGINE chatting.backends.sqlite3 unless tuned is False"""
+
+    def use_database(self, tuned=True, alias=ALIAS, **options):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_dict = dict(connection.settings_dict, NAME=os.path.join(directory.name, 'db.sqlite3'),
+                             TEST={}, OPTIONS=dict({'timeout': 5}, **options))
+        if tuned:
+            settings_dict['ENGINE'] = 'chatting.backends.sqlite3'
+        connections.settings[alias] = settings_dict
+        self.addCleanup(connections.settings.pop, alias)
+        self.addCleanup(self.close_connection, alias)
+        with connections[alias].cursor() as cursor:
+            cursor.execute('CREATE TABLE item (id integer PRIMARY KEY, number integer)')
+
+    @staticmethod
+    def close_connection(alias):
+        if hasattr(connections._connections, alias):
+            connections[alias].close()
+            delattr(connections._connections, alias)
+
+    @staticmethod
+    def query(sql, *params, using=ALIAS):
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def run_threads(self, *targets):
+        """Runs targets in threads with connections of their own, returns the errors they raised"""
+        errors = []
+
+        def run(target):
+            try:
+                target()
+            except OperationalError as e:
+                errors.append(e)
+            finally:
+                for alias in (ALIAS, OTHER_ALIAS):
+                    if alias in connections.settings:
+                        connections[alias].close()
+
+        threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return errors
+
+    def write_after_read(self):
+        # the number of the new item depends on what the transaction read, like counters and change sequences
+        with transaction.atomic(using=ALIAS):
+            count = self.query('SELECT count(*) FROM item')[0][0]
+            self.query('INSERT INTO item (number) VALUES (%s)', count + 1)
+
+    def test_connection_settings(self):
+        self.use_database(mmap_size=1024 * 1024)
+
+        self.assertEqual(self.query('PRAGMA journal_mode'), [('wal',)])
+        # NORMAL
+        self.assertEqual(self.query('PRAGMA synchronous'), [(1,)])
+        self.assertEqual(self.query('PRAGMA busy_timeout'), [(5000,)])
+        self.assertEqual(self.query('PRAGMA mmap_size'), [(1024 * 1024,)])
+
+    def interleaved_transactions(self):
+        """Two transactions reading before writing, the second one reads while the first one is not committed"""
+        first_read = threading.Event()
+
+        def first():
+            with transaction.atomic(using=ALIAS):
+                self.query('SELECT count(*) FROM item')
+                first_read.set()
+                time.sleep(0.2)
+                self.query('INSERT INTO item (number) VALUES (1)')
+
+        def second():
+            first_read.wait()
+            self.write_after_read()
+
+        return self.run_threads(first, second)
+
+    def test_interleaved_transactions_wait_for_each_other(self):
+        self.use_database()
+
+        self.assertEqual(self.interleaved_transactions(), [])
+        self.assertEqual(self.query('SELECT number FROM item ORDER BY id'), [(1,), (2,)])
+
+    def test_interleaved_transactions_wait_for_each_other_with_serialized_writes(self):
+        self.use_database(serialize_writes=True)
+
+        self.assertEqual(self.interleaved_transactions(), [])
+        self.assertEqual(self.query('SELECT number FROM item ORDER BY id'), [(1,), (2,)])
+
+    def test_interleaved_transactions_fail_with_default_backend(self):
+        self.use_database(tuned=False)
+
+        errors = self.interleaved_transactions()
+
+        self.assertEqual([str(error) for error in errors], ['database is locked'])
+
+    def test_serialized_writes_across_databases_never_wait_in_a_cycle(self):
+        self.use_database(serialize_writes=True)
+        self.use_database(alias=OTHER_ALIAS, serialize_writes=True)
+        first_wrote, second_wrote = threading.Event(), threading.Event()
+
+        def write(using):
+            self.query('INSERT INTO item (number) VALUES (1)', using=using)
+
+        def first():
+            # takes the locks in alias order
+            with transaction.atomic(using=ALIAS):
+                write(ALIAS)
+                first_wrote.set()
+                second_wrote.wait()
+                with transaction.atomic(using=OTHER_ALIAS):
+                    write(OTHER_ALIAS)
+
+        def second():
+            first_wrote.wait()
+            with transaction.atomic(using=OTHER_ALIAS):
+                write(OTHER_ALIAS)
+                second_wrote.set()
+                with transaction.atomic(using=ALIAS):
+                    write(ALIAS)
+
+        started = time.perf_counter()
+        errors = self.run_threads(first, second)
+
+        # the second thread gives up at once instead of both waiting for the timeout
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertEqual([str(error) for error in errors], ['database is locked'])
+        self.assertEqual(self.query('SELECT count(*) FROM item'), [(1,)])
+        self.assertEqual(self.query('SELECT count(*) FROM item', using=OTHER_ALIAS), [(1,)])
+
+    def test_sustained_writes_with_readers(self):
+        self.use_database()
+        writers_done = threading.Event()
+        reads = []
+
+        def writer():
+            for _ in range(50):
+                self.write_after_read()
+
+        def reader():
+            while not writers_done.is_set():
+                reads.append(self.query('SELECT max(number) FROM item'))
+
+        def writers():
+            try:
+                self.assertEqual(self.run_threads(*[writer] * 4), [])
+            finally:
+                writers_done.set()
+
+        started = time.perf_counter()
+        errors = self.run_threads(writers, *[reader] * 8)
+        elapsed = time.perf_counter() - started
+
+        self.assertEqual(errors, [])
+        # every transaction saw the items of the transactions before it
+        self.assertEqual(self.query('SELECT number FROM item ORDER BY id'), [(number,) for number in range(1, 201)])
+        self.assertGreater(len(reads), 0)
+        self.assertGreater(200 / elapsed, 20, 'writes per second')
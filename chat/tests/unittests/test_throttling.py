@@ -0,0 +1,179 @@
+import os
+import tempfile
+from unittest import mock
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from chat import throttling
+from chat.models import Message, Topic
+from chat.throttling import LocalMemoryStore, SharedMemoryStore, parse_rate
+
+
+def throttle_rates(**rates):
+    return override_settings(REST_FRAMEWORK={**settings.REST_FRAMEWORK,
+                                             'DEFAULT_THROTTLE_RATES': {'client': None, 'topic': None, **rates}})
+
+
+@override_settings(CHAT_RESPONSE_CACHE=None)
+class ThrottlingTest(TestCase):
+
+    def setUp(self):
+        self.topic = Topic.objects.create(id=1, title='What is the weather like?')
+        Topic.objects.create(id=2, title='The Most Popular Color in the World')
+        # fresh buckets and a clock of our own for every test
+        for name, value in (('_stores', {}), ('_current', (None, None))):
+            patcher = mock.patch.object(throttling, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.now = 1000.0
+        patcher = mock.patch.object(throttling.TokenBucketThrottle, 'timer', mock.Mock(side_effect=lambda: self.now))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def post(self, topic_id, address='10.0.0.1'):
+        return self.client.post(f'/topics/{topic_id}/messages/', {'text': 'A message sent in a hurry'},
+                                content_type='application/json', REMOTE_ADDR=address)
+
+    def test_client_bucket(self):
+        with throttle_rates(client='3/min'):
+            for _ in range(3):
+                self.assertEqual(self.client.get('/topics/', REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_200_OK)
+            response = self.client.get('/topics/', REMOTE_ADDR='10.0.0.1')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '20')
+            self.assertEqual(self.client.get('/topics/', REMOTE_ADDR='10.0.0.2').status_code, status.HTTP_200_OK)
+
+            # a token every 20 seconds
+            self.now += 20
+            self.assertEqual(self.client.get('/topics/', REMOTE_ADDR='10.0.0.1').status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.get('/topics/', REMOTE_ADDR='10.0.0.1').status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_topic_bucket(self):
+        with throttle_rates(topic='2/s'):
+            self.assertEqual(self.post(1, '10.0.0.1').status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.post(1, '10.0.0.2').status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.post(1, '10.0.0.3').status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            response = self.client.post('/messages/', {'text': 'A message sent in a hurry', 'topic': 1},
+                                        content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+            self.assertEqual(self.post(2).status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.client.get('/topics/1/messages/').status_code, status.HTTP_200_OK)
+            self.now += 0.5
+            self.assertEqual(self.post(1).status_code, status.HTTP_201_CREATED)
+
+    def test_topic_bucket_of_message_updates_and_deletes(self):
+        messages = [Message.objects.create(text='A message sent in a hurry', topic=self.topic) for _ in range(3)]
+        with throttle_rates(topic='2/s'):
+            response = self.client.patch(f'/messages/{messages[0].id}/', {'text': 'An edited message'},
+                                         content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(self.client.delete(f'/messages/{messages[1].id}/').status_code,
+                             status.HTTP_204_NO_CONTENT)
+            self.assertEqual(self.client.delete(f'/messages/{messages[2].id}/').status_code,
+                             status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(self.post(2).status_code, status.HTTP_201_CREATED)
+            # no topic, no bucket, the view answers
+            self.assertEqual(self.client.delete('/messages/99/').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_topic_bucket_of_message_updates_takes_no_query(self):
+        message = Message.objects.create(text='A message sent in a hurry', topic=self.topic)
+
+        def patch():
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch(f'/messages/{message.id}/', {'text': 'An edited message'},
+                                             content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(queries)
+
+        unthrottled = patch()
+        with throttle_rates(topic='2/s'):
+            self.assertEqual(patch(), unthrottled)
+
+    def test_topic_bucket_of_batches(self):
+        messages = [Message.objects.create(text='A message sent in a hurry', topic_id=2) for _ in range(3)]
+        item = {'text': 'A message sent in a hurry'}
+        with throttle_rates(topic='3/s'):
+            # a token per message
+            response = self.client.post('/topics/1/messages/bulk/', [item] * 2, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            response = self.client.post('/messages/bulk/', [dict(item, topic=1)] * 2, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '1')
+
+            response = self.client.patch('/messages/bulk/', [dict(item, id=message.id) for message in messages],
+                                         content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            response = self.client.delete('/messages/bulk/', [messages[0].id], content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertTrue(Message.objects.filter(id=messages[0].id).exists())
+
+            # a batch larger than the bucket takes it whole
+            self.now += 1
+            response = self.client.post('/topics/2/messages/bulk/', [item] * 5, content_type='application/json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.post(2).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_disabled_by_default(self):
+        for _ in range(20):
+            self.assertEqual(self.post(1).status_code, status.HTTP_201_CREATED)
+
+    def test_shared_memory_store(self):
+        with tempfile.TemporaryDirectory() as directory, throttle_rates(client='2/min'), \
+                override_settings(CHAT_THROTTLE_STORE={'BACKEND': 'chat.throttling.SharedMemoryStore',
+                                                       'OPTIONS': {'path': os.path.join(directory, 'buckets')}}):
+            self.assertEqual(self.post(1).status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.post(1).status_code, status.HTTP_201_CREATED)
+            self.assertEqual(self.post(1).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            throttling.get_store().close()
+
+
+class StoreTest(SimpleTestCase):
+
+    def test_rates(self):
+        self.assertEqual(parse_rate('20/s'), (20, 20))
+        self.assertEqual(parse_rate('600/min'), (600, 10))
+        for rate in ('0/s', '-1/min'):
+            with self.subTest(rate=rate), self.assertRaises(ImproperlyConfigured):
+                parse_rate(rate)
+
+    def test_local_memory_store_drops_least_recently_used(self):
+        store = LocalMemoryStore(max_entries=2)
+        self.assertEqual(store.consume('a', 1, 1, now=0), 0)
+        self.assertEqual(store.consume('b', 1, 1, now=0), 0)
+        self.assertEqual(store.consume('a', 1, 1, now=0.5), 0.5)
+        store.consume('c', 1, 1, now=0.5)
+
+        self.assertEqual(list(store._buckets), ['a', 'c'])
+
+    def test_shared_memory_store_is_shared_by_mappings(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'buckets')
+            # every process maps the file, like two of them here
+            first, second = SharedMemoryStore(path, slots=64), SharedMemoryStore(path, slots=64)
+            self.addCleanup(first.close)
+            self.addCleanup(second.close)
+
+            self.assertEqual(first.consume('client:a', 2, 1, now=0), 0)
+            self.assertEqual(second.consume('client:a', 2, 1, now=0), 0)
+            self.assertEqual(first.consume('client:a', 2, 1, now=0), 1)
+            self.assertEqual(second.consume('client:b', 2, 1, now=0), 0)
+            self.assertEqual(second.consume('client:a', 2, 1, now=1), 0)
+
+    def test_shared_memory_store_full_group(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = SharedMemoryStore(os.path.join(directory, 'buckets'), slots=2, ways=2)
+            self.addCleanup(store.close)
+
+            store.consume('a', 1, 1, now=0)
+            store.consume('b', 1, 1, now=1)
+            # the least recently updated bucket, a, makes room for c
+            self.assertEqual(store.consume('c', 1, 1, now=1), 0)
+            self.assertEqual(store.consume('b', 1, 1, now=1), 1)
+            self.assertEqual(store.consume('a', 1, 1, now=1), 0)
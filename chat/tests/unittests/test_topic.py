@@ -77,14 +77,15 @@ class TopicSerializerTest(TestCase):
         mocked = datetime.datetime(2020, 1, 1, 0, 0, 0, tzinfo=pytz.utc)
         self.topic_attr = {'id': 1, 'title': 'What is the weather like?'}
         self.topic_serialized = {'id': 1, 'title': 'What is the weather like?',
-                                 'created_at': mocked.strftime(REST_FRAMEWORK['DATETIME_FORMAT'])}
+                                 'created_at': mocked.strftime(REST_FRAMEWORK['DATETIME_FORMAT']),
+                                 'message_count': 0, 'last_message_at': None}
         with mock.patch('django.utils.timezone.now', mock.Mock(return_value=mocked)):
             self.topic = Topic.objects.create(**self.topic_attr)
         self.serializer = TopicSerializer(instance=self.topic)
 
     def test_contains_expected_fields(self):
         data = self.serializer.data
-        self.assertCountEqual(data.keys(), ['id', 'title', 'created_at'])
+        self.assertCountEqual(data.keys(), ['id', 'title', 'created_at', 'message_count', 'last_message_at'])
 
     def test_contains_correct_data(self):
         self.assertEqual(self.serializer.data, self.topic_serialized)
@@ -0,0 +1,109 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+import pytz
+from django.core.management import call_command
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory
+
+from chat.models import Topic, Message
+from chat.views import MessageFromTopicViewSet, MessageViewSet, TopicViewSet
+
+
+class TopicActivityTest(TestCase):
+    mocked_date = datetime.datetime(2020, 1, 1, 0, 0, 0, tzinfo=pytz.utc)
+
+    def setUp(self) -> None:
+        self.topic = Topic.objects.create(id=1, title='What is the weather like?')
+        self.other_topic = Topic.objects.create(id=2, title='The Most Popular Color in the World')
+        self.factory = APIRequestFactory()
+
+    def create_message(self, id, minutes, topic=None):
+        with mock.patch('django.utils.timezone.now',
+                        mock.Mock(return_value=self.mocked_date + datetime.timedelta(minutes=minutes))):
+            return Message.objects.create(id=id, text=f'Typical message number {id}', topic=topic or self.topic)
+
+    def assertActivity(self, topic, message_count, last_message_at):
+        topic.refresh_from_db()
+        self.assertEqual((topic.message_count, topic.last_message_at), (message_count, last_message_at))
+
+    def test_create_through_view(self):
+        request = self.factory.post(reverse('message-from-topic-list', args=(1,)), {'text': 'Hot and sunny day'})
+        MessageFromTopicViewSet.as_view({'post': 'create'})(request, topic_id=1)
+
+        self.assertActivity(self.topic, 1, Message.objects.get().created_at)
+
+    def test_update_keeps_activity(self):
+        message = self.create_message(1, 5)
+        message.text = 'Updated typical message'
+        message.save()
+
+        self.assertActivity(self.topic, 1, message.created_at)
+
+    def test_deleting_newest_message_falls_back_to_previous(self):
+        first = self.create_message(1, 1)
+        newest = self.create_message(2, 2)
+
+        request = self.factory.delete(reverse('messages-detail', args=(2,)))
+        MessageViewSet.as_view({'delete': 'destroy'})(request, pk=newest.id)
+        self.assertActivity(self.topic, 1, first.created_at)
+
+        first.delete()
+        self.assertActivity(self.topic, 0, None)
+
+    def test_bulk_writes(self):
+        request = self.factory.post(reverse('messages-bulk'), [
+            {'text': 'Hot and sunny day', 'topic': 1},
+            {'text': 'The best color is Blue', 'topic': 2},
+            {'text': 'It will be a rainstorm', 'topic': 1}], format='json')
+        MessageViewSet.as_view({'post': 'bulk_create'})(request)
+
+        self.assertActivity(self.topic, 2, Message.objects.filter(topic=1).latest('created_at').created_at)
+        self.assertActivity(self.other_topic, 1, Message.objects.get(topic=2).created_at)
+
+        Message.objects.filter(topic=1).delete_leaving_tombstones()
+        self.assertActivity(self.topic, 0, None)
+        self.assertEqual(Topic.objects.get(id=2).message_count, 1)
+
+    def test_topic_save_does_not_overwrite_message_count(self):
+        stale_topic = Topic.objects.get(id=1)
+        self.create_message(1, 1)
+
+        stale_topic.title = 'What is the weather like today?'
+        stale_topic.save()
+
+        self.assertActivity(self.topic, 1, self.mocked_date + datetime.timedelta(minutes=1))
+
+    def test_topic_list_does_not_aggregate_messages(self):
+        self.create_message(1, 1)
+        request = self.factory.get(reverse('topics-list'))
+
+        # the ETag version and the page
+        with self.assertNumQueries(2) as queries:
+            response = TopicViewSet.as_view({'get': 'list'})(request)
+
+        self.assertEqual(response.data[0]['message_count'], 1)
+        self.assertFalse(any('chat_message' in query['sql'] for query in queries.captured_queries))
+
+    def test_repair_command(self):
+        self.create_message(1, 1)
+        newest = self.create_message(2, 2)
+        Topic.objects.filter(id=1).update(message_count=7, last_message_at=None)
+        Topic.objects.filter(id=2).update(message_count=3)
+
+        out = StringIO()
+        call_command('repair_topic_counters', stdout=out)
+
+        self.assertEqual(out.getvalue(), 'Repaired 2 of 2 topics\n')
+        self.assertActivity(self.topic, 2, newest.created_at)
+        self.assertActivity(self.other_topic, 0, None)
+
+    def test_repair_command_with_correct_counters(self):
+        self.create_message(1, 1)
+        out = StringIO()
+
+        call_command('repair_topic_counters', '1', stdout=out)
+
+        self.assertEqual(out.getvalue(), 'Repaired 0 of 1 topics\n')
@@ -0,0 +1,83 @@
+from django.core.cache import caches
+from django.db import connection
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+
+from chat.models import Message, Topic
+from chat.serializers import MessageSerializer, TopicSerializer
+from chat.views import TopicViewSet
+
+
+@override_settings(CHAT_RESPONSE_CACHE='chat')
+class TopicLatestMessagesTest(TransactionTestCase):
+    """
+    Topic i of 1-10 has i messages, topic 11 none. Runs in autocommit like production requests, with the response
+    cache.
+    """
+
+    def setUp(self):
+        caches['chat'].clear()
+        for topic_id in range(1, 12):
+            topic = Topic.objects.create(id=topic_id, title=f'Topic number {topic_id}')
+            for number in range(topic_id if topic_id <= 10 else 0):
+                Message.objects.create(text=f'Message {number} of topic {topic_id}', topic=topic)
+
+    def get(self, path, **params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content)
+        return response.json()
+
+    def latest_messages(self, topic_id, number):
+        messages = Message.objects.filter(topic=topic_id).order_by('created_at', 'id')
+        return MessageSerializer(list(messages)[-number:], many=True).data
+
+    def test_list(self):
+        topics = self.get('/topics/', include='latest_messages')
+
+        self.assertEqual(len(topics), 11)
+        for topic in topics:
+            latest_messages = topic.pop('latest_messages')
+            self.assertEqual(topic, TopicSerializer(Topic.objects.get(id=topic['id'])).data)
+            self.assertEqual(latest_messages, self.latest_messages(topic['id'], 3))
+        self.assertEqual(topics[-1]['message_count'], 0)
+        self.assertNotIn('latest_messages', self.get('/topics/')[0])
+
+    def test_number_and_retrieve(self):
+        topic = self.get('/topics/9/', include='latest_messages', n=5)
+
+        self.assertEqual(topic['latest_messages'], self.latest_messages(9, 5))
+        self.assertEqual(len(self.get('/topics/9/', include='latest_messages', n=20)['latest_messages']), 9)
+        self.assertEqual(self.get('/topics/11/', include='latest_messages')['latest_messages'], [])
+
+    def test_one_query_for_the_page(self):
+        def count_queries(page_size):
+            with CaptureQueriesContext(connection) as queries:
+                self.get('/topics/', include='latest_messages', n=2, page_size=page_size)
+            return len(queries)
+
+        with CaptureQueriesContext(connection) as without:
+            self.get('/topics/', page_size=2)
+        self.assertEqual(count_queries(2), len(without) + 1)
+        self.assertEqual(count_queries(10), len(without) + 1)
+
+    def test_message_edits_reach_cached_lists(self):
+        self.get('/topics/', include='latest_messages', n=1)
+        etag = self.client.get('/topics/', {'include': 'latest_messages', 'n': 1})['ETag']
+        message = Message.objects.get(topic=1)
+        response = self.client.patch(f'/messages/{message.id}/', {'text': 'An edited message'}, content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get('/topics/', {'include': 'latest_messages', 'n': 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json()[0]['latest_messages'][0]['text'], 'An edited message')
+
+    def test_invalid_parameters(self):
+        for params in ({'include': 'messages'}, {'include': 'latest_messages', 'n': 'three'},
+                       {'include': 'latest_messages', 'n': 0}, {'include': 'latest_messages', 'n': 21}):
+            response = self.client.get('/topics/', params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_served_by_the_sync_view(self):
+        self.assertTrue(TopicViewSet.runs_sync(RequestFactory().get('/topics/', {'include': 'latest_messages'})))
+        self.assertFalse(TopicViewSet.runs_sync(RequestFactory().get('/topics/')))
@@ -242,6 +242,38 @@ class MessageFromTopicViewsUpdateMessage(TestCase):
         self.assertEqual(json.loads(response.content), msg_after_update)
         self.assertEqual(response['content-type'], 'application/json')
 
+    def test_update_message_from_topic_with_json_body(self):
+        factory = APIRequestFactory()
+        message_view = MessageFromTopicViewSet.as_view({'patch': 'partial_update'})
+        topic_id, msg_id = self.messages[0]['topic'].id, self.messages[0]['id']
+
+        for data, expected in (({'text': 'The worst weather ever', 'topic': 99}, status.HTTP_200_OK),
+                               (['The worst weather ever'], status.HTTP_400_BAD_REQUEST)):
+            request = factory.patch(reverse('message-from-topic-detail', args=(topic_id, msg_id)), data, format='json')
+            response = message_view(request, topic_id=topic_id, msg_id=msg_id)
+            response.render()
+
+            self.assertEqual(response.status_code, expected, response.content)
+        self.assertEqual(Message.objects.get(id=msg_id).text, 'The worst weather ever')
+        self.assertEqual(Message.objects.get(id=msg_id).topic_id, topic_id)
+
+    def test_update_message_from_topic_query_count(self):
+        """
+        Update costs: load message, check topic from URL exists, bump topic change sequence, UPDATE.
+        Topic lock needs no extra queries
+        """
+        msg_to_send = {'text': 'The worst weather ever'}
+
+        factory = APIRequestFactory()
+        message_view = MessageFromTopicViewSet.as_view({'put': 'update'})
+        request = factory.put(reverse('message-from-topic-detail', args=(self.messages[0]['topic'].id, self.messages[0]['id'])), msg_to_send)
+
+        with self.assertNumQueries(4):
+            response = message_view(request, topic_id=self.messages[0]['topic'].id, msg_id=self.messages[0]['id'])
+            response.render()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_update_message_with_too_short_text_from_topic(self):
         # create messages to update and change Topics object to id
         new_text = 'H' * 9
@@ -107,6 +107,7 @@ class TopicViewsCreateTopics(TestCase):
 
             temp_topic = self.topic
             temp_topic['created_at'] = mocked.strftime(REST_FRAMEWORK['DATETIME_FORMAT'])
+            temp_topic.update(message_count=0, last_message_at=None)
             self.topic_data = temp_topic
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -127,6 +128,7 @@ class TopicViewsCreateTopics(TestCase):
 
             temp_topic = self.topic
             temp_topic['created_at'] = mocked.strftime(REST_FRAMEWORK['DATETIME_FORMAT'])
+            temp_topic.update(message_count=0, last_message_at=None)
             self.topic_data = temp_topic
 
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -0,0 +1,127 @@
+import datetime
+import io
+import os
+import tempfile
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+from chat.models import Topic, Message
+from chat.transfer import Checkpoint
+
+
+class Interrupted(Exception):
+    pass
+
+
+def interrupt_after(saves):
+    """Checkpoint.save failing after the given number of saves, like a kill after a committed batch"""
+    save = Checkpoint.save
+    calls = []
+
+    def interrupted_save(checkpoint, state):
+        if len(calls) == saves:
+            raise Interrupted
+        calls.append(state)
+        save(checkpoint, state)
+
+    return mock.patch.object(Checkpoint, 'save', interrupted_save)
+
+
+class TransferCommandsTest(TestCase):
+
+    def setUp(self) -> None:
+        start = datetime.datetime(2021, 3, 4, 5, 6, 7, 891011, tzinfo=datetime.timezone.utc)
+        topics = [Topic.objects.create(title='What is the weather like?'),
+                  Topic.objects.create(title='The Most Popular Color in the World'),
+                  Topic.objects.create(title='Empty topic')]
+        texts = ['Hot and sunny day', 'Zażółć gęślą jaźń ☀', 'Line\nbreak, "quotes", commas\r\nand \\ slash']
+        for id in range(1, 31):
+            Message.objects.create(id=id * 3, text=f'{texts[id % 3]} {id}', topic=topics[id % 2],
+                                   created_at=start + datetime.timedelta(seconds=id % 7))
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def snapshot(self):
+        return (list(Topic.objects.order_by('id').values_list('id', 'title', 'created_at', 'message_count',
+                                                               'last_message_at')),
+                list(Message.objects.order_by('id').values_list('id', 'text', 'topic', 'created_at')))
+
+    def run_command(self, name, *args, **options):
+        out = io.StringIO()
+        call_command(name, self.directory, *args, stdout=out, **options)
+        return out.getvalue()
+
+    def clear(self):
+        Topic.objects.all().delete()
+
+    def test_round_trip_keeps_ids_and_timestamps(self):
+        expected = self.snapshot()
+        for format in ('ndjson', 'csv'):
+            with self.subTest(format=format):
+                output = self.run_command('chat_export', format=format, chunk_size=7)
+                self.assertIn('Exported 30 messages', output)
+                self.clear()
+
+                output = self.run_command('chat_import', batch_size=4)
+
+                self.assertIn('Imported 3 topics', output)
+                self.assertIn('Imported 30 messages', output)
+                self.assertEqual(self.snapshot(), expected)
+                self.assertFalse(os.path.exists(os.path.join(self.directory, 'chat_import.progress')))
+                os.remove(os.path.join(self.directory, f'topics.{format}'))
+
+    def test_imported_messages_have_change_sequences(self):
+        self.run_command('chat_export')
+        self.clear()
+        self.run_command('chat_import', batch_size=4)
+
+        topic = Topic.objects.get(id=1)
+        seqs = list(Message.objects.filter(topic=topic).order_by('change_seq').values_list('change_seq', flat=True))
+        self.assertEqual(seqs, list(range(1, topic.message_count + 1)))
+        self.assertEqual(topic.change_seq, topic.message_count)
+
+    def test_resumed_export_is_identical(self):
+        for format in ('ndjson', 'csv'):
+            with self.subTest(format=format):
+                self.run_command('chat_export', format=format, chunk_size=4)
+                expected = self.read_dump(format)
+
+                # topics and 3 chunks of messages are checkpointed, the 4th chunk is written only
+                with interrupt_after(5), self.assertRaises(Interrupted):
+                    self.run_command('chat_export', format=format, chunk_size=4)
+                self.assertNotEqual(self.read_dump(format), expected)
+                self.run_command('chat_export', chunk_size=4, resume=True)
+
+                self.assertEqual(self.read_dump(format), expected)
+
+    def read_dump(self, format):
+        dump = []
+        for name in ('topics', 'messages'):
+            with open(os.path.join(self.directory, f'{name}.{format}'), 'rb') as file:
+                dump.append(file.read())
+        return dump
+
+    def test_resumed_import_inserts_every_row_once(self):
+        expected = self.snapshot()
+        self.run_command('chat_export')
+        self.clear()
+
+        # topics and 4 batches of messages are committed and checkpointed, the 5th batch is committed only
+        with interrupt_after(5), self.assertRaises(Interrupted):
+            self.run_command('chat_import', batch_size=4)
+        self.assertEqual(Message.objects.count(), 20)
+        with self.assertRaises(CommandError):
+            self.run_command('chat_import')
+
+        self.run_command('chat_import', batch_size=4, resume=True)
+
+        self.assertEqual(self.snapshot(), expected)
+
+    def test_nothing_to_resume(self):
+        with self.assertRaises(CommandError):
+            self.run_command('chat_export', resume=True)
+        with self.assertRaises(CommandError):
+            self.run_command('chat_import', resume=True)
@@ -0,0 +1,94 @@
+import json
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers as drf_serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from chat import serializers
+from chat.models import Topic, Message
+from chat.renderers import FastJSONRenderer
+from chat.views import MessageFromTopicViewSet, TopicViewSet
+
+
+class ValuesSerializerTest(TestCase):
+
+    def setUp(self) -> None:
+        self.topics_saved = [Topic.objects.create(id=1, title='What is the weather like?'),
+                             Topic.objects.create(id=2, title='Empty topic')]
+        texts = ['Hot and sunny day', 'Zażółć gęślą jaźń ☀', 'Line\nbreak, "quotes" and \\ \u2028 \x07', '']
+        for id, text in enumerate(texts, start=1):
+            Message.objects.create(id=id, text=text, topic=self.topics_saved[0])
+        self.factory = APIRequestFactory()
+
+    def assertSameData(self, values_serializer_class, queryset):
+        serializer_class = values_serializer_class.serializer_class
+        rows = list(values_serializer_class.values_list(queryset))
+
+        expected = serializer_class(queryset, many=True).data
+        data = values_serializer_class(rows, many=True).data
+        self.assertEqual(data, expected)
+        self.assertEqual(values_serializer_class(rows[0]).data, serializer_class(queryset[0]).data)
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(expected))
+
+    def test_same_data_as_model_serializers(self):
+        self.assertSameData(serializers.TopicValuesSerializer, Topic.objects.order_by('id'))
+        self.assertSameData(serializers.MessageValuesSerializer, Message.objects.order_by('id'))
+
+    def test_same_data_in_other_timezone_and_format(self):
+        with timezone.override('Europe/Warsaw'):
+            self.assertSameData(serializers.MessageValuesSerializer, Message.objects.order_by('id'))
+        with override_settings(REST_FRAMEWORK={'DATETIME_FORMAT': 'iso-8601'}):
+            self.assertSameData(serializers.TopicValuesSerializer, Topic.objects.order_by('id'))
+
+    def test_unsupported_field(self):
+        class NestedSerializer(drf_serializers.ModelSerializer):
+            topic = serializers.TopicSerializer()
+
+            class Meta:
+                model = Message
+                fields = ('id', 'topic')
+
+        class NestedValuesSerializer(serializers.ValuesSerializer):
+            serializer_class = NestedSerializer
+
+        with self.assertRaises(ImproperlyConfigured):
+            NestedValuesSerializer.values_list(Message.objects.all())
+
+    def test_views_render_model_serializer_output(self):
+        view = MessageFromTopicViewSet.as_view({'get': 'list'})
+        response = view(self.factory.get(reverse('message-from-topic-list', args=(1,))), topic_id=1)
+        response.render()
+
+        messages = Message.objects.filter(topic=1).order_by('created_at', 'id')
+        expected = serializers.MessageSerializer(messages, many=True).data
+        self.assertEqual(response.content, JSONRenderer().render(expected))
+
+        view = TopicViewSet.as_view({'get': 'retrieve'})
+        response = view(self.factory.get(reverse('topics-detail', args=(1,))), pk=1)
+        response.render()
+
+        self.assertEqual(json.loads(response.content), serializers.TopicSerializer(Topic.objects.get(id=1)).data)
+
+    def test_browsable_api_reads_model_instances(self):
+        view = TopicViewSet.as_view({'get': 'retrieve'})
+        response = view(self.factory.get(reverse('topics-detail', args=(1,)), HTTP_ACCEPT='text/html'), pk=1)
+        response.render()
+
+        self.assertIsInstance(response.data.serializer, serializers.TopicSerializer)
+        self.assertIn(b'What is the weather like?', response.content)
+
+
+class FastJSONRendererTest(TestCase):
+
+    def test_falls_back_to_json_renderer(self):
+        data = {'text': 'Sunny \u2029', 'values': [1.5, None, True], 'created_at': timezone.now()}
+
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+        self.assertEqual(FastJSONRenderer().render(data, 'application/json; indent=4'),
+                         JSONRenderer().render(data, 'application/json; indent=4'))
+        self.assertEqual(FastJSONRenderer().render({'id': 2 ** 70}), JSONRenderer().render({'id': 2 ** 70}))
+        self.assertEqual(FastJSONRenderer().render(None), b'')
@@ -0,0 +1,264 @@
+"""
+Token-bucket throttles per client and per topic, plugged into DRF's throttle hooks.
+
+A rate 'N/period' (period s, min, hour or day, like DRF's rates) is a bucket holding up to N tokens, refilled
+continuously at N per period. Every request takes a token, a request finding the bucket empty is answered 429 with
+Retry-After set to the time until the next token. Unlike DRF's SimpleRateThrottle, which keeps a list of request
+times per client in the cache, a bucket is two numbers updated in place, so a check costs the same at any rate.
+
+* ClientRateThrottle ('client' scope) - every request, by user when authenticated, by address otherwise
+  (X-Forwarded-For is trusted with NUM_PROXIES, see BaseThrottle.get_ident),
+* TopicRateThrottle ('topic' scope) - writes of messages to a topic, whoever sends them: creates, updates and
+  deletes, a token per message of a batch. A batch larger than the bucket takes it whole once it is full. Writes
+  of messages by id without the topic in the URL are charged by the view once it read the messages (see
+  views.TopicThrottleMixin), so the throttle adds no query.
+
+Rates and throttles are configured in REST_FRAMEWORK, a None rate disables its throttle:
+
+    REST_FRAMEWORK = {
+        'DEFAULT_THROTTLE_CLASSES': ['chat.throttling.ClientRateThrottle', 'chat.throttling.TopicRateThrottle'],
+        'DEFAULT_THROTTLE_RATES': {'client': '20/s', 'topic': '100/min'},
+    }
+
+Buckets live in the store picked by settings.CHAT_THROTTLE_STORE:
+
+* LocalMemoryStore - buckets of one process, at most max_entries, the least recently used are dropped,
+* SharedMemoryStore - buckets shared by the processes of one host in a memory-mapped file at path, a fixed-size
+  set-associative table whose groups of slots are locked with fcntl record locks. All processes need the same
+  slots and ways.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import Counter, OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'N/period' as (capacity, tokens per second)"""
+    number, period = rate.split('/')
+    number = int(number)
+    if number <= 0:
+        # an empty bucket that never refills, None is the way to turn a throttle off
+        raise ImproperlyConfigured(f"Throttle rate {rate!r} must allow at least 1 request per period")
+    return number, number / DURATIONS[period[0]]
+
+
+def take_token(tokens, stamp, capacity, rate, now, count=1):
+    """
+    Refills a bucket last updated at stamp and takes count tokens (all of them for more than capacity), returns
+    (tokens, seconds to wait, 0 when taken)
+    """
+    tokens = min(capacity, tokens + max(now - stamp, 0) * rate)
+    count = min(count, capacity)
+    if tokens >= count:
+        return tokens - count, 0.0
+    return tokens, (count - tokens) / rate
+
+
+class LocalMemoryStore:
+    """Buckets of this process, the max_entries most recently used"""
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, now, count=1):
+        """Takes count tokens from the bucket key, returns 0 or the seconds until they are available"""
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (capacity, now))
+            tokens, wait = take_token(tokens, stamp, capacity, rate, now, count)
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_entries:
+                # a dropped bucket starts full again, clients idle the longest lose the least
+                self._buckets.popitem(last=False)
+        return wait
+
+
+class SharedMemoryStore:
+    """
+    Buckets shared by the processes mapping the file path. A key hashes to a group of `ways` slots, a slot holds the
+    key's hash, tokens and time of the last update. A key without a slot takes an empty one or the least recently
+    updated of its group.
+    """
+
+    slot = struct.Struct('<Qdd')
+
+    def __init__(self, path, slots=65536, ways=8):
+        self.ways = ways
+        self.groups = max(slots // ways, 1)
+        self.group_size = self.ways * self.slot.size
+        size = self.groups * self.group_size
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(self._fd).st_size < size:
+            # growing keeps what other processes wrote, a new file reads as empty slots
+            os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        # record locks belong to the process, threads of the process take turns
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, now, count=1):
+        """Takes count tokens from the bucket key, returns 0 or the seconds until they are available"""
+        key_hash = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') | 1
+        start = key_hash % self.groups * self.group_size
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.group_size, start)
+            try:
+                offset, tokens, stamp = self._find(key_hash, start, capacity, now)
+                tokens, wait = take_token(tokens, stamp, capacity, rate, now, count)
+                self.slot.pack_into(self._map, offset, key_hash, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.group_size, start)
+        return wait
+
+    def _find(self, key_hash, start, capacity, now):
+        """(offset, tokens, stamp) of the slot of key_hash in the group at start, of a new full bucket if it has none"""
+        victim = None
+        for way in range(self.ways):
+            offset = start + way * self.slot.size
+            slot_hash, tokens, stamp = self.slot.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, tokens, stamp
+            # empty slots first, then the least recently updated
+            order = (slot_hash != 0, stamp)
+            if victim is None or order < victim[1]:
+                victim = (offset, order)
+        return victim[0], capacity, now
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+DEFAULT_STORE = {'BACKEND': 'chat.throttling.LocalMemoryStore'}
+
+_stores = {}
+_stores_lock = threading.Lock()
+# (settings.CHAT_THROTTLE_STORE, its store) of the last call, skips building the key on every request
+_current = (None, None)
+
+
+def get_store():
+    """Store of this process for the current CHAT_THROTTLE_STORE"""
+    global _current
+    config = getattr(settings, 'CHAT_THROTTLE_STORE', DEFAULT_STORE)
+    current_config, store = _current
+    if config is current_config:
+        return store
+    key = repr(config)
+    with _stores_lock:
+        if key not in _stores:
+            backend = import_string(config.get('BACKEND', DEFAULT_STORE['BACKEND']))
+            _stores[key] = backend(**config.get('OPTIONS', {}))
+        _current = (config, _stores[key])
+    return _current[1]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """Throttle of a scope of REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], get_key() picks the bucket of a request"""
+
+    scope = None
+    timer = time.time
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_rate(self):
+        # read for every request, rates follow changes of the settings
+        try:
+            return api_settings.DEFAULT_THROTTLE_RATES[self.scope]
+        except KeyError:
+            raise ImproperlyConfigured(f"No default throttle rate set for '{self.scope}' scope")
+
+    def get_key(self, request, view):
+        """Bucket of the request within the scope, None leaves it unthrottled"""
+        raise NotImplementedError('.get_key() must be overridden')
+
+    def get_keys(self, request, view):
+        """{bucket: tokens to take} of the request, the bucket of get_key() by default"""
+        key = self.get_key(request, view)
+        return {} if key is None else {key: 1}
+
+    def allow_request(self, request, view):
+        if self.get_rate() is None:
+            return True
+        return self.take(self.get_keys(request, view))
+
+    def take(self, keys):
+        """Takes the tokens of keys ({bucket: tokens}), whether they were all available"""
+        rate = self.get_rate()
+        if rate is None or not keys:
+            return True
+        capacity, tokens_per_second = parse_rate(rate)
+        now, store = self.timer(), get_store()
+        self.wait_seconds = max(store.consume(f'{self.scope}:{key}', capacity, tokens_per_second, now, count)
+                                for key, count in keys.items())
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ClientRateThrottle(TokenBucketThrottle):
+    scope = 'client'
+
+    def get_key(self, request, view):
+        user = request.user
+        if user is not None and user.is_authenticated:
+            return f'user:{user.pk}'
+        return f'address:{self.get_ident(request)}'
+
+
+class TopicRateThrottle(TokenBucketThrottle):
+    scope = 'topic'
+    bulk_actions = ('bulk_create', 'bulk_update', 'bulk_destroy')
+
+    def get_writes(self, request, view):
+        """
+        {topic id: messages written} of the request, None when they are written by id and their topics are only known
+        to the view once it read them
+        """
+        if request.method in SAFE_METHODS:
+            return {}
+        items = None
+        if getattr(view, 'action', None) in self.bulk_actions and isinstance(request.data, list):
+            items = request.data
+        topic_id = view.kwargs.get('topic_id')
+        if topic_id is not None:
+            return {str(topic_id): 1 if items is None else len(items)}
+        if getattr(view, 'basename', None) != 'messages':
+            return {}
+        if view.action == 'bulk_create':
+            return Counter(str(item['topic']) for item in items or ()
+                           if isinstance(item, dict) and item.get('topic') is not None)
+        if view.action in self.bulk_actions or 'pk' in view.kwargs:
+            return None
+        if isinstance(request.data, dict) and request.data.get('topic') is not None:
+            return {str(request.data['topic']): 1}
+        return {}
+
+    def get_keys(self, request, view):
+        return self.get_writes(request, view) or {}
+
+    def allow_written_messages(self, view, topic_ids):
+        """Takes a token per message written by id (topic_ids of the messages) once the view read them"""
+        if self.get_writes(view.request, view) is not None:
+            # charged by allow_request()
+            return True
+        return self.take(Counter(str(topic_id) for topic_id in topic_ids))
@@ -0,0 +1,62 @@
+"""
+Retention of message tombstones: manage.py prune_tombstones deletes the tombstones older than
+settings.CHAT_TOMBSTONE_RETENTION_DAYS, so the table does not grow with every message ever deleted.
+
+The tombstones of a topic are replaced by one marker (message id PRUNED_MESSAGE_ID, no message has it) holding the
+change_seq of the last pruned one. A changes feed token before the marker may miss deletions, the feed answers it
+with 410 and the client syncs again from 0, which lists the messages left. The marker is pruned like the others and
+folded into the next one.
+"""
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import MessageTombstone
+from .routers import get_write_database
+
+PRUNED_MESSAGE_ID = 0
+
+
+class ChangesPruned(APIException):
+    """A changes feed token from before the pruned tombstones of the topic"""
+    status_code = status.HTTP_410_GONE
+    default_detail = 'Deletions after this token were pruned, sync again from 0.'
+    default_code = 'changes_pruned'
+
+
+def get_cutoff(retention_days=None):
+    """Time before which tombstones are pruned, RETENTION_DAYS by default, None when they are kept"""
+    if retention_days is None:
+        retention_days = getattr(settings, 'CHAT_TOMBSTONE_RETENTION_DAYS', None)
+    if retention_days is None:
+        return None
+    return timezone.now() - datetime.timedelta(days=retention_days)
+
+
+def prune_tombstones(cutoff, topic_ids=None):
+    """Replaces the tombstones deleted before cutoff by the marker of their topic, returns their number"""
+    tombstones = MessageTombstone.objects.filter(deleted_at__lt=cutoff)
+    if topic_ids is not None:
+        tombstones = tombstones.filter(topic__in=topic_ids)
+    pruned = 0
+    for topic_id in tombstones.order_by('topic').values_list('topic', flat=True).distinct():
+        with transaction.atomic(using=get_write_database()):
+            old = tombstones.filter(topic=topic_id)
+            last_seq = old.aggregate(last=Max('change_seq'))['last']
+            if last_seq is None:
+                continue
+            pruned += old.exclude(message_id=PRUNED_MESSAGE_ID).count()
+            old.delete()
+            MessageTombstone.objects.create(message_id=PRUNED_MESSAGE_ID, topic_id=topic_id, change_seq=last_seq)
+    return pruned
+
+
+def check_pruned(tombstones):
+    """Raises ChangesPruned when the (change_seq, message_id) of tombstones after a changes token hold the marker"""
+    if any(message_id == PRUNED_MESSAGE_ID for _, message_id in tombstones):
+        raise ChangesPruned
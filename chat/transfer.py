@@ -0,0 +1,143 @@
+"""
+Dump files of manage.py chat_export and chat_import.
+
+A dump is a directory with topics.<format> and messages.<format>, the format is ndjson (a JSON object per line) or
+csv (with a header row). Records have the fields of TOPIC_FIELDS and MESSAGE_FIELDS, created_at in ISO 8601 with
+microseconds and offset, so ids and timestamps survive the round trip. Counters and change sequences are not
+dumped, the import rebuilds them. Topics are written in id order, messages grouped by topic in (topic, created_at,
+id) order, the order of message_topic_created_id_idx, so the import touches one topic per batch.
+
+Both commands write their position to <directory>/<command>.progress after every chunk and remove it when they
+finish, --resume continues from it.
+"""
+import csv
+import io
+import json
+import os
+import time
+
+from django.core.management.base import CommandError
+from django.utils.dateparse import parse_datetime
+
+from .renderers import NDJSONRenderer
+
+FORMATS = ('ndjson', 'csv')
+TOPIC_FIELDS = ('id', 'title', 'created_at')
+MESSAGE_FIELDS = ('id', 'topic', 'created_at', 'text')
+
+
+def dump_path(directory, name, format):
+    return os.path.join(directory, f'{name}.{format}')
+
+
+def find_format(directory):
+    """Format of the dump in directory"""
+    formats = [format for format in FORMATS if os.path.exists(dump_path(directory, 'topics', format))]
+    if len(formats) != 1:
+        raise CommandError(f'Expected one of {", ".join(f"topics.{format}" for format in FORMATS)} in {directory}')
+    return formats[0]
+
+
+def encode_records(rows, fields, format, header=False):
+    """Bytes of rows (tuples of values of fields, created_at as datetime) in format"""
+    rows = [[value.isoformat() if name == 'created_at' else value for name, value in zip(fields, row)]
+            for row in rows]
+    if format == 'ndjson':
+        return NDJSONRenderer().render([dict(zip(fields, row)) for row in rows])
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if header:
+        writer.writerow(fields)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8')
+
+
+def read_records(file, fields, format):
+    """
+    Yields (record, offset) for the records of the binary file from its current position, offset is the position
+    after the record. Records are dicts of fields, ids as int and created_at as datetime.
+    """
+    offset = file.tell()
+
+    def lines():
+        nonlocal offset
+        for line in file:
+            offset += len(line)
+            yield line.decode('utf-8')
+
+    if format == 'ndjson':
+        records = (json.loads(line) for line in lines() if line.strip())
+    else:
+        reader = csv.reader(lines())
+        if offset == 0:
+            header = tuple(next(reader, fields))
+            if header != fields:
+                raise CommandError(f'Expected columns {",".join(fields)} in {file.name}, got {",".join(header)}')
+        records = (dict(zip(fields, row)) for row in reader)
+
+    for record in records:
+        try:
+            record = {name: record[name] for name in fields}
+            for name in fields:
+                if name in ('id', 'topic'):
+                    record[name] = int(record[name])
+            created_at = parse_datetime(record['created_at'])
+        except (KeyError, TypeError, ValueError):
+            created_at = None
+        if created_at is None:
+            raise CommandError(f'Invalid record in {file.name} before byte {offset}: {record}')
+        record['created_at'] = created_at
+        yield record, offset
+
+
+class Checkpoint:
+    """JSON state of a command in <directory>/<name>.progress, replaced atomically"""
+
+    def __init__(self, directory, name):
+        self.path = os.path.join(directory, f'{name}.progress')
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def load(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(state, file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def delete(self):
+        os.remove(self.path)
+
+
+class Progress:
+    """Writes rows done and rows per second to stdout at most every interval seconds"""
+
+    def __init__(self, stdout, label, verbosity=1, interval=1.0):
+        self.stdout = stdout
+        self.label = label
+        self.verbosity = verbosity
+        self.interval = interval
+        self.rows = 0
+        self.started = self.reported = time.monotonic()
+
+    def update(self, rows):
+        self.rows += rows
+        now = time.monotonic()
+        if self.verbosity > 0 and now - self.reported >= self.interval:
+            self.reported = now
+            self.stdout.write(f'{self.label}: {self.rows} rows, {self.rate(now):.0f} rows/s')
+
+    def finish(self, verb):
+        now = time.monotonic()
+        if self.verbosity > 0:
+            self.stdout.write(f'{verb} {self.rows} {self.label} in {now - self.started:.1f}s '
+                              f'({self.rate(now):.0f} rows/s)')
+
+    def rate(self, now):
+        return self.rows / max(now - self.started, 1e-9)
@@ -1,23 +1,706 @@
+import hashlib
+import heapq
+import logging
+from contextlib import nullcontext
+from functools import partial
+from itertools import islice
+from operator import attrgetter
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DatabaseError, connection, router, transaction
+from django.db.models import Count, Max, Sum
+from django.http import Http404, StreamingHttpResponse
+from django.utils.http import parse_etags, quote_etag
 from rest_framework import viewsets
+from rest_framework.decorators import action, api_view
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.response import Response
 from rest_framework.generics import get_object_or_404
 from rest_framework import status
+from rest_framework.settings import api_settings
+from . import archive
+from . import ingest
 from . import models
 from . import serializers
+from . import sharding
+from .broadcast import publish_message_event
+from .async_views import AsyncViewSetMixin, iterate_in_thread
+from .cache import TOPICS_SCOPE, TOPICS_WITH_MESSAGES_SCOPE, get_response_cache, topic_scope
+from .metrics import SerializerTimingMixin, is_allowed_address
+from .pagination import SearchCursorPagination
+from .renderers import FastJSONRenderer, NDJSONRenderer
+from .routers import current_shard, reads_from_replica, set_shard, use_shard
+from .search import get_search, split_terms
+from .tombstones import PRUNED_MESSAGE_ID, check_pruned
+
+logger = logging.getLogger(__name__)
+
+
+class CachedReadMixin:
+    """
+    Serves list and retrieve with strong ETags and from the response cache (see chat.cache).
+
+    ETags are derived from version counters (Topic.change_seq, Message.change_seq) read with one small query, never
+    from the rendered body, so a request with a matching If-None-Match gets 304 before any message row is loaded.
+    Cached responses keep the ETag they were served with, a cache hit answers both cases without a query.
+    Responses are cached under the scope and the full URL, so every page cursor is cached separately.
+    """
+    cached_headers = ('Link', 'ETag')
+
+    def get_cache_scope(self):
+        """Scope of the response cache for the current read, None disables caching (ETags are still served)"""
+        return None
+
+    def get_read_version(self):
+        """Version of what the current read returns, None when the object does not exist"""
+        raise NotImplementedError
+
+    async def aget_read_version(self):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(partial(super().list, request, *args, **kwargs))
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(partial(super().retrieve, request, *args, **kwargs))
+
+    async def alist(self, request, *args, **kwargs):
+        return await self.acached_response(partial(super().alist, request, *args, **kwargs))
+
+    async def aretrieve(self, request, *args, **kwargs):
+        return await self.acached_response(partial(super().aretrieve, request, *args, **kwargs))
+
+    def cached_response(self, build):
+        response_cache, key = self._get_cache_key()
+        response = self._get_cached_response(response_cache, key)
+        if response is not None:
+            return response
+
+        # the version is read before the response, a write in between can only make the ETag older than the body
+        etag = self.make_etag(self.get_read_version())
+        if self._etag_matches(etag):
+            return self._not_modified(etag)
+        return self._store_response(build(), response_cache, key, etag)
+
+    async def acached_response(self, build):
+        response_cache, key = self._get_cache_key()
+        response = self._get_cached_response(response_cache, key)
+        if response is not None:
+            return response
+
+        etag = self.make_etag(await self.aget_read_version())
+        if self._etag_matches(etag):
+            return self._not_modified(etag)
+        return self._store_response(await build(), response_cache, key, etag)
+
+    def make_etag(self, version):
+        if version is None:
+            return None
+        name = f'{self.action}:{version}:{self._get_representation_name()}'
+        return quote_etag(hashlib.sha1(name.encode('utf-8')).hexdigest())
+
+    def _get_cache_key(self):
+        scope = self.get_cache_scope()
+        response_cache = get_response_cache() if scope is not None else None
+        # a request inside a transaction may see uncommitted rows, it must neither read nor fill the shared cache
+        if response_cache is None or connection.in_atomic_block:
+            return None, None
+        return response_cache, response_cache.make_key(scope, f'{self.action}:{self._get_representation_name()}')
+
+    def _get_cached_response(self, response_cache, key):
+        cached = response_cache.get(key) if response_cache is not None else None
+        if cached is None:
+            return None
+        data, headers = cached
+        if self._etag_matches(headers.get('ETag')):
+            return self._not_modified(headers['ETag'])
+        return Response(data, headers=headers)
+
+    def _store_response(self, response, response_cache, key, etag):
+        if response.status_code == status.HTTP_200_OK:
+            if etag is not None:
+                response['ETag'] = etag
+            # a lagging replica could return what the current generation replaced
+            if response_cache is not None and not reads_from_replica():
+                headers = {name: response[name] for name in self.cached_headers if response.has_header(name)}
+                response_cache.set(key, (response.data, headers))
+        return response
+
+    def _get_representation_name(self):
+        # every page and every media type (JSON, browsable API) is a different representation
+        request = self.request
+        return f'{request.accepted_media_type}:{request.get_host()}{request.get_full_path()}'
+
+    def _etag_matches(self, etag):
+        if etag is None:
+            return False
+        if_none_match = parse_etags(self.request.META.get('HTTP_IF_NONE_MATCH', ''))
+        return etag in if_none_match or '*' in if_none_match
+
+    @staticmethod
+    def _not_modified(etag):
+        return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+
+class ValuesReadMixin:
+    """
+    JSON list and retrieve read rows with values_list() and serialize them with values_serializer_class (see
+    serializers.ValuesSerializer), no model instance is built. The browsable API keeps model instances, its
+    forms are filled from them.
+    """
+    values_serializer_class = None
+    values_actions = ('list', 'retrieve')
+
+    def use_values(self):
+        renderer = getattr(self.request, 'accepted_renderer', None)
+        return self.action in self.values_actions and renderer is not None and renderer.format == 'json'
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.use_values():
+            return self.values_serializer_class.values_list(queryset)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.use_values():
+            return self.values_serializer_class
+        return super().get_serializer_class()
+
+
+# Version of all topics (and so of all messages) in the database, changes on any topic or message write. Topic ids
+# are never reused and every topic's change_seq only grows, so equal (count, max id, sum of change_seq) means nothing
+# was created, deleted or changed in between.
+TOPICS_VERSION = {'count': Count('id'), 'max_id': Max('id'), 'seqs': Sum('change_seq')}
+TOPICS_VERSION_FORMAT = '{count}-{max_id}-{seqs}'
+
+
+def topics_version():
+    """
+    Version of all topics (and so of all messages), changes on any topic or message write. With a response cache it
+    is the generation of the scope every write invalidates and costs no query, without one it is read from the
+    topics.
+    """
+    generation = topics_generation()
+    if generation is not None:
+        return generation
+    if sharding.is_sharded():
+        return merge_topics_versions([models.Topic.objects.using(alias).aggregate(**TOPICS_VERSION)
+                                      for alias in sharding.get_shards()])
+    return TOPICS_VERSION_FORMAT.format(**models.Topic.objects.aggregate(**TOPICS_VERSION))
+
+
+async def atopics_version():
+    generation = topics_generation()
+    if generation is not None:
+        return generation
+    if sharding.is_sharded():
+        return merge_topics_versions([await models.Topic.objects.using(alias).aaggregate(**TOPICS_VERSION)
+                                      for alias in sharding.get_shards()])
+    return TOPICS_VERSION_FORMAT.format(**await models.Topic.objects.aaggregate(**TOPICS_VERSION))
+
+
+def topics_generation():
+    """Generation of TOPICS_WITH_MESSAGES_SCOPE, None when it may not match what the request reads"""
+    response_cache = get_response_cache()
+    # generations are bumped after commit, a transaction sees its own writes before and a replica may see them after
+    if response_cache is None or connection.in_atomic_block or reads_from_replica():
+        return None
+    return f'generation-{response_cache.get_generation(TOPICS_WITH_MESSAGES_SCOPE)}'
+
+
+def merge_topics_versions(versions):
+    """Version of the topics of all shards from their TOPICS_VERSION aggregates"""
+    return TOPICS_VERSION_FORMAT.format(count=sum(version['count'] for version in versions),
+                                        max_id=max(version['max_id'] or 0 for version in versions),
+                                        seqs=sum(version['seqs'] or 0 for version in versions))
+
+
+def topic_version_query(topic_id):
+    return models.Topic.objects.filter(id=topic_id).values_list('change_seq', flat=True)
+
+
+def message_version_query(queryset):
+    return queryset.values_list('change_seq', flat=True)
+
+
+class MessageBroadcastMixin:
+    """
+    Pushes created, updated and deleted messages to WebSocket subscribers of the topic (see chat.websocket)
+    """
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        publish_message_event('created', serializer.data)
+
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        publish_message_event('updated', serializer.data)
+
+    def perform_destroy(self, instance):
+        deleted = {'id': instance.id, 'topic': instance.topic_id}
+        super().perform_destroy(instance)
+        publish_message_event('deleted', deleted)
+
+
+class MessageIngestMixin:
+    """
+    Creates messages through the group commit writer when settings.CHAT_INGEST is set (see chat.ingest): the message
+    is validated and built in the request, inserted in a batch with others and answered once committed.
+    """
+
+    def perform_create(self, serializer):
+        if not ingest.is_enabled():
+            return super().perform_create(serializer)
+        serializer.instance = ingest.ingest(models.Message(**serializer.validated_data),
+                                            using=router.db_for_write(models.Message))
+
+    async def aperform_create(self, serializer):
+        if not ingest.is_enabled():
+            return await super().aperform_create(serializer)
+        # waiting for the writer needs no database connection, so requests wait in threads of their own instead of
+        # one after another in the thread sync_to_async runs sync code in
+        await sync_to_async(self.perform_create, thread_sensitive=False)(serializer)
+
+
+class MessageSearchMixin:
+    """
+    Full-text search on .../search/?q=, messages matching every word of q, most relevant first (see chat.search).
+
+    Results are paginated with ?page_size= and ?after=, the next page is linked in the Link header.
+    """
+    search_pagination_class = SearchCursorPagination
+
+    def get_search_topic_id(self):
+        return None
+
+    @action(detail=False, methods=['get'], url_path='search', url_name='search')
+    def search(self, request, *args, **kwargs):
+        query = request.query_params.get('q', '')
+        if not split_terms(query):
+            raise ValidationError({'q': ['Enter at least one word to search for.']})
+
+        paginator = self.search_pagination_class()
+        search = get_search()
+        if sharding.is_sharded() and current_shard() is None:
+            search = sharding.ShardedSearch(search, sharding.get_shards())
+        page = paginator.paginate_search(search, query, request, topic_id=self.get_search_topic_id())
+        message_ids = [message_id for _, message_id in page]
+        if sharding.is_sharded() and current_shard() is None:
+            messages = sharding.in_bulk(models.Message, message_ids)
+        else:
+            messages = models.Message.objects.in_bulk(message_ids)
+        # a message deleted after the index was read is skipped
+        serializer = self.get_serializer([messages[message_id] for _, message_id in page if message_id in messages],
+                                         many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+
+class TopicThrottleMixin:
+    """
+    Topic throttles (see chat.throttling.TopicRateThrottle) of messages written by id without the topic in the URL,
+    their topics are known once the view read the messages
+    """
+
+    def check_written_messages(self, topic_ids):
+        """Answers 429 unless the topic buckets have a token per message, topic_ids of the messages written"""
+        for throttle in self.get_throttles():
+            if hasattr(throttle, 'allow_written_messages') and not throttle.allow_written_messages(self, topic_ids):
+                self.throttled(self.request, throttle.wait())
+
+
+class MessageBulkMixin:
+    """
+    Batch writes on .../bulk/: POST a list of messages, PATCH a list of messages with ids, DELETE a list of ids.
+
+    A batch is validated first and written in one transaction with bulk_create/bulk_update, so either every item
+    is written or none. If any item is invalid, 400 with a list of errors aligned with the input ({} for valid
+    items) is returned.
+    """
+    bulk_max_items = 5000
+
+    def get_bulk_queryset(self):
+        return models.Message.objects.all()
+
+    def prepare_bulk_item(self, item):
+        return item
+
+    @action(detail=False, methods=['post'], url_path='bulk', url_name='bulk')
+    def bulk_create(self, request, *args, **kwargs):
+        items = [self.prepare_bulk_item(item) for item in self.get_bulk_items(request)]
+
+        serializer = self.get_serializer(data=items, many=True, context=self.get_bulk_serializer_context(items))
+        serializer.is_valid(raise_exception=True)
+        with transaction.atomic(using=router.db_for_write(models.Message)):
+            serializer.save()
+            for data in serializer.data:
+                publish_message_event('created', data)
+
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @bulk_create.mapping.patch
+    def bulk_update(self, request, *args, **kwargs):
+        items = [self.prepare_bulk_item(item) for item in self.get_bulk_items(request)]
+        ids = [self._get_item_id(item.get('id') if isinstance(item, dict) else None) for item in items]
+        instances = self.get_bulk_queryset().in_bulk([id for id in ids if id is not None])
+        self.check_written_messages([instance.topic_id for instance in instances.values()])
+        context = self.get_bulk_serializer_context(items)
+
+        errors, item_serializers, seen = [], [], set()
+        for id, item in zip(ids, items):
+            if id is None or id not in instances:
+                errors.append({'id': ['Not found.']})
+            elif id in seen:
+                errors.append({'id': ['Duplicate id.']})
+            else:
+                seen.add(id)
+                serializer = self.get_serializer(instances[id], data=item, partial=True, context=context)
+                if serializer.is_valid():
+                    errors.append({})
+                    item_serializers.append(serializer)
+                else:
+                    errors.append(serializer.errors)
+        if any(errors):
+            raise ValidationError(errors)
+
+        fields = set()
+        for serializer in item_serializers:
+            for attr, value in serializer.validated_data.items():
+                setattr(serializer.instance, attr, value)
+                fields.add(attr)
+        fields.discard('topic')
+
+        with transaction.atomic(using=router.db_for_write(models.Message)):
+            models.Message.objects.bulk_update_messages([serializer.instance for serializer in item_serializers],
+                                                        fields)
+            for serializer in item_serializers:
+                publish_message_event('updated', serializer.data)
+
+        return Response([serializer.data for serializer in item_serializers])
+
+    @bulk_create.mapping.delete
+    def bulk_destroy(self, request, *args, **kwargs):
+        items = self.get_bulk_items(request)
+        ids = [self._get_item_id(item) for item in items]
+        queryset = self.get_bulk_queryset().filter(id__in=[id for id in ids if id is not None])
+        existing = dict(queryset.values_list('id', 'topic'))
+        self.check_written_messages(existing.values())
+
+        errors = [{} if id in existing else {'id': ['Not found.']} for id in ids]
+        if any(errors):
+            raise ValidationError(errors)
 
+        with transaction.atomic(using=router.db_for_write(models.Message)):
+            for message_id, topic_id in queryset.delete_leaving_tombstones():
+                publish_message_event('deleted', {'id': message_id, 'topic': topic_id})
 
-class TopicViewSet(viewsets.ModelViewSet):
-    queryset = models.Topic.objects.all()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def get_bulk_items(self, request):
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                f'Expected a list of items but got type "{type(items).__name__}".']})
+        if len(items) > self.bulk_max_items:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                f'Ensure this list has no more than {self.bulk_max_items} items.']})
+        return items
+
+    async def aget_create_context(self, data):
+        """Loads the topic of the message with the async ORM, see serializers.TopicPrimaryKeyField"""
+        context = self.get_serializer_context()
+        topic_id = self._get_item_id(data.get('topic'))
+        context['topics'] = {topic.id: topic async for topic in models.Topic.objects.filter(id=topic_id)}
+        return context
+
+    def get_bulk_serializer_context(self, items):
+        """Loads topics of the whole batch at once, see serializers.TopicPrimaryKeyField"""
+        context = self.get_serializer_context()
+        topic_ids = {self._get_item_id(item.get('topic')) for item in items if isinstance(item, dict)}
+        context['topics'] = models.Topic.objects.in_bulk([id for id in topic_ids if id is not None])
+        return context
+
+    @staticmethod
+    def _get_item_id(value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return None
+
+
+class ArchiveReadMixin:
+    """
+    Reads archived messages along with the others when old messages are archived (see chat.archive): pages of the
+    lists merge the archived messages of the page, retrieve falls back to the archive. Archived messages are
+    read-only, writes of them answer 409. Requests are served by the sync views, archive reads are file reads.
+    """
+
+    @classmethod
+    def runs_sync(cls, request):
+        return archive.is_enabled() or super().runs_sync(request)
+
+    def paginate_queryset(self, queryset):
+        if self.paginator is None or self.action != 'list' or not archive.is_enabled():
+            return super().paginate_queryset(queryset)
+        shards = sharding.get_shards() if sharding.is_sharded() and current_shard() is None else None
+        readers = [partial(self.read_archive_page, shard=shard) for shard in shards or [None]]
+        return self.paginator.paginate_queryset_across(queryset, self.request, shards, readers)
+
+    def read_archive_page(self, after, before, limit, shard=None):
+        with use_shard(shard) if shard is not None else nullcontext():
+            messages = archive.read_page(after, before, limit, topic_id=self.kwargs.get('topic_id'))
+        return self.as_rows(messages)
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            return self.get_archived_object()
+
+    def get_archived_object(self):
+        """The archived message of the URL, Http404 when there is none"""
+        message_id = self.kwargs.get('msg_id', self.kwargs.get('pk'))
+        message = archive.get_message(message_id, self.kwargs.get('topic_id')) if archive.is_enabled() else None
+        if message is None:
+            raise Http404
+        if self.action != 'retrieve':
+            raise archive.MessageArchived()
+        self.check_object_permissions(self.request, message)
+        return self.as_rows([message])[0]
+
+    def as_rows(self, messages):
+        """messages as the reads of the action return them, values rows or instances (see ValuesReadMixin)"""
+        return self.values_serializer_class.rows_of(messages) if self.use_values() else messages
+
+
+class ShardRoutingMixin:
+    """
+    Runs the queries of a request in the shard of its topic when topics are sharded (see chat.sharding).
+
+    get_request_shard() names the shard once the request is parsed, None for actions reading every shard (lists
+    and search merge the pages of all shards). A write of a topic that moved to another shard meanwhile answers
+    503 with Retry-After. Sharded requests are served by the sync views.
+    """
+
+    def get_request_shard(self):
+        return None
+
+    @classmethod
+    def runs_sync(cls, request):
+        return sharding.is_sharded() or super().runs_sync(request)
+
+    def dispatch(self, request, *args, **kwargs):
+        if not sharding.is_sharded():
+            return super().dispatch(request, *args, **kwargs)
+        with use_shard(None):
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if sharding.is_sharded():
+            set_shard(self.get_request_shard())
+
+    def paginate_queryset(self, queryset):
+        if self.paginator is not None and sharding.is_sharded() and current_shard() is None:
+            return self.paginator.paginate_queryset_across(queryset, self.request, sharding.get_shards())
+        return super().paginate_queryset(queryset)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, models.Topic.DoesNotExist) and sharding.is_sharded():
+            exc = sharding.TopicMoved()
+        return super().handle_exception(exc)
+
+    def get_single_shard(self, shards):
+        """The shard of a batch, ValidationError when it spans several"""
+        if len(shards) > 1:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                'Items of a batch must belong to topics of one shard.']})
+        return next(iter(shards), None) or sharding.get_shards()[0]
+
+
+class LatestMessagesMixin:
+    """
+    ?include=latest_messages adds the n latest messages (3 by default, ?n= up to max_latest_messages) of every topic
+    to list and retrieve, in message order. They are read for the whole page with one query, one per shard when the
+    topics are sharded (see MessageQuerySet.latest_of_topics). Archived messages are not included. Requests with
+    include are served by the sync views.
+    """
+    includes = ('latest_messages',)
+    default_latest_messages = 3
+    max_latest_messages = 20
+
+    @classmethod
+    def runs_sync(cls, request):
+        return 'include' in request.GET or super().runs_sync(request)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.latest_messages_number = (self.get_latest_messages_number(request)
+                                       if self.action in ('list', 'retrieve') else None)
+
+    def get_latest_messages_number(self, request):
+        """n of the request, None without include=latest_messages"""
+        includes = [name for name in request.query_params.get('include', '').split(',') if name]
+        unknown = [name for name in includes if name not in self.includes]
+        if unknown:
+            raise ValidationError({'include': [f'Unknown include {name!r}.' for name in unknown]})
+        if 'latest_messages' not in includes:
+            return None
+        try:
+            number = int(request.query_params.get('n', self.default_latest_messages))
+        except ValueError:
+            raise ValidationError({'n': ['A valid integer is required.']})
+        if not 1 <= number <= self.max_latest_messages:
+            raise ValidationError({'n': [f'Ensure this value is between 1 and {self.max_latest_messages}.']})
+        return number
+
+    def get_serializer(self, *args, **kwargs):
+        number = getattr(self, 'latest_messages_number', None)
+        if number and args:
+            topics = args[0] if kwargs.get('many') else [args[0]]
+            kwargs['context'] = dict(self.get_serializer_context(),
+                                     latest_messages=self.read_latest_messages([topic.id for topic in topics], number))
+        return super().get_serializer(*args, **kwargs)
+
+    def read_latest_messages(self, topic_ids, number):
+        """{topic id: [message data]} of the number latest messages of the topics"""
+        latest_messages = {topic_id: [] for topic_id in topic_ids}
+        if not topic_ids:
+            return latest_messages
+        shards = sharding.get_shards() if sharding.is_sharded() and current_shard() is None else [None]
+        values_serializer_class = serializers.MessageValuesSerializer
+        for shard in shards:
+            with use_shard(shard) if shard is not None else nullcontext():
+                rows = list(values_serializer_class.values_list(
+                    models.Message.objects.latest_of_topics(topic_ids, number)))
+            for message in values_serializer_class(rows, many=True).data:
+                latest_messages[message['topic']].append(message)
+        return latest_messages
+
+
+class TopicViewSet(CachedReadMixin, ValuesReadMixin, LatestMessagesMixin, SerializerTimingMixin, ShardRoutingMixin,
+                   AsyncViewSetMixin, viewsets.ModelViewSet):
+    queryset = models.Topic.objects.order_by('created_at', 'id')
     serializer_class = serializers.TopicSerializer
+    values_serializer_class = serializers.TopicValuesSerializer
+    # ids only, anything else is a 404 before the version query
+    lookup_value_regex = r'[0-9]+'
+
+    def get_cache_scope(self):
+        if self.action != 'list':
+            return topic_scope(self.kwargs['pk'])
+        # message edits leave the plain list alone, not the messages embedded in it
+        return TOPICS_WITH_MESSAGES_SCOPE if self.latest_messages_number else TOPICS_SCOPE
+
+    def get_read_version(self):
+        if self.action == 'list':
+            return topics_version()
+        return topic_version_query(self.kwargs['pk']).first()
+
+    async def aget_read_version(self):
+        if self.action == 'list':
+            return await atopics_version()
+        return await topic_version_query(self.kwargs['pk']).afirst()
 
+    def get_request_shard(self):
+        if 'pk' in self.kwargs:
+            return sharding.shard_of_topic(self.kwargs['pk'])
+        return None
 
-class MessageViewSet(viewsets.ModelViewSet):
-    queryset = models.Message.objects.all()
+    def perform_create(self, serializer):
+        if not sharding.is_sharded():
+            return super().perform_create(serializer)
+        topic_id, shard = sharding.create_topic_entry()
+        with use_shard(shard):
+            serializer.save(id=topic_id)
+
+    def perform_destroy(self, instance):
+        topic_id = instance.id
+        super().perform_destroy(instance)
+        if sharding.is_sharded():
+            models.TopicShard.objects.filter(topic_id=topic_id).delete()
+        if archive.is_enabled():
+            transaction.on_commit(partial(archive.delete_topic_files, topic_id),
+                                  using=router.db_for_write(models.Topic))
+
+
+class MessageViewSet(CachedReadMixin, ValuesReadMixin, MessageSearchMixin, TopicThrottleMixin, MessageBulkMixin,
+                     MessageBroadcastMixin, MessageIngestMixin, SerializerTimingMixin, ArchiveReadMixin,
+                     ShardRoutingMixin, AsyncViewSetMixin, viewsets.ModelViewSet):
+    queryset = models.Message.objects.order_by('created_at', 'id')
     serializer_class = serializers.MessageSerializer
+    values_serializer_class = serializers.MessageValuesSerializer
+    lookup_value_regex = r'[0-9]+'
+
+    # messages of all topics are not cached, every write would invalidate them
 
+    def get_read_version(self):
+        if self.action == 'list':
+            return topics_version()
+        return message_version_query(models.Message.objects.filter(id=self.kwargs['pk'])).first()
 
-class MessageFromTopicViewSet(viewsets.ModelViewSet):
+    async def aget_read_version(self):
+        if self.action == 'list':
+            return await atopics_version()
+        return await message_version_query(models.Message.objects.filter(id=self.kwargs['pk'])).afirst()
+
+    def get_object(self):
+        obj = super().get_object()
+        if self.request.method not in SAFE_METHODS:
+            self.check_written_messages([obj.topic_id])
+        return obj
+
+    def get_request_shard(self):
+        if 'pk' in self.kwargs:
+            ids = [self.kwargs['pk']]
+            return self.get_single_shard(sharding.shards_with(models.Message, ids) or
+                                         sharding.shards_with(models.ArchivedMessage, ids))
+        if self.action == 'create':
+            # anything but an object is left to the serializer, which answers 400
+            data = self.request.data if isinstance(self.request.data, dict) else {}
+            topic_id = self._get_item_id(data.get('topic'))
+            return sharding.shard_of_topic(topic_id) if topic_id is not None else sharding.get_shards()[0]
+        if self.action == 'bulk_create':
+            items = self.request.data if isinstance(self.request.data, list) else []
+            topic_ids = {self._get_item_id(item.get('topic')) for item in items if isinstance(item, dict)}
+            return self.get_single_shard(sharding.shards_of_topics([id for id in topic_ids if id is not None]))
+        if self.action in ('bulk_update', 'bulk_destroy'):
+            items = self.request.data if isinstance(self.request.data, list) else []
+            ids = [self._get_item_id(item.get('id') if isinstance(item, dict) else item) for item in items]
+            return self.get_single_shard(sharding.shards_with(models.Message, [id for id in ids if id is not None]))
+        return None
+
+
+class MessageFromTopicViewSet(CachedReadMixin, ValuesReadMixin, MessageSearchMixin, TopicThrottleMixin,
+                              MessageBulkMixin, MessageBroadcastMixin, MessageIngestMixin, SerializerTimingMixin,
+                              ArchiveReadMixin, ShardRoutingMixin, AsyncViewSetMixin, viewsets.ModelViewSet):
     serializer_class = serializers.MessageSerializer
+    values_serializer_class = serializers.MessageValuesSerializer
+    changes_limit = 100
+    changes_max_limit = 1000
+    export_renderer_classes = (FastJSONRenderer, NDJSONRenderer)
+    export_chunk_size = 2000
+
+    def get_queryset(self):
+        messages = models.Message.objects.filter(topic=self.kwargs['topic_id'])
+        if 'msg_id' in self.kwargs:
+            return messages.filter(id=self.kwargs['msg_id'])
+        # ordering matches message_topic_created_id_idx, so the listing is served straight from the index
+        return messages.order_by('created_at', 'id')
+
+    def get_cache_scope(self):
+        return topic_scope(self.kwargs['topic_id']) if self.action == 'list' else None
+
+    def get_read_version(self):
+        if self.action == 'list':
+            return topic_version_query(self.kwargs['topic_id']).first()
+        return message_version_query(self.get_queryset()).first()
+
+    async def aget_read_version(self):
+        if self.action == 'list':
+            return await topic_version_query(self.kwargs['topic_id']).afirst()
+        return await message_version_query(self.get_queryset()).afirst()
 
     def get_object(self):
         """
@@ -27,36 +710,62 @@ class MessageFromTopicViewSet(viewsets.ModelViewSet):
         """
         queryset = self.filter_queryset(self.get_queryset())
 
-        obj = get_object_or_404(queryset)
+        try:
+            obj = get_object_or_404(queryset)
+        except Http404:
+            return self.get_archived_object()
 
         # May raise a permission denied
         self.check_object_permissions(self.request, obj)
 
         return obj
 
-    def list(self, request, *args, **kwargs):
-        self.queryset = models.Message.objects.filter(topic=kwargs['topic_id'])
-        return super().list(request, *args, **kwargs)
+    async def aget_object(self):
+        # like get_object(), the queryset is already filtered by the ids from the URL
+        obj = await self._aget_or_404(self.filter_queryset(self.get_queryset()))
+        self.check_object_permissions(self.request, obj)
+        return obj
 
-    def retrieve(self, request, *args, **kwargs):
-        self.queryset = models.Message.objects.filter(topic=kwargs['topic_id'], id=kwargs['msg_id'])
-        return super().retrieve(request, *args, **kwargs)
+    def get_bulk_queryset(self):
+        return models.Message.objects.filter(topic=self.kwargs['topic_id'])
 
-    def create(self, request, *args, **kwargs):
-        data = request.data.dict()
-        data['topic'] = kwargs['topic_id']
+    def get_request_shard(self):
+        return sharding.shard_of_topic(self.kwargs['topic_id'])
+
+    def get_search_topic_id(self):
+        return get_object_or_404(models.Topic.objects.only('id'), id=self.kwargs['topic_id']).id
+
+    def prepare_bulk_item(self, item):
+        # like in create() and update(), the topic is taken from the URL
+        if isinstance(item, dict):
+            item = dict(item, topic=self.kwargs['topic_id'])
+        return item
+
+    def get_create_data(self, request):
+        # the topic is always taken from the URL
+        return self.with_url_topic(request.data)
+
+    def with_url_topic(self, data):
+        """A copy of the request data (form or JSON) with the topic of the URL, anything but an object as it is"""
+        if hasattr(data, 'dict'):
+            data = data.dict()
+        elif isinstance(data, dict):
+            data = dict(data)
+        else:
+            # the serializer answers 400
+            return data
+        data['topic'] = self.kwargs['topic_id']
+        return data
 
-        serializer = self.get_serializer(data=data)
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=self.get_create_data(request))
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
 
     def update(self, request, *args, **kwargs):
-        self.queryset = models.Message.objects.filter(topic=kwargs['topic_id'], id=kwargs['msg_id'])
-
-        data = request.data.dict()
-        data['topic'] = kwargs['topic_id']
+        data = self.with_url_topic(request.data)
 
         partial = kwargs.pop('partial', False)
         instance = self.get_object()
@@ -71,6 +780,106 @@ class MessageFromTopicViewSet(viewsets.ModelViewSet):
 
         return Response(serializer.data)
 
-    def destroy(self, request, *args, **kwargs):
-        self.queryset = models.Message.objects.filter(topic=kwargs['topic_id'], id=kwargs['msg_id'])
-        return super().destroy(self, request, *args, **kwargs)
\ No newline at end of file
+    def changes(self, request, *args, **kwargs):
+        """
+        Messages created, updated or deleted in the topic after the `since` token.
+
+        Returns {"messages": [...], "deleted": [ids], "token": "...", "has_more": bool}. Clients upsert messages,
+        drop deleted ids and send the token back as `since` in the next call, until has_more is false. A token from
+        before pruned tombstones (see chat.tombstones) is answered 410, the client syncs again from 0.
+        """
+        topic = get_object_or_404(models.Topic.objects.only('id'), id=kwargs['topic_id'])
+        since = self._get_int_param(request, 'since', 0, 'Invalid token')
+        limit = min(self._get_int_param(request, 'limit', self.changes_limit, 'Invalid limit') or self.changes_limit,
+                    self.changes_max_limit)
+
+        messages = models.Message.objects.filter(topic=topic, change_seq__gt=since).order_by('change_seq')
+        tombstones = models.MessageTombstone.objects.filter(topic=topic, change_seq__gt=since).order_by('change_seq')
+        if not since:
+            # a sync from 0 lists the messages left, deletions before do not matter
+            tombstones = tombstones.exclude(message_id=PRUNED_MESSAGE_ID)
+        deleted = list(tombstones.values_list('change_seq', 'message_id')[:limit + 1])
+        # the marker comes before the tombstones left, which were deleted after those pruned
+        check_pruned(deleted)
+        changes = sorted([(msg.change_seq, msg) for msg in messages[:limit + 1]] + deleted,
+                         key=lambda change: change[0])
+
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+        token = changes[-1][0] if changes else since
+
+        return Response({
+            'messages': self.get_serializer([obj for _, obj in changes if isinstance(obj, models.Message)],
+                                            many=True).data,
+            'deleted': [obj for _, obj in changes if not isinstance(obj, models.Message)],
+            'token': str(token),
+            'has_more': has_more,
+        })
+
+    def export(self, request, *args, **kwargs):
+        """
+        All messages of the topic, oldest first, streamed as a JSON array or as NDJSON (Accept: application/x-ndjson
+        or ?format=ndjson).
+
+        Rows are read with a server-side cursor (iterator()) and rendered export_chunk_size at a time, so memory
+        does not grow with the topic, under ASGI too (see async_views.iterate_in_thread). The JSON array is the body
+        the unpaginated list would have.
+        """
+        topic = get_object_or_404(models.Topic.objects.only('id'), id=kwargs['topic_id'])
+        # the rows are read after the request returned, from the database it was routed to
+        messages = models.Message.objects.filter(topic=topic).order_by('created_at', 'id')
+        messages = messages.using(router.db_for_read(models.Message))
+        rows = self.values_serializer_class.values_list(messages).iterator(chunk_size=self.export_chunk_size)
+        if archive.is_enabled():
+            archived = archive.iter_topic(topic.id, using=router.db_for_read(models.ArchiveBlock))
+            rows = heapq.merge(rows, (self.values_serializer_class.rows_of([message])[0] for message in archived),
+                               key=attrgetter('created_at', 'id'))
+        renderer = request.accepted_renderer
+        stream = renderer.render_stream(self._iter_export_chunks(rows))
+        if isinstance(request._request, ASGIRequest):
+            stream = iterate_in_thread(stream)
+        return StreamingHttpResponse(stream, content_type=renderer.media_type)
+
+    def _iter_export_chunks(self, rows):
+        while chunk := list(islice(rows, self.export_chunk_size)):
+            yield self.values_serializer_class(chunk, many=True).data
+
+    def get_renderers(self):
+        if self.action == 'export':
+            return [renderer() for renderer in self.export_renderer_classes]
+        return super().get_renderers()
+
+    @staticmethod
+    def _get_int_param(request, name, default, error):
+        value = request.query_params.get(name)
+        if value is None:
+            return default
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValidationError({name: [error]})
+        if value < 0:
+            raise ValidationError({name: [error]})
+        return value
+
+
+@api_view(['GET'])
+def health(request):
+    """200 when the database answers, 503 otherwise, for load balancers and orchestrators"""
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+    except DatabaseError:
+        # the error may name hosts or users, it goes to the log and not to whoever asks
+        logger.exception('Health check of the database failed')
+        return Response({'database': 'unavailable'}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return Response({'database': 'ok'})
+
+
+@api_view(['GET'])
+def response_cache_stats(request):
+    """Hits, misses and evictions of the response cache in this process, for the addresses allowed to see metrics"""
+    if not is_allowed_address(request):
+        raise PermissionDenied()
+    response_cache = get_response_cache()
+    return Response(response_cache.stats() if response_cache is not None else {})
@@ -0,0 +1,63 @@
+"""
+ASGI WebSocket endpoint streaming message events of one topic: /ws/topics/<topic_id>/messages/
+
+Every frame is a JSON object {"event": "created"|"updated"|"deleted", "message": {...}}. Messages sent by the
+client are ignored. Close codes: 4404 unknown topic or path, 1013 the client was too slow and has to resync.
+"""
+import asyncio
+import re
+
+from asgiref.sync import sync_to_async
+
+from .broadcast import OVERFLOW, get_broadcast, topic_channel
+from .models import Topic
+
+TOPIC_MESSAGES_PATH = re.compile(r'^/ws/topics/(?P<topic_id>\d+)/messages/$')
+
+CLOSE_NOT_FOUND = 4404
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+@sync_to_async
+def topic_exists(topic_id):
+    return Topic.objects.filter(id=topic_id).exists()
+
+
+async def topic_messages_socket(scope, receive, send):
+    event = await receive()
+    if event['type'] != 'websocket.connect':
+        return
+
+    match = TOPIC_MESSAGES_PATH.match(scope['path'])
+    if match is None or not await topic_exists(int(match['topic_id'])):
+        await send({'type': 'websocket.close', 'code': CLOSE_NOT_FOUND})
+        return
+
+    subscription = get_broadcast().subscribe(topic_channel(int(match['topic_id'])))
+    await send({'type': 'websocket.accept'})
+
+    # frames are pushed by a separate task awaiting only the queue, client events are rare and waited for here
+    sender = asyncio.ensure_future(send_events(subscription, send))
+    receiver = asyncio.ensure_future(receive())
+    try:
+        while True:
+            done, _ = await asyncio.wait({receiver, sender}, return_when=asyncio.FIRST_COMPLETED)
+            if sender in done:
+                sender.result()
+                return
+            if receiver.result()['type'] == 'websocket.disconnect':
+                return
+            receiver = asyncio.ensure_future(receive())
+    finally:
+        receiver.cancel()
+        sender.cancel()
+        subscription.close()
+
+
+async def send_events(subscription, send):
+    while True:
+        text = await subscription.get()
+        if text is OVERFLOW:
+            await send({'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN_LATER})
+            return
+        await send({'type': 'websocket.send', 'text': text})
@@ -2,6 +2,9 @@
 ASGI config for chatting project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP requests go to Django, WebSocket connections to chat.websocket. HTTP requests are routed by
+chatting.urls like under WSGI, or by chatting.urls_async when settings.CHAT_ASYNC_VIEWS is True: the same URLs with
+async views for reading and creating topics and messages.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
@@ -9,8 +12,32 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatting.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+
+class AsyncURLConfHandler(ASGIHandler):
+    urlconf = 'chatting.urls_async'
+
+    def create_request(self, scope, body_file):
+        request, error_response = super().create_request(scope, body_file)
+        if request is not None:
+            request.urlconf = self.urlconf
+        return request, error_response
+
+
+django_application = AsyncURLConfHandler() if getattr(settings, 'CHAT_ASYNC_VIEWS', False) else ASGIHandler()
+
+# imported after setup, chat.websocket needs the app registry
+from chat.websocket import topic_messages_socket  # noqa: E402
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        return await topic_messages_socket(scope, receive, send)
+    return await django_application(scope, receive, send)
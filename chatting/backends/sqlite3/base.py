@@ -0,0 +1,108 @@
+"""
+SQLite backend tuned for concurrent requests on one database file, ENGINE 'chatting.backends.sqlite3'.
+
+Every connection is switched to WAL, where readers never block the writer and the writer never blocks readers,
+with synchronous=NORMAL (a commit is durable at the next checkpoint, the database cannot be corrupted) and a
+memory map of mmap_size bytes. timeout (seconds) is the busy timeout, how long a statement waits for the write
+lock of another process before failing with "database is locked".
+
+Transactions (atomic blocks) start with BEGIN IMMEDIATE, taking the write lock up front: a deferred transaction
+that reads and then writes fails at once when another connection wrote in between, the busy timeout does not
+help there. With serialize_writes, transactions of a process also wait in turn for a lock per database file
+before BEGIN, so threads of one worker queue in the process instead of polling SQLite's busy handler, which
+sleeps up to 100ms between attempts. It is off by default, benchmarks.sqlite_concurrency measured fewer writes per
+second with it. A thread holding locks of other databases only waits for the lock of an alias ranked after theirs
+(shards by name, then default, the order of IdSequence and TopicShard writes in shard transactions), otherwise it
+fails with "database is locked" at once when the lock is taken, so threads never wait for each other in a cycle.
+
+OPTIONS, besides those of sqlite3.connect():
+
+    'synchronous': 'NORMAL', 'mmap_size': 268435456, 'serialize_writes': False
+"""
+import threading
+from collections import defaultdict
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError
+from django.db.backends.sqlite3 import base
+
+# database file -> lock of the writing transaction of this process
+_write_locks = defaultdict(threading.Lock)
+_write_locks_lock = threading.Lock()
+# aliases whose write lock the thread holds
+_held = threading.local()
+
+TUNING_OPTIONS = {'synchronous': 'NORMAL', 'mmap_size': 256 * 1024 * 1024, 'serialize_writes': False}
+
+
+def _lock_rank(alias):
+    return alias == DEFAULT_DB_ALIAS, alias
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._holds_write_lock = False
+
+    @property
+    def tuning(self):
+        options = self.settings_dict['OPTIONS']
+        return {name: options.get(name, default) for name, default in TUNING_OPTIONS.items()}
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        for name in TUNING_OPTIONS:
+            params.pop(name, None)
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        tuning = self.tuning
+        # in memory databases stay in their 'memory' journal mode
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute(f'PRAGMA synchronous = {tuning["synchronous"]}')
+        conn.execute(f'PRAGMA mmap_size = {int(tuning["mmap_size"])}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        if self.tuning['serialize_writes'] and not self.is_in_memory_db():
+            with _write_locks_lock:
+                lock = _write_locks[str(self.settings_dict['NAME'])]
+            held = _held.__dict__.setdefault('aliases', set())
+            if any(_lock_rank(alias) > _lock_rank(self.alias) for alias in held):
+                acquired = lock.acquire(blocking=False)
+            else:
+                acquired = lock.acquire(timeout=self.settings_dict['OPTIONS'].get('timeout', 5.0))
+            if not acquired:
+                raise OperationalError('database is locked')
+            self._holds_write_lock = True
+            held.add(self.alias)
+        try:
+            self.cursor().execute('BEGIN IMMEDIATE')
+        except Exception:
+            self._release_write_lock()
+            raise
+
+    def _commit(self):
+        try:
+            return super()._commit()
+        finally:
+            self._release_write_lock()
+
+    def _rollback(self):
+        try:
+            return super()._rollback()
+        finally:
+            self._release_write_lock()
+
+    def _close(self):
+        try:
+            return super()._close()
+        finally:
+            self._release_write_lock()
+
+    def _release_write_lock(self):
+        if self._holds_write_lock:
+            self._holds_write_lock = False
+            _held.__dict__.get('aliases', set()).discard(self.alias)
+            _write_locks[str(self.settings_dict['NAME'])].release()
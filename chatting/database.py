@@ -0,0 +1,179 @@
+"""
+The default database of chatting.settings, configured by environment variables.
+
+    CHAT_DB_ENGINE            sqlite (default) or postgresql
+    CHAT_DB_NAME              SQLite file (db.sqlite3 of the project by default) or PostgreSQL database (chat)
+    CHAT_DB_SQLITE_WAL        1 for SQLite tuned for concurrent requests (chatting.backends.sqlite3): WAL,
+                              synchronous=NORMAL, a memory map and transactions taking the write lock up front
+    CHAT_DB_SQLITE_BUSY_TIMEOUT, CHAT_DB_SQLITE_MMAP_SIZE, CHAT_DB_SQLITE_SERIALIZE_WRITES
+                              seconds a write waits for the lock (5), bytes mapped (256MB), 1 or 0 (default) for
+                              transactions also queued per process
+    CHAT_DB_USER, CHAT_DB_PASSWORD, CHAT_DB_HOST, CHAT_DB_PORT
+                              PostgreSQL connection, empty values are left to libpq (and its PG* variables)
+    CHAT_DB_POOL              PostgreSQL connection handling, see POOL_MODES (persistent by default)
+    CHAT_DB_CONN_MAX_AGE      seconds a persistent connection is reused (600), for persistent and pgbouncer
+    CHAT_DB_HEALTH_CHECKS     1 (default) or 0, check a reused connection before the first query of a request
+    CHAT_DB_POOL_MIN_SIZE, CHAT_DB_POOL_MAX_SIZE, CHAT_DB_POOL_TIMEOUT
+                              size of the native pool (2, 20) and seconds to wait for a connection (10)
+    CHAT_DB_REPLICAS          comma separated read replicas of the default database, SQLite files or PostgreSQL
+                              host[:port], with the settings of the default database otherwise
+    CHAT_DB_REPLICA_SELECTION round_robin (default) or least_loaded, see chat/routers.py
+    CHAT_DB_STICKY_SECONDS    seconds a client reads from the default database after a write (5)
+    CHAT_DB_SHARDS            comma separated databases topics are sharded over, SQLite files or PostgreSQL
+                              host[:port][/name], with the settings of the default database otherwise
+    CHAT_DB_SHARD_VIRTUAL_NODES
+                              points of every shard on the consistent hashing ring (64), see chat/sharding.py
+
+POOL_MODES:
+
+* none - a connection per request, closed when the request ends (CONN_MAX_AGE=0),
+* persistent - every worker thread keeps its connection for CONN_MAX_AGE seconds,
+* pgbouncer - persistent connections to a pgbouncer in transaction pooling mode: server-side cursors and
+  prepared statements, which do not survive a change of server connection, are disabled. QuerySet.iterator()
+  (the export endpoint, chat_export) then fetches whole results,
+* native - the connection pool of Django 5.1+ with psycopg 3, shared by the threads of a process.
+
+Health checks (CONN_HEALTH_CHECKS) replace a persistent connection that was closed by the server, a restart or
+pgbouncer before the request uses it, instead of failing the request. /health/ checks the database on demand.
+
+The search backend (CHAT_SEARCH) follows the engine of the default database, see search_from_database().
+
+Replicas are the databases replica1, replica2... mirroring the default database in tests, reads of GET requests
+go to them through chat.routers. Shards are the databases shard1, shard2..., the default database keeps the
+directory of the topics.
+"""
+import importlib.util
+
+import django
+from django.core.exceptions import ImproperlyConfigured
+from django.db import DEFAULT_DB_ALIAS
+
+POOL_MODES = ('none', 'persistent', 'pgbouncer', 'native')
+
+
+def database_from_env(environ, base_dir):
+    """Settings of the default database from environ (os.environ), SQLite files are relative to base_dir"""
+    engine = environ.get('CHAT_DB_ENGINE', 'sqlite')
+    if engine == 'sqlite':
+        database = {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': base_dir / environ.get('CHAT_DB_NAME', 'db.sqlite3'),
+        }
+        if _get_bool(environ, 'CHAT_DB_SQLITE_WAL', False):
+            database['ENGINE'] = 'chatting.backends.sqlite3'
+            database['OPTIONS'] = {
+                'timeout': _get_int(environ, 'CHAT_DB_SQLITE_BUSY_TIMEOUT', 5),
+                'synchronous': 'NORMAL',
+                'mmap_size': _get_int(environ, 'CHAT_DB_SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+                'serialize_writes': _get_bool(environ, 'CHAT_DB_SQLITE_SERIALIZE_WRITES', False),
+            }
+        return database
+    if engine != 'postgresql':
+        raise ImproperlyConfigured(f'CHAT_DB_ENGINE must be sqlite or postgresql, not {engine!r}')
+
+    pool = environ.get('CHAT_DB_POOL', 'persistent')
+    if pool not in POOL_MODES:
+        raise ImproperlyConfigured(f'CHAT_DB_POOL must be one of {", ".join(POOL_MODES)}, not {pool!r}')
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': environ.get('CHAT_DB_NAME', 'chat'),
+        'USER': environ.get('CHAT_DB_USER', ''),
+        'PASSWORD': environ.get('CHAT_DB_PASSWORD', ''),
+        'HOST': environ.get('CHAT_DB_HOST', ''),
+        'PORT': environ.get('CHAT_DB_PORT', ''),
+        'CONN_MAX_AGE': 0,
+        'CONN_HEALTH_CHECKS': _get_bool(environ, 'CHAT_DB_HEALTH_CHECKS', True),
+        'OPTIONS': {},
+    }
+    if pool in ('persistent', 'pgbouncer'):
+        database['CONN_MAX_AGE'] = _get_int(environ, 'CHAT_DB_CONN_MAX_AGE', 600)
+    if pool == 'pgbouncer':
+        database['DISABLE_SERVER_SIDE_CURSORS'] = True
+        if _has_psycopg3():
+            # psycopg 3 prepares statements run several times on the server connection
+            database['OPTIONS']['prepare_threshold'] = None
+    if pool == 'native':
+        if django.VERSION < (5, 1):
+            raise ImproperlyConfigured('CHAT_DB_POOL=native needs Django 5.1 or later, use persistent or pgbouncer')
+        database['OPTIONS']['pool'] = {
+            'min_size': _get_int(environ, 'CHAT_DB_POOL_MIN_SIZE', 2),
+            'max_size': _get_int(environ, 'CHAT_DB_POOL_MAX_SIZE', 20),
+            'timeout': _get_int(environ, 'CHAT_DB_POOL_TIMEOUT', 10),
+        }
+    return database
+
+
+def replicas_from_env(environ, base_dir, default):
+    """Databases of the read replicas of default and CHAT_REPLICAS (None without replicas)"""
+    databases = {f'replica{number}': dict(_database_at(default, location, base_dir), TEST={'MIRROR': DEFAULT_DB_ALIAS})
+                 for number, location in enumerate(_get_list(environ, 'CHAT_DB_REPLICAS'), 1)}
+    if not databases:
+        return databases, None
+    return databases, {
+        'DATABASES': list(databases),
+        'SELECTION': environ.get('CHAT_DB_REPLICA_SELECTION', 'round_robin'),
+        'STICKY_SECONDS': _get_int(environ, 'CHAT_DB_STICKY_SECONDS', 5),
+    }
+
+
+def shards_from_env(environ, base_dir, default):
+    """Databases of the topic shards and CHAT_SHARDS (None without shards)"""
+    databases = {f'shard{number}': _database_at(default, location, base_dir)
+                 for number, location in enumerate(_get_list(environ, 'CHAT_DB_SHARDS'), 1)}
+    if not databases:
+        return databases, None
+    return databases, {
+        'DATABASES': list(databases),
+        'VIRTUAL_NODES': _get_int(environ, 'CHAT_DB_SHARD_VIRTUAL_NODES', 64),
+    }
+
+
+def search_from_database(database):
+    """CHAT_SEARCH of the full-text index that migration 0006 creates on database, ContainsSearch for other engines"""
+    if database['ENGINE'] == 'django.db.backends.postgresql':
+        return {'BACKEND': 'chat.search.PostgreSQLFullTextSearch'}
+    if database['ENGINE'] in ('django.db.backends.sqlite3', 'chatting.backends.sqlite3'):
+        return {'BACKEND': 'chat.search.SQLiteFullTextSearch'}
+    return {'BACKEND': 'chat.search.ContainsSearch'}
+
+
+def _database_at(default, location, base_dir):
+    """default at location, a SQLite file or PostgreSQL host[:port][/name]"""
+    database = dict(default)
+    if default['ENGINE'] == 'django.db.backends.postgresql':
+        address, _, name = location.partition('/')
+        database['HOST'], _, port = address.partition(':')
+        database['PORT'] = port or default['PORT']
+        database['NAME'] = name or default['NAME']
+    else:
+        database['NAME'] = base_dir / location
+    return database
+
+
+def _get_int(environ, name, default):
+    value = environ.get(name)
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ImproperlyConfigured(f'{name} must be an integer, not {value!r}')
+
+
+def _get_list(environ, name):
+    return [value.strip() for value in environ.get(name, '').split(',') if value.strip()]
+
+
+def _get_bool(environ, name, default):
+    value = environ.get(name)
+    if value is None:
+        return default
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ImproperlyConfigured(f'{name} must be 1 or 0, not {value!r}')
+
+
+def _has_psycopg3():
+    return importlib.util.find_spec('psycopg') is not None
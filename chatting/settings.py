@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from .database import database_from_env, replicas_from_env, search_from_database, shards_from_env
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve(strict=True).parent.parent
 
@@ -42,6 +45,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first, so its timings cover the other middleware, does nothing unless CHAT_METRICS is set
+    'chat.metrics.MetricsMiddleware',
+    # does nothing unless CHAT_REPLICAS is set
+    'chat.routers.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -73,17 +80,105 @@ WSGI_APPLICATION = 'chatting.wsgi.application'
 
 REST_FRAMEWORK = {
     'DATETIME_FORMAT': "%Y-%m-%d %H:%M:%S",
+    # JSONRenderer output written with orjson when it is installed, see chat/renderers.py
+    'DEFAULT_RENDERER_CLASSES': [
+        'chat.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'chat.pagination.KeysetCursorPagination',
+    'PAGE_SIZE': 100,
+    # token buckets per client and per topic (message writes), see chat/throttling.py. Rates like '20/s' or
+    # '600/min', None disables a throttle
+    'DEFAULT_THROTTLE_CLASSES': [
+        'chat.throttling.ClientRateThrottle',
+        'chat.throttling.TopicRateThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'client': None,
+        'topic': None,
+    },
+}
+
+# Broadcast layer for the WebSocket endpoint, see chat/broadcast.py. With several ASGI workers on one host use
+# 'chat.broadcast.LocalSocketBroadcast' with OPTIONS {'path': <directory shared by the workers>}
+CHAT_BROADCAST = {
+    'BACKEND': 'chat.broadcast.InMemoryBroadcast',
+    'OPTIONS': {
+        'max_queue': 100,
+    },
+}
+
+# Buckets of the throttles, chat.throttling.LocalMemoryStore per process. With several workers on one host use
+# 'chat.throttling.SharedMemoryStore' with OPTIONS {'path': <file shared by the workers>}
+CHAT_THROTTLE_STORE = {
+    'BACKEND': 'chat.throttling.LocalMemoryStore',
+    'OPTIONS': {
+        'max_entries': 100000,
+    },
+}
+
+# Caches, 'chat' holds responses of topic and message reads, see chat/cache.py
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'chat': {
+        'BACKEND': 'chat.cache.LRULocMemCache',
+        'LOCATION': 'chat-responses',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
 }
+
+# alias of the cache used for responses, None disables response caching. Writes invalidate cached responses in
+# that cache only, with several worker processes it has to be shared by all of them (Redis, Memcached): 'chat' is
+# the memory of one process, for a single worker
+CHAT_RESPONSE_CACHE = None
+
+# Request metrics, see chat/metrics.py: Server-Timing headers and Prometheus text on /metrics for ALLOWED_IPS.
+# None disables them, enable with e.g. {'SERVER_TIMING': True, 'ALLOWED_IPS': ['127.0.0.1', '::1']}
+CHAT_METRICS = None
+
+# Cold storage of messages older than AGE_DAYS in compressed segment files, see chat/archive.py. None disables it,
+# enable with e.g. {'DIRECTORY': BASE_DIR / 'archive', 'AGE_DAYS': 30} and run manage.py archive_messages regularly
+CHAT_ARCHIVE = None
+
+# Message creates inserted in batches by a writer thread, one commit per batch, see chat/ingest.py. None disables
+# it, enable with e.g. {'MAX_BATCH': 256, 'MAX_DELAY_MS': 2}
+CHAT_INGEST = None
+
+# Tombstones of deleted messages older than this many days are deleted by manage.py prune_tombstones, see
+# chat/tombstones.py. Changes feed tokens from before them get 410. None keeps them
+CHAT_TOMBSTONE_RETENTION_DAYS = 30
+
+# HTTP requests of ASGI routed to the async views of chat/async_views.py (chatting.urls_async). Off by default, in
+# benchmarks/async_views.py they serve fewer requests than the sync views and with a higher p99
+CHAT_ASYNC_VIEWS = False
+
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
+# SQLite in db.sqlite3 unless CHAT_DB_ENGINE=postgresql, connection pooling is set with CHAT_DB_POOL, see
+# chatting/database.py
 
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_from_env(os.environ, BASE_DIR),
 }
 
+# read replicas from CHAT_DB_REPLICAS, CHAT_REPLICAS is None without them, see chat/routers.py
+replicas, CHAT_REPLICAS = replicas_from_env(os.environ, BASE_DIR, DATABASES['default'])
+DATABASES.update(replicas)
+# topics sharded over the CHAT_DB_SHARDS databases, CHAT_SHARDS is None without them, see chat/sharding.py
+shards, CHAT_SHARDS = shards_from_env(os.environ, BASE_DIR, DATABASES['default'])
+DATABASES.update(shards)
+DATABASE_ROUTERS = ['chat.routers.ShardRouter', 'chat.routers.ReplicaRouter']
+
+# Full-text search of messages, see chat/search.py. chat.search.SQLiteFullTextSearch / PostgreSQLFullTextSearch
+# need the index of migration 0006 on that database, chat.search.ContainsSearch works everywhere without an index.
+# The index of the engine of the default database by default
+CHAT_SEARCH = search_from_database(DATABASES['default'])
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -0,0 +1,36 @@
+"""
+Settings of the API-only deployment, select them with DJANGO_SETTINGS_MODULE=chatting.settings_api.
+
+The settings of chatting.settings without what only browsers use: no admin, sessions, messages, CSRF or
+clickjacking middleware, no templates and no browsable API, responses are JSON only. Authentication is stateless,
+requests carry no session and request.user is None; the API has no permissions, so nothing needs a user. Without
+django.contrib.admin chatting.urls leaves out /admin/.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import REST_FRAMEWORK
+
+INSTALLED_APPS = [
+    'chat',
+    'rest_framework',
+]
+
+MIDDLEWARE = [
+    'chat.metrics.MetricsMiddleware',
+    'chat.routers.ReplicaMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    # redirects /topics to /topics/
+    'django.middleware.common.CommonMiddleware',
+]
+
+TEMPLATES = []
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    'DEFAULT_RENDERER_CLASSES': [
+        'chat.renderers.FastJSONRenderer',
+    ],
+    'DEFAULT_AUTHENTICATION_CLASSES': [],
+    'DEFAULT_PERMISSION_CLASSES': [],
+    # AnonymousUser would need django.contrib.auth
+    'UNAUTHENTICATED_USER': None,
+}
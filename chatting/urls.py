@@ -13,10 +13,12 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.apps import apps
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework import routers
 
+from chat import metrics as chat_metrics
 from chat import views as chat_views
 
 router = routers.DefaultRouter()
@@ -27,6 +29,20 @@ message_from_topic_list = chat_views.MessageFromTopicViewSet.as_view({
     'get': 'list',
     'post': 'create'
 })
+message_from_topic_changes = chat_views.MessageFromTopicViewSet.as_view({
+    'get': 'changes'
+})
+message_from_topic_search = chat_views.MessageFromTopicViewSet.as_view({
+    'get': 'search'
+})
+message_from_topic_export = chat_views.MessageFromTopicViewSet.as_view({
+    'get': 'export'
+})
+message_from_topic_bulk = chat_views.MessageFromTopicViewSet.as_view({
+    'post': 'bulk_create',
+    'patch': 'bulk_update',
+    'delete': 'bulk_destroy'
+})
 message_from_topic_detail = chat_views.MessageFromTopicViewSet.as_view({
     'get': 'retrieve',
     'put': 'update',
@@ -35,9 +51,19 @@ message_from_topic_detail = chat_views.MessageFromTopicViewSet.as_view({
 })
 
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('', include(router.urls)),
     path('topics/<int:topic_id>/messages/', message_from_topic_list, name='message-from-topic-list'),
+    path('topics/<int:topic_id>/messages/bulk/', message_from_topic_bulk, name='message-from-topic-bulk'),
+    path('stats/cache/', chat_views.response_cache_stats, name='response-cache-stats'),
+    path('metrics', chat_metrics.metrics, name='metrics'),
+    path('health/', chat_views.health, name='health'),
+    path('topics/<int:topic_id>/messages/changes/', message_from_topic_changes, name='message-from-topic-changes'),
+    path('topics/<int:topic_id>/messages/search/', message_from_topic_search, name='message-from-topic-search'),
+    path('topics/<int:topic_id>/messages/export/', message_from_topic_export, name='message-from-topic-export'),
     path('topics/<int:topic_id>/messages/<int:msg_id>/', message_from_topic_detail, name='message-from-topic-detail'),
 
 ]
+
+# the API-only settings (chatting.settings_api) leave the admin out
+if apps.is_installed('django.contrib.admin'):
+    urlpatterns.insert(0, path('admin/', admin.site.urls))
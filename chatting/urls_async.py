@@ -0,0 +1,8 @@
+"""
+URL configuration of requests served through ASGI (see chatting.asgi), the routes and names of chatting.urls with
+async views for list, retrieve and create of topics and messages.
+"""
+from chat.async_views import async_urlpatterns
+from chatting.urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = async_urlpatterns(sync_urlpatterns)